@@ -0,0 +1,100 @@
+"""
+下载路径的基准测试，从本地服务器下载数据，比较不同读取块大小和写入方式每MB消耗的CPU时间
+    python benchmarks/bench_download.py [--size-mb N] [--repeat N]
+结果以json格式输出到标准输出
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vchat import fileio  # noqa: E402
+from vchat.net.writer import (  # noqa: E402
+    BufferWriter,
+    FileWriter,
+    stream_response,
+)
+
+
+async def legacy_to_memory(resp, chunk_size):
+    # 优化之前的实现
+    with io.BytesIO() as output:
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            output.write(chunk)
+        return output.getvalue()
+
+
+async def buffer_to_memory(resp, chunk_size):
+    writer = BufferWriter()
+    await stream_response(resp, writer, chunk_size)
+    return writer.getvalue()
+
+
+async def file_to_disk(resp, chunk_size):
+    with tempfile.TemporaryFile() as f:
+        await stream_response(resp, FileWriter(f), chunk_size)
+
+
+async def bench(size_mb: int, repeat: int) -> list[dict]:
+    body = os.urandom(size_mb * 1024 * 1024)
+
+    async def handler(request):
+        return web.Response(body=body)
+
+    app = web.Application()
+    app.router.add_get("/media", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    url = f"http://127.0.0.1:{port}/media"
+
+    results = []
+    async with ClientSession() as session:
+        for name, fn in (
+            ("bytesio", legacy_to_memory),
+            ("buffer", buffer_to_memory),
+            ("file", file_to_disk),
+        ):
+            for chunk_size in (1024, 64 * 1024, 256 * 1024):
+                cpu = []
+                for _ in range(repeat):
+                    start = time.process_time()
+                    async with session.get(url) as resp:
+                        await fn(resp, chunk_size)
+                    cpu.append(time.process_time() - start)
+                results.append(
+                    {
+                        "writer": name,
+                        "chunk_size": chunk_size,
+                        "size_mb": size_mb,
+                        "cpu_seconds_per_mb": min(cpu) / size_mb,
+                    }
+                )
+    await runner.cleanup()
+    fileio.get_executor().shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    json.dump(asyncio.run(bench(args.size_mb, args.repeat)), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+接收、解析、分发消息的热点路径的基准测试，使用合成的数据，不需要网络
+    python benchmarks/bench_hotpath.py [--number N] [--filter NAME] [--compare OLD.json] > NEW.json
+覆盖utils.msg_formatter、各类型消息的Content解析、RawMessage和Contact/Chatroom的构造、
+_produce_msg处理一批同步消息、注册N个处理函数时的分发、大量联系人时的search_contact
+结果以json格式输出到标准输出，包含版本信息；--compare指定旧版本的结果时，每项结果附带旧的耗时和变化比例
+"""
+
+import argparse
+import asyncio
+import copy
+import importlib.metadata
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import yarl
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from payloads import make_contact, make_member, make_raw_message  # noqa: E402
+from vchat import Core, utils  # noqa: E402
+from vchat.model import (  # noqa: E402
+    Chatroom,
+    Contact,
+    ContactTypes,
+    Content,
+    ContentTypes,
+    RawMessage,
+    User,
+)
+
+LOGIN_URL = "https://wx.qq.com/cgi-bin/mmwebwx-bin"
+
+# 消息类型 -> (MsgType, AppMsgType, Content)
+MESSAGE_KINDS: dict[str, tuple[int, int, str]] = {
+    "text": (1, 0, "你好，hello " * 10),
+    "image": (3, 0, '<?xml version="1.0"?><msg><img length="102400" /></msg>'),
+    "voice": (34, 0, '<msg><voicemsg length="4000" voicelength="3000" /></msg>'),
+    "video": (43, 0, '<?xml version="1.0"?><msg><videomsg length="2048000" /></msg>'),
+    "attach": (
+        49,
+        6,
+        "<msg><appmsg appid='' sdkver=''><title>report.pdf</title><type>6</type>"
+        "<appattach><totallen>1048576</totallen><attachid>@cdn_1</attachid>"
+        "<fileext>pdf</fileext></appattach></appmsg></msg>",
+    ),
+    "link": (
+        49,
+        5,
+        "<msg><appmsg appid='' sdkver='0'><title>标题</title><des>描述</des>"
+        "<type>5</type><url>https://example.com/a</url>"
+        "<sourcedisplayname>公众号</sourcedisplayname></appmsg></msg>",
+    ),
+    "transfer": (
+        49,
+        2000,
+        "<msg><appmsg><des><![CDATA[收到转账]]></des>"
+        "<wcpayinfo><pay_memo><![CDATA[转账0.01元。]]></pay_memo></wcpayinfo>"
+        "</appmsg></msg>",
+    ),
+    "system": (10000, 0, "你已添加了张三，现在可以开始聊天了。"),
+    "revoke": (
+        10002,
+        0,
+        '<sysmsg type="revokemsg"><revokemsg><session>@abc</session>'
+        "<oldmsgid>1</oldmsgid><msgid>1234567890</msgid>"
+        "<replacemsg><![CDATA[张三撤回了一条消息]]></replacemsg></revokemsg></sysmsg>",
+    ),
+}
+
+EMOJI_TEXT = (
+    '早上好<span class="emoji emoji1f602"></span>&lt;测试&gt;<br/>'
+    '第二行<span class="emoji emoji1f450"></span>&amp;'
+) * 5
+
+
+def make_message(kind: str, from_username: str, to_username: str) -> dict:
+    msg_type, app_msg_type, content = MESSAGE_KINDS[kind]
+    msg = make_raw_message(from_username, to_username, msg_type, content, app_msg_type)
+    msg["MediaId"] = "@crypt_media"
+    msg["FileName"] = "report.pdf"
+    return msg
+
+
+async def make_core(friend_count: int, chatroom_count: int, member_count: int) -> Core:
+    """
+    构造已经登录并加载了联系人的Core，不发出任何请求
+    """
+    core = Core()
+    await core.init()
+    net_helper = core._net_helper
+    net_helper.login_info.url = LOGIN_URL
+    net_helper.login_info.skey = "@crypt_skey"
+    net_helper.login_info.wxuin = "1234567890"
+    net_helper.session.cookie_jar.update_cookies(
+        {"webwx_data_ticket": "ticket"}, yarl.URL(LOGIN_URL)
+    )
+    me_dict = make_contact()
+    me = User(**me_dict)
+    net_helper.login_info.user = me
+    core._storage.myname = me.username
+    core._storage.nick_name = me["NickName"]
+    core._storage.members[me.username] = me
+    for _ in range(friend_count):
+        friend = User(**make_contact())
+        core._storage.members[friend.username] = friend
+    for _ in range(chatroom_count):
+        data = make_contact(chatroom=True, member_count=member_count)
+        member = make_member()
+        member["UserName"] = me.username
+        data["MemberList"].append(member)
+        chatroom = Chatroom(**data)
+        core._storage.chatrooms[chatroom.username] = chatroom
+    return core
+
+
+def make_sync_batch(core: Core, size: int, chatroom_ratio: float = 0.5) -> list[dict]:
+    myname = core._storage.myname
+    friends = [u for u in core._storage.members if u != myname]
+    chatrooms = list(core._storage.chatrooms.values())
+    kinds = ["text"] * 6 + ["image", "voice", "attach", "system"]
+    batch = []
+    for _ in range(size):
+        kind = random.choice(kinds)
+        if chatrooms and random.random() < chatroom_ratio:
+            chatroom = random.choice(chatrooms)
+            sender = random.choice(list(chatroom.members))
+            msg = make_message(kind, chatroom.username, myname)
+            msg["Content"] = f"{sender}:<br/>{msg['Content']}"
+        else:
+            msg = make_message(kind, random.choice(friends), myname)
+        batch.append(msg)
+    return batch
+
+
+async def measure(
+    fn: Callable[[], Awaitable | None], number: int, repeat: int = 5
+) -> float:
+    """
+    返回repeat轮中最快的一轮里每次调用的平均耗时（秒），fn可以是同步函数或者协程函数
+    """
+    is_async = asyncio.iscoroutinefunction(fn)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if is_async:
+            for _ in range(number):
+                await fn()
+        else:
+            for _ in range(number):
+                fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+async def bench(number: int, name_filter: str | None) -> list[dict]:
+    random.seed(0)
+    results: list[dict] = []
+
+    async def run(name: str, fn, n: int = number, per: int = 1, **params) -> None:
+        """
+        per是每次调用处理的条目数，结果中的seconds是每个条目的耗时
+        """
+        if name_filter is not None and name_filter not in name:
+            return
+        seconds = await measure(fn, max(1, n)) / per
+        results.append(
+            {
+                "name": name,
+                "params": params,
+                "seconds": seconds,
+                "ops_per_second": 1 / seconds if seconds else None,
+            }
+        )
+
+    core = await make_core(friend_count=2000, chatroom_count=50, member_count=200)
+    net_helper = core._net_helper
+    myname = core._storage.myname
+    friend = next(u for u in core._storage.members if u != myname)
+
+    await run("msg_formatter", lambda: utils.msg_formatter(EMOJI_TEXT), number * 10)
+
+    for kind in MESSAGE_KINDS:
+        raw = make_message(kind, friend, myname)
+        rmsg = RawMessage(**raw)
+        await run(
+            "build_content",
+            lambda: Content.build_from_content_trimmed_raw_message(
+                rmsg, net_helper, None
+            ),
+            number * 10,
+            kind=kind,
+        )
+
+    raw = make_message("text", friend, myname)
+    await run("raw_message", lambda: RawMessage(**raw), number * 10)
+
+    for member_count in (0, 500):
+        data = make_contact(chatroom=member_count > 0, member_count=member_count)
+        await run(
+            "contact_constructor",
+            lambda: Contact.constructor(data),
+            number * 10 if member_count == 0 else number,
+            member_count=member_count,
+        )
+
+    for batch_size in (1, 100):
+        batch = make_sync_batch(core, batch_size)
+
+        async def produce():
+            # _produce_msg会修改RawMessage，每次都从原始的dict构造，和真实的接收路径相同
+            rmsgs = [RawMessage(**copy.copy(m)) for m in batch]
+            async for _ in core._produce_msg(rmsgs):
+                pass
+
+        await run(
+            "produce_msg",
+            produce,
+            max(1, number * 10 // batch_size),
+            batch_size,
+            batch_size=batch_size,
+        )
+
+    for handler_count in (1, 10, 100):
+        core._function_dict = {t: [] for t in core._function_dict}
+        for _ in range(handler_count):
+
+            async def handler(msg):
+                pass
+
+            core.msg_register(ContentTypes.TEXT, ContactTypes.USER)(handler)
+        msgs = [
+            m
+            async for m in core._produce_msg(
+                [RawMessage(**make_message("text", friend, myname))]
+            )
+        ]
+
+        async def dispatch():
+            await core._storage.msgs.put(msgs[0])
+            await core._configured_reply()
+
+        await run("dispatch", dispatch, number * 10, handler_count=handler_count)
+
+    for contact_count in (1000, 20000):
+        search_core = await make_core(contact_count, 0, 0)
+        await run(
+            "search_contact",
+            lambda: search_core.search_friends_by_nickname("测试"),
+            max(1, number * 1000 // contact_count),
+            contact_count=contact_count,
+        )
+        await search_core._net_helper.close()
+
+    await net_helper.close()
+    return results
+
+
+def metadata() -> dict:
+    try:
+        version = importlib.metadata.version("vchat")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "vchat_version": version,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": int(time.time()),
+    }
+
+
+def compare(results: list[dict], baseline: dict) -> None:
+    """
+    为每项结果附带旧版本的耗时，change > 1表示变慢
+    """
+    old = {
+        (r["name"], json.dumps(r["params"], sort_keys=True)): r["seconds"]
+        for r in baseline["results"]
+    }
+    for r in results:
+        seconds = old.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        r["baseline_seconds"] = seconds
+        r["change"] = r["seconds"] / seconds if seconds else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100)
+    parser.add_argument("--filter", default=None, help="只运行名称包含FILTER的测试")
+    parser.add_argument("--compare", type=Path, default=None)
+    args = parser.parse_args()
+    results = asyncio.run(bench(args.number, args.filter))
+    if args.compare is not None:
+        compare(results, json.loads(args.compare.read_text()))
+    json.dump({"meta": metadata(), "results": results}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+json编解码器的基准测试，比较stdlib、orjson、msgspec解析和序列化服务器响应的耗时
+    python benchmarks/bench_json.py [--payload-dir DIR] [--number N]
+DIR中的*.json文件是录制的服务器响应体（例如webwxsync、webwxgetcontact），没有提供时使用合成的响应
+结果以json格式输出到标准输出
+"""
+
+import argparse
+import importlib.util
+import json
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from payloads import make_contact_response, make_sync_response  # noqa: E402
+from vchat.net.codec import JsonCodec, get_codec  # noqa: E402
+
+
+def load_payloads(payload_dir: Path | None) -> dict[str, bytes]:
+    if payload_dir is not None:
+        return {
+            path.name: path.read_bytes() for path in sorted(payload_dir.glob("*.json"))
+        }
+    random.seed(0)
+    return {
+        "webwxsync_100msgs": json.dumps(
+            make_sync_response(100), ensure_ascii=False
+        ).encode(),
+        "webwxgetcontact_2000": json.dumps(
+            make_contact_response(), ensure_ascii=False
+        ).encode(),
+    }
+
+
+def available_codecs() -> list[JsonCodec]:
+    return [
+        get_codec(name)
+        for name in ("stdlib", "orjson", "msgspec")
+        if name == "stdlib" or importlib.util.find_spec(name) is not None
+    ]
+
+
+def bench(payloads: dict[str, bytes], number: int) -> list[dict]:
+    results = []
+    for payload_name, raw in payloads.items():
+        obj = json.loads(raw)
+        for codec in available_codecs():
+            for op, fn in (
+                ("loads", lambda: codec.loads(raw)),
+                ("dumps", lambda: codec.dumps(obj)),
+            ):
+                best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+                results.append(
+                    {
+                        "payload": payload_name,
+                        "size": len(raw),
+                        "codec": codec.name,
+                        "op": op,
+                        "seconds": best,
+                        "mb_per_second": len(raw) / best / 1e6,
+                    }
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payload-dir", type=Path, default=None)
+    parser.add_argument("--number", type=int, default=10)
+    args = parser.parse_args()
+    json.dump(bench(load_payloads(args.payload_dir), args.number), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
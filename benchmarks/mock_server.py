@@ -0,0 +1,514 @@
+"""
+本地的模拟微信网页版服务器，用于没有真实帐号时的压力测试和集成测试
+    python benchmarks/mock_server.py [--port N] [--msg-rate N] [--latency MIN MAX] [--error-rate P]
+实现了VChat使用的接口：jslogin、login、webwxinit、synccheck、webwxsync、webwxgetcontact、
+webwxbatchgetcontact、webwxsendmsg等发送接口、webwxuploadmedia、媒体下载接口和webwxrevokemsg
+扫码立即成功（或者等待scan_delay秒），之后按照msg_rate的速率产生好友消息和群聊消息
+
+在代码中使用：
+    server = MockWeChatServer(MockOptions(msg_rate=100))
+    await server.start()
+    config.BASE_URL = server.base_url
+    core = Core()
+    await core.init()
+    await core.auto_login(hot_reload=False, qr_callback=..., login_callback=...)
+服务器默认使用localhost，cookie可以正常保存；使用IP地址时需要设置config.COOKIE_JAR_UNSAFE = True
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from payloads import (  # noqa: E402
+    make_contact,
+    make_member,
+    make_raw_message,
+    make_sync_key,
+)
+
+OK = {"Ret": 0, "ErrMsg": ""}
+CGI = "/cgi-bin/mmwebwx-bin"
+# 返回数据的接口 -> 数据大小相对于media_size的比例
+MEDIA_ENDPOINTS = {
+    "webwxgetmsgimg": 1,
+    "webwxgetvoice": 1,
+    "webwxgetvideo": 16,
+    "webwxgetmedia": 4,
+    "webwxgeticon": 0.0625,
+    "webwxgetheadimg": 0.0625,
+}
+SEND_ENDPOINTS = (
+    "webwxsendmsg",
+    "webwxsendmsgimg",
+    "webwxsendappmsg",
+    "webwxsendvideomsg",
+    "webwxsendemoticon",
+)
+# 只需要返回成功的接口
+NOOP_ENDPOINTS = (
+    "webwxstatusnotify",
+    "webwxoplog",
+    "webwxverifyuser",
+    "webwxupdatechatroom",
+)
+
+
+@dataclass
+class MockOptions:
+    """
+    latency: 每个请求额外等待的时间范围（秒）
+    error_rate: 每个请求返回error_status的概率，endpoint_error_rates可以为单个接口设置不同的概率
+    msg_rate: 每秒产生的消息数，chatroom_ratio是其中群聊消息的比例，image_ratio是其中图片消息的比例
+    scan_delay: 获取二维码后经过多少秒扫码成功
+    synccheck_hold: 没有新消息时synccheck最多等待的时间（秒），真实服务器约为25秒
+    """
+
+    latency: tuple[float, float] = (0.0, 0.0)
+    error_rate: float = 0.0
+    endpoint_error_rates: dict[str, float] = field(default_factory=dict)
+    error_status: int = 500
+    msg_rate: float = 1.0
+    chatroom_ratio: float = 0.5
+    image_ratio: float = 0.0
+    max_batch: int = 100
+    contact_count: int = 200
+    chatroom_count: int = 10
+    member_count: int = 50
+    media_size: int = 64 * 1024
+    scan_delay: float = 0.0
+    synccheck_hold: float = 25.0
+    seed: int | None = 0
+
+
+class MockWeChatServer:
+    """
+    requests记录每个接口收到的请求数，sent_msgs记录收到的发送请求中的Msg，
+    uploads记录上传完成的文件大小，revoked记录撤回的消息id，测试可以据此检查VChat的行为
+    """
+
+    def __init__(
+        self,
+        options: MockOptions | None = None,
+        host: str = "localhost",
+        port: int = 0,
+    ) -> None:
+        self.options = options or MockOptions()
+        self.host = host
+        self.port = port
+        self.requests: Counter[str] = Counter()
+        self.sent_msgs: list[dict] = []
+        self.uploads: dict[str, int] = {}
+        self.revoked: list[str] = []
+        self.generated_msgs = 0
+        self._runner: web.AppRunner | None = None
+        # 不修改全局的random，避免影响同一个进程中的其他代码
+        self._random = random.Random(self.options.seed)
+        self._init_contacts()
+        self._uuids: dict[str, float] = {}  # uuid -> 扫码成功的时间
+        self.wxuin = str(self._random.randint(10**9, 10**10))
+        self.wxsid = uuid.uuid4().hex[:16]
+        self.skey = "@crypt_" + uuid.uuid4().hex[:8]
+        self.pass_ticket = uuid.uuid4().hex
+        self.data_ticket = uuid.uuid4().hex
+        self._sync_key = make_sync_key()
+        self._pending = 0.0  # 已经产生但还没有被webwxsync取走的消息数
+        self._last_tick = time.monotonic()
+        self._media = bytes(self._random.getrandbits(8) for _ in range(256))
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> str:
+        app = web.Application(middlewares=[self._middleware], client_max_size=2**30)
+        app.router.add_get("/", self._index)
+        app.router.add_get("/jslogin", self._jslogin)
+        app.router.add_get(f"{CGI}/login", self._login)
+        app.router.add_get(f"{CGI}/webwxnewloginpage", self._new_login_page)
+        app.router.add_get(f"{CGI}/webwxpushloginurl", self._push_login)
+        app.router.add_post(f"{CGI}/webwxinit", self._webwxinit)
+        app.router.add_get(f"{CGI}/synccheck", self._synccheck)
+        app.router.add_post(f"{CGI}/webwxsync", self._webwxsync)
+        app.router.add_get(f"{CGI}/webwxgetcontact", self._get_contact)
+        app.router.add_post(f"{CGI}/webwxbatchgetcontact", self._batch_get_contact)
+        app.router.add_post(f"{CGI}/webwxuploadmedia", self._upload_media)
+        app.router.add_post(f"{CGI}/webwxrevokemsg", self._revoke)
+        app.router.add_post(f"{CGI}/webwxcreatechatroom", self._create_chatroom)
+        app.router.add_get(f"{CGI}/webwxlogout", self._logout)
+        for endpoint in SEND_ENDPOINTS:
+            app.router.add_post(f"{CGI}/{endpoint}", self._send)
+        for endpoint in NOOP_ENDPOINTS:
+            app.router.add_post(f"{CGI}/{endpoint}", self._noop)
+        for endpoint in MEDIA_ENDPOINTS:
+            app.router.add_get(f"{CGI}/{endpoint}", self._media_get)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        # localhost可能同时解析为IPv4和IPv6，只监听IPv4，否则端口为0时两者的端口不同
+        bind = "127.0.0.1" if self.host == "localhost" else self.host
+        site = web.TCPSite(self._runner, bind, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _init_contacts(self) -> None:
+        options = self.options
+        self.me = make_contact(rng=self._random)
+        self.me["NickName"] = "mock"
+        self.friends = [
+            make_contact(rng=self._random) for _ in range(options.contact_count)
+        ]
+        self.chatrooms = []
+        for _ in range(options.chatroom_count):
+            chatroom = make_contact(
+                chatroom=True, member_count=options.member_count, rng=self._random
+            )
+            me = make_member(self._random)
+            me["UserName"] = self.me["UserName"]
+            chatroom["MemberList"].append(me)
+            chatroom["MemberCount"] += 1
+            self.chatrooms.append(chatroom)
+        self.contacts = {c["UserName"]: c for c in self.friends + self.chatrooms}
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        endpoint = request.path.rstrip("/").rsplit("/", 1)[-1] or "/"
+        self.requests[endpoint] += 1
+        low, high = self.options.latency
+        if high > 0:
+            await asyncio.sleep(self._random.uniform(low, high))
+        error_rate = self.options.endpoint_error_rates.get(
+            endpoint, self.options.error_rate
+        )
+        if error_rate and self._random.random() < error_rate:
+            return web.Response(status=self.options.error_status, text="mock error")
+        return await handler(request)
+
+    async def _index(self, request: web.Request) -> web.Response:
+        return web.Response(text="mock wechat")
+
+    async def _jslogin(self, request: web.Request) -> web.Response:
+        qr_uuid = uuid.uuid4().hex[:12]
+        self._uuids[qr_uuid] = time.monotonic() + self.options.scan_delay
+        return web.Response(
+            text=f'window.QRLogin.code = 200; window.QRLogin.uuid = "{qr_uuid}";'
+        )
+
+    async def _login(self, request: web.Request) -> web.Response:
+        qr_uuid = request.query.get("uuid", "")
+        if qr_uuid not in self._uuids:
+            return web.Response(text="window.code=400;")
+        remaining = self._uuids[qr_uuid] - time.monotonic()
+        if remaining > 0:
+            # 和真实服务器一样长轮询，超时返回408
+            await asyncio.sleep(min(remaining, self.options.synccheck_hold))
+            if self._uuids[qr_uuid] > time.monotonic():
+                return web.Response(text="window.code=408;")
+        del self._uuids[qr_uuid]
+        redirect = (
+            f"{self.base_url}{CGI}/webwxnewloginpage"
+            f"?ticket={uuid.uuid4().hex}&uuid={qr_uuid}&lang=zh_CN&scan={int(time.time())}"
+        )
+        return web.Response(text=f'window.code=200;\nwindow.redirect_uri="{redirect}";')
+
+    async def _new_login_page(self, request: web.Request) -> web.Response:
+        resp = web.Response(
+            text=(
+                "<error><ret>0</ret><message></message>"
+                f"<skey>{self.skey}</skey><wxsid>{self.wxsid}</wxsid>"
+                f"<wxuin>{self.wxuin}</wxuin><pass_ticket>{self.pass_ticket}</pass_ticket>"
+                "<isgrayscale>1</isgrayscale></error>"
+            ),
+            content_type="text/plain",
+        )
+        resp.set_cookie("wxsid", self.wxsid, path="/")
+        resp.set_cookie("wxuin", self.wxuin, path="/")
+        resp.set_cookie("webwx_data_ticket", self.data_ticket, path="/")
+        return resp
+
+    async def _push_login(self, request: web.Request) -> web.Response:
+        if request.query.get("uin") != self.wxuin:
+            return web.json_response({"ret": "1", "msg": "unknown uin"})
+        qr_uuid = uuid.uuid4().hex[:12]
+        self._uuids[qr_uuid] = time.monotonic() + self.options.scan_delay
+        return web.json_response({"ret": "0", "msg": "all ok", "uuid": qr_uuid})
+
+    async def _webwxinit(self, request: web.Request) -> web.Response:
+        if not self._authorized(await request.json()):
+            return web.json_response({"BaseResponse": {"Ret": 1100, "ErrMsg": ""}})
+        contacts = self.chatrooms[:10]
+        return web.json_response(
+            {
+                "BaseResponse": OK,
+                "Count": len(contacts),
+                "ContactList": contacts,
+                "SyncKey": self._sync_key,
+                "User": self.me,
+                "ChatSet": ",".join(c["UserName"] for c in contacts),
+                "SKey": self.skey,
+                "ClientVersion": 0,
+                "SystemTime": int(time.time()),
+                "GrayScale": 1,
+                "InviteStartCount": 40,
+                "MPSubscribeMsgCount": 0,
+                "MPSubscribeMsgList": [],
+                "ClickReportInterval": 600000,
+            }
+        )
+
+    async def _synccheck(self, request: web.Request) -> web.Response:
+        if request.query.get("sid") != self.wxsid:
+            return self._synccheck_result("1101", "0")
+        deadline = time.monotonic() + self.options.synccheck_hold
+        while self._tick() < 1:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return self._synccheck_result("0", "0")
+            if self.options.msg_rate > 0:
+                next_msg = (1 - self._pending) / self.options.msg_rate
+                remaining = min(remaining, next_msg)
+            await asyncio.sleep(remaining)
+        return self._synccheck_result("0", "2")
+
+    async def _webwxsync(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not self._authorized(body) or request.query.get("sid") != self.wxsid:
+            return web.json_response({"BaseResponse": {"Ret": 1101, "ErrMsg": ""}})
+        count = min(int(self._tick()), self.options.max_batch)
+        self._pending -= count
+        msgs = [self._make_msg() for _ in range(count)]
+        self.generated_msgs += count
+        for item in self._sync_key["List"]:
+            item["Val"] += 1
+        return web.json_response(
+            {
+                "BaseResponse": OK,
+                "AddMsgCount": count,
+                "AddMsgList": msgs,
+                "ModContactCount": 0,
+                "ModContactList": [],
+                "DelContactCount": 0,
+                "DelContactList": [],
+                "ModChatRoomMemberCount": 0,
+                "ModChatRoomMemberList": [],
+                "Profile": {},
+                "ContinueFlag": 0,
+                "SyncKey": self._sync_key,
+                "SKey": self.skey,
+                "SyncCheckKey": self._sync_key,
+            }
+        )
+
+    async def _get_contact(self, request: web.Request) -> web.Response:
+        if request.query.get("skey") != self.skey:
+            return web.json_response({"BaseResponse": {"Ret": 1101, "ErrMsg": ""}})
+        member_list = self.friends + self.chatrooms
+        return web.json_response(
+            {
+                "BaseResponse": OK,
+                "MemberCount": len(member_list),
+                "MemberList": member_list,
+                "Seq": 0,
+            }
+        )
+
+    async def _batch_get_contact(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        contacts = []
+        for item in body.get("List", []):
+            contact = self.contacts.get(item["UserName"])
+            if contact is None:
+                contact = make_contact(
+                    chatroom=item["UserName"].startswith("@@"), rng=self._random
+                )
+                contact["UserName"] = item["UserName"]
+            contacts.append(contact)
+        return web.json_response(
+            {"BaseResponse": OK, "Count": len(contacts), "ContactList": contacts}
+        )
+
+    async def _send(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if not self._authorized(body):
+            return web.json_response({"BaseResponse": {"Ret": 1101, "ErrMsg": ""}})
+        msg = body["Msg"]
+        self.sent_msgs.append(msg)
+        return web.json_response(
+            {
+                "BaseResponse": OK,
+                "MsgID": str(self._random.randint(10**18, 10**19)),
+                "LocalID": str(msg.get("LocalID", "")),
+            }
+        )
+
+    async def _upload_media(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        upload_request = json.loads(form["uploadmediarequest"])
+        if form.get("webwx_data_ticket") != self.data_ticket:
+            return web.json_response({"BaseResponse": {"Ret": 1, "ErrMsg": ""}})
+        chunk = int(form.get("chunk", 0))
+        chunks = int(form.get("chunks", 1))
+        data = form["filename"].file.read()
+        key = f"{upload_request['ClientMediaId']}"
+        self.uploads[key] = self.uploads.get(key, 0) + len(data)
+        result = {
+            "BaseResponse": OK,
+            "MediaId": "",
+            "StartPos": self.uploads[key],
+            "CDNThumbImgHeight": 0,
+            "CDNThumbImgWidth": 0,
+        }
+        if chunk == chunks - 1:  # 最后一个分块上传完成后才返回MediaId
+            result["MediaId"] = "@crypt_" + uuid.uuid4().hex
+        return web.json_response(result)
+
+    async def _media_get(self, request: web.Request) -> web.StreamResponse:
+        endpoint = request.path.rsplit("/", 1)[-1]
+        size = max(1, int(self.options.media_size * MEDIA_ENDPOINTS[endpoint]))
+        start, end = 0, size - 1
+        ma = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if ma is not None:
+            start = int(ma.group(1))
+            end = min(int(ma.group(2) or end), end)
+            if start > end:
+                return web.Response(
+                    status=416, headers={"Content-Range": f"bytes */{size}"}
+                )
+        body = self._media_bytes(start, end + 1)
+        if ma is None:
+            return web.Response(body=body, content_type="application/octet-stream")
+        return web.Response(
+            status=206,
+            body=body,
+            content_type="application/octet-stream",
+            headers={"Content-Range": f"bytes {start}-{end}/{size}"},
+        )
+
+    async def _revoke(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.revoked.append(str(body["SvrMsgId"]))
+        return web.json_response(
+            {"BaseResponse": OK, "Introduction": "", "SysWording": ""}
+        )
+
+    async def _create_chatroom(self, request: web.Request) -> web.Response:
+        chatroom = make_contact(chatroom=True, rng=self._random)
+        self.chatrooms.append(chatroom)
+        self.contacts[chatroom["UserName"]] = chatroom
+        return web.json_response(
+            {"BaseResponse": OK, "ChatRoomName": chatroom["UserName"]}
+        )
+
+    async def _noop(self, request: web.Request) -> web.Response:
+        return web.json_response({"BaseResponse": OK, "MsgID": ""})
+
+    async def _logout(self, request: web.Request) -> web.Response:
+        return web.Response(text="")
+
+    def _authorized(self, body: dict) -> bool:
+        base_request = body.get("BaseRequest", {})
+        return base_request.get("Sid") == self.wxsid
+
+    def _tick(self) -> float:
+        """
+        按照msg_rate累积新消息，返回等待取走的消息数
+        """
+        now = time.monotonic()
+        self._pending += (now - self._last_tick) * self.options.msg_rate
+        self._last_tick = now
+        return self._pending
+
+    def _make_msg(self) -> dict:
+        me = self.me["UserName"]
+        if self.chatrooms and self._random.random() < self.options.chatroom_ratio:
+            chatroom = self._random.choice(self.chatrooms)
+            sender = self._random.choice(chatroom["MemberList"])["UserName"]
+            msg = make_raw_message(chatroom["UserName"], me, rng=self._random)
+            msg["Content"] = f"{sender}:<br/>{msg['Content']}"
+        else:
+            friend = self._random.choice(self.friends)["UserName"]
+            msg = make_raw_message(friend, me, rng=self._random)
+        if self._random.random() < self.options.image_ratio:
+            msg["MsgType"] = 3
+            prefix = (
+                msg["Content"].split("<br/>")[0] + "<br/>"
+                if "<br/>" in msg["Content"]
+                else ""
+            )
+            msg["Content"] = (
+                prefix
+                + '&lt;?xml version="1.0"?&gt;&lt;msg&gt;&lt;img /&gt;&lt;/msg&gt;'
+            )
+        return msg
+
+    def _media_bytes(self, start: int, end: int) -> bytes:
+        # 内容只由位置决定，分段下载的结果可以和完整下载比较
+        pattern = self._media
+        first = start % len(pattern)
+        repeated = pattern[first:] + pattern * ((end - start) // len(pattern) + 1)
+        return repeated[: end - start]
+
+    @staticmethod
+    def _synccheck_result(retcode: str, selector: str) -> web.Response:
+        return web.Response(
+            text=f'window.synccheck={{retcode:"{retcode}",selector:"{selector}"}}'
+        )
+
+
+async def serve(options: MockOptions, host: str, port: int) -> None:
+    server = MockWeChatServer(options, host, port)
+    base_url = await server.start()
+    print(json.dumps({"base_url": base_url}), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--msg-rate", type=float, default=1.0)
+    parser.add_argument("--chatroom-ratio", type=float, default=0.5)
+    parser.add_argument("--image-ratio", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.0, 0.0))
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--contacts", type=int, default=200)
+    parser.add_argument("--chatrooms", type=int, default=10)
+    parser.add_argument("--members", type=int, default=50)
+    args = parser.parse_args()
+    options = MockOptions(
+        latency=tuple(args.latency),
+        error_rate=args.error_rate,
+        msg_rate=args.msg_rate,
+        chatroom_ratio=args.chatroom_ratio,
+        image_ratio=args.image_ratio,
+        contact_count=args.contacts,
+        chatroom_count=args.chatrooms,
+        member_count=args.members,
+    )
+    try:
+        asyncio.run(serve(options, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+合成的服务器响应，字段与网页版微信的响应一致，用于没有录制数据时的基准测试
+rng参数用于生成随机字段，默认使用全局的random
+"""
+
+import random
+import string
+
+
+def _username(chatroom: bool = False, rng: random.Random | None = None) -> str:
+    rng = rng or random
+    prefix = "@@" if chatroom else "@"
+    return prefix + "".join(rng.choices("0123456789abcdef", k=64))
+
+
+def _nickname(rng: random.Random | None = None) -> str:
+    rng = rng or random
+    return "".join(rng.choices(string.ascii_letters + "测试昵称用户群聊", k=8))
+
+
+def make_contact(
+    chatroom: bool = False, member_count: int = 0, rng: random.Random | None = None
+) -> dict:
+    rng = rng or random
+    username = _username(chatroom, rng)
+    return {
+        "Uin": 0,
+        "UserName": username,
+        "NickName": _nickname(rng),
+        "HeadImgUrl": f"/cgi-bin/mmwebwx-bin/webwxgeticon?seq=0&username={username}&skey=@crypt_0",
+        "ContactFlag": 3,
+        "MemberCount": member_count,
+        "MemberList": [make_member(rng) for _ in range(member_count)],
+        "RemarkName": "",
+        "HideInputBarFlag": 0,
+        "Sex": rng.randint(0, 2),
+        "Signature": _nickname(rng),
+        "VerifyFlag": 0,
+        "OwnerUin": 0,
+        "PYInitial": "CS",
+        "PYQuanPin": "ceshi",
+        "RemarkPYInitial": "",
+        "RemarkPYQuanPin": "",
+        "StarFriend": 0,
+        "AppAccountFlag": 0,
+        "Statues": 0,
+        "AttrStatus": 0,
+        "Province": "",
+        "City": "",
+        "Alias": "",
+        "SnsFlag": 0,
+        "UniFriend": 0,
+        "DisplayName": "",
+        "ChatRoomId": 0,
+        "KeyWord": "",
+        "EncryChatRoomId": "@" + "".join(rng.choices("0123456789abcdef", k=32)),
+        "IsOwner": 0,
+    }
+
+
+def make_member(rng: random.Random | None = None) -> dict:
+    return {
+        "Uin": 0,
+        "UserName": _username(rng=rng),
+        "NickName": _nickname(rng),
+        "AttrStatus": 0,
+        "PYInitial": "",
+        "PYQuanPin": "",
+        "RemarkPYInitial": "",
+        "RemarkPYQuanPin": "",
+        "MemberStatus": 0,
+        "DisplayName": "",
+        "KeyWord": "",
+    }
+
+
+def make_raw_message(
+    from_username: str,
+    to_username: str,
+    msg_type: int = 1,
+    content: str | None = None,
+    app_msg_type: int = 0,
+    rng: random.Random | None = None,
+) -> dict:
+    rng = rng or random
+    return {
+        "MsgId": str(rng.randint(10**18, 10**19)),
+        "FromUserName": from_username,
+        "ToUserName": to_username,
+        "MsgType": msg_type,
+        "Content": content if content is not None else "你好，hello " * 10,
+        "Status": 3,
+        "ImgStatus": 1,
+        "CreateTime": 1700000000,
+        "VoiceLength": 0,
+        "PlayLength": 0,
+        "FileName": "",
+        "FileSize": "",
+        "MediaId": "",
+        "Url": "",
+        "AppMsgType": app_msg_type,
+        "StatusNotifyCode": 0,
+        "StatusNotifyUserName": "",
+        "RecommendInfo": {
+            "UserName": "",
+            "NickName": "",
+            "QQNum": 0,
+            "Province": "",
+            "City": "",
+            "Content": "",
+            "Signature": "",
+            "Alias": "",
+            "Scene": 0,
+            "VerifyFlag": 0,
+            "AttrStatus": 0,
+            "Sex": 0,
+            "Ticket": "",
+            "OpCode": 0,
+        },
+        "ForwardFlag": 0,
+        "AppInfo": {"AppID": "", "Type": 0},
+        "HasProductId": 0,
+        "Ticket": "",
+        "ImgHeight": 0,
+        "ImgWidth": 0,
+        "SubMsgType": 0,
+        "NewMsgId": rng.randint(10**18, 10**19),
+        "OriContent": "",
+        "EncryFileName": "",
+    }
+
+
+def make_sync_key(count: int = 4) -> dict:
+    return {
+        "Count": count,
+        "List": [{"Key": i + 1, "Val": 700000000 + i} for i in range(count)],
+    }
+
+
+def make_sync_response(msg_count: int = 100, contact_count: int = 10) -> dict:
+    """
+    webwxsync的响应
+    """
+    me = _username()
+    return {
+        "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+        "AddMsgCount": msg_count,
+        "AddMsgList": [make_raw_message(_username(), me) for _ in range(msg_count)],
+        "ModContactCount": contact_count,
+        "ModContactList": [make_contact() for _ in range(contact_count)],
+        "DelContactCount": 0,
+        "DelContactList": [],
+        "ModChatRoomMemberCount": 0,
+        "ModChatRoomMemberList": [],
+        "Profile": {},
+        "ContinueFlag": 0,
+        "SyncKey": make_sync_key(),
+        "SKey": "",
+        "SyncCheckKey": make_sync_key(),
+    }
+
+
+def make_contact_response(
+    contact_count: int = 2000, chatroom_count: int = 50, member_count: int = 100
+) -> dict:
+    """
+    webwxgetcontact的响应
+    """
+    member_list = [make_contact() for _ in range(contact_count)]
+    member_list += [
+        make_contact(chatroom=True, member_count=member_count)
+        for _ in range(chatroom_count)
+    ]
+    return {
+        "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+        "MemberCount": len(member_list),
+        "MemberList": member_list,
+        "Seq": 0,
+    }
@@ -0,0 +1,88 @@
+"""
+发送消息和上传分块收到5xx、429时应该按照重试策略重试，而不是直接失败
+使用benchmarks/mock_server.py的错误注入模拟服务器的临时错误
+    python -m pytest tests
+"""
+
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from mock_server import MockOptions, MockWeChatServer  # noqa: E402
+from vchat import Core, config  # noqa: E402
+from vchat.errors import VChatError  # noqa: E402
+
+
+async def _noop_qr_callback(**kwargs) -> None:
+    pass
+
+
+def _run_with_server(monkeypatch, options: MockOptions, fn) -> MockWeChatServer:
+    """
+    启动mock服务器并登录，调用fn(core)，返回服务器以便检查收到的请求
+    """
+    monkeypatch.setattr(config, "SEND_RETRY_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "SEND_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(config, "UPLOAD_CHUNK_RETRY", 2)
+    server = MockWeChatServer(options)
+
+    async def main() -> None:
+        monkeypatch.setattr(config, "BASE_URL", await server.start())
+        core = Core()
+        try:
+            await core.init(watchdog=False)
+            await core.auto_login(hot_reload=False, qr_callback=_noop_qr_callback)
+            await fn(core)
+        finally:
+            await core.close()
+            await server.stop()
+
+    asyncio.run(main())
+    return server
+
+
+@pytest.mark.parametrize("status", [500, 429])
+def test_send_msg_retries_server_errors(monkeypatch, tmp_path, status):
+    monkeypatch.chdir(tmp_path)
+    options = MockOptions(
+        endpoint_error_rates={"webwxsendmsg": 1.0}, error_status=status
+    )
+
+    async def send(core: Core) -> None:
+        with pytest.raises(VChatError):
+            await core.send_msg("hello", "filehelper")
+
+    server = _run_with_server(monkeypatch, options, send)
+    assert server.requests["webwxsendmsg"] == 3
+    assert server.sent_msgs == []
+
+
+def test_upload_retries_server_errors(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    options = MockOptions(endpoint_error_rates={"webwxuploadmedia": 1.0})
+
+    async def send(core: Core) -> None:
+        with pytest.raises(VChatError):
+            await core.send_file(
+                "filehelper", fd=io.BytesIO(b"x" * 1024), file_name="a.bin"
+            )
+
+    server = _run_with_server(monkeypatch, options, send)
+    assert server.requests["webwxuploadmedia"] == 3
+    assert server.uploads == {}
+
+
+def test_send_msg_succeeds_without_errors(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    async def send(core: Core) -> None:
+        await core.send_msg("hello", "filehelper")
+
+    server = _run_with_server(monkeypatch, MockOptions(), send)
+    assert server.requests["webwxsendmsg"] == 1
+    assert len(server.sent_msgs) == 1
@@ -1 +1,2 @@
 from vchat.core import Core
+from vchat.accounts import AccountManager
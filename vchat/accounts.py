@@ -0,0 +1,280 @@
+import asyncio
+import enum
+import inspect
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from vchat import config
+from vchat.config import logger
+from vchat.core import Core
+from vchat.errors import VLoginError, VMalformedParameterError
+from vchat.loop import LoopWatchdog
+from vchat.metrics import Metrics, MetricsGroup, MetricsServer
+from vchat.net.interface import SharedConnectors, new_device_id
+from vchat.net.retry import RetryPolicy
+from vchat.net.scheduler import TokenBucket
+
+# 每次（重新）登录后调用，用于注册消息处理函数等，可以是协程函数
+SetupFn = Callable[[Core], Awaitable[None] | None]
+
+
+class AccountState(enum.Enum):
+    PENDING = "pending"  # 等待AccountManager启动
+    STARTING = "starting"  # 正在初始化和登录
+    RUNNING = "running"
+    RESTARTING = "restarting"  # 退出后等待重启
+    STOPPED = "stopped"  # 被remove_account或者stop停止
+    FAILED = "failed"  # 无法登录或者连续失败次数过多，不再重启
+
+
+class Account:
+    """
+    AccountManager中的一个账号，每次重启都会创建新的Core，设备id和metrics在重启之间保持不变
+    """
+
+    def __init__(
+        self,
+        name: str,
+        device_id: str,
+        setup: SetupFn | None,
+        login_options: dict[str, Any],
+        metrics: Metrics,
+    ) -> None:
+        self.name = name
+        self.device_id = device_id
+        self.setup = setup
+        self.login_options = login_options
+        self.metrics = metrics
+        self.core: Core | None = None
+        self.state = AccountState.PENDING
+        self.restarts = 0
+        self.failures = 0  # 连续失败的次数
+        self.last_error: BaseException | None = None
+        self._task: asyncio.Task | None = None
+
+
+class AccountManager:
+    """
+    在同一个进程、同一个事件循环中运行多个账号
+    1. 每个账号有各自的Core（Storage、cookie、发送队列）和设备id
+    2. 所有账号共享连接池和总的发送限速，同时登录的账号数受限制
+    3. 每个账号的指标带有account标签，合并到self.metrics中，可以通过start_metrics_server统一输出
+    4. 账号退出（异常、被服务器退出登录、连续接收失败）后自动重启，等待时间指数增长，
+       无法登录（VLoginError）或者连续失败次数过多时不再重启
+        manager = AccountManager()
+        manager.add_account("alice", setup=register_handlers)
+        manager.add_account("bob", setup=register_handlers)
+        await manager.run()
+    """
+
+    def __init__(
+        self,
+        send_limit: tuple[float, float] | None = None,
+        login_concurrency: int | None = None,
+        max_restarts: int | None = None,
+        restart_policy: RetryPolicy | None = None,
+    ) -> None:
+        if max_restarts is None:
+            max_restarts = config.ACCOUNT_MAX_RESTARTS
+        self.accounts: dict[str, Account] = {}
+        self.metrics = MetricsGroup()
+        self.metrics.base.set_gauge("vchat_accounts", lambda: len(self.accounts))
+        self.metrics.base.set_gauge(
+            "vchat_accounts_running",
+            lambda: sum(
+                a.state == AccountState.RUNNING for a in self.accounts.values()
+            ),
+        )
+        self.send_bucket = TokenBucket(*(send_limit or config.ACCOUNTS_SEND_LIMIT))
+        self.max_restarts = max_restarts
+        self.restart_policy = restart_policy or RetryPolicy(
+            max_attempts=max_restarts + 1,
+            base_delay=config.ACCOUNT_RESTART_BASE_DELAY,
+            max_delay=config.ACCOUNT_RESTART_MAX_DELAY,
+        )
+        # QR码登录时会一直占用，直到扫码完成或者超时
+        self._login_semaphore = asyncio.Semaphore(
+            login_concurrency or config.ACCOUNTS_LOGIN_CONCURRENCY
+        )
+        self._connectors: SharedConnectors | None = None
+        self._metrics_server: MetricsServer | None = None
+        self._watchdog: LoopWatchdog | None = None
+
+    @property
+    def started(self) -> bool:
+        return self._connectors is not None
+
+    def add_account(
+        self,
+        name: str,
+        setup: SetupFn | None = None,
+        device_id: str | None = None,
+        **login_options,
+    ) -> Account:
+        """
+        login_options是Core.auto_login的参数，热重载文件默认为vchat-{name}.pkl，QR码图片默认为QR-{name}.svg
+        AccountManager已经启动时立刻启动这个账号
+        """
+        if name in self.accounts:
+            raise VMalformedParameterError(f"账号{name}已经存在")
+        login_options.setdefault("status_storage_path", Path(f"vchat-{name}.pkl"))
+        login_options.setdefault("pic_path", Path(f"QR-{name}.svg"))
+        account = Account(
+            name,
+            device_id or new_device_id(),
+            setup,
+            login_options,
+            Metrics(labels={"account": name}),
+        )
+        account.metrics.set_gauge("vchat_account_restarts", lambda: account.restarts)
+        self.accounts[name] = account
+        self.metrics.add(name, account.metrics)
+        if self.started:
+            self._start_account(account)
+        return account
+
+    async def remove_account(self, name: str) -> None:
+        account = self.accounts.pop(name, None)
+        if account is None:
+            return
+        self.metrics.remove(name)
+        await self._stop_account(account)
+
+    def core(self, name: str) -> Core | None:
+        """
+        账号当前的Core，重启后会变化，不要长期持有
+        """
+        account = self.accounts.get(name)
+        return account.core if account is not None else None
+
+    async def start(self) -> None:
+        if self.started:
+            return
+        self._connectors = SharedConnectors()
+        if config.LOOP_WATCHDOG:
+            self._watchdog = LoopWatchdog(self.metrics)
+            self._watchdog.start()
+        for account in self.accounts.values():
+            self._start_account(account)
+
+    async def run(self) -> None:
+        """
+        启动所有账号，直到所有账号都停止或者失败
+        """
+        await self.start()
+        try:
+            while True:
+                tasks = [
+                    a._task
+                    for a in self.accounts.values()
+                    if a._task is not None and not a._task.done()
+                ]
+                if not tasks:
+                    break
+                await asyncio.wait(tasks)
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        for account in list(self.accounts.values()):
+            await self._stop_account(account)
+        if self._connectors is not None:
+            await self._connectors.close()
+            self._connectors = None
+        await self.stop_metrics_server()
+        if self._watchdog is not None:
+            await self._watchdog.stop()
+            self._watchdog = None
+
+    async def start_metrics_server(
+        self, host: str | None = None, port: int | None = None
+    ) -> None:
+        """
+        输出所有账号的指标，见Core.start_metrics_server
+        """
+        if self._metrics_server is not None:
+            return
+        server = MetricsServer(self.metrics, host, port)
+        await server.start()
+        self._metrics_server = server
+
+    async def stop_metrics_server(self) -> None:
+        if self._metrics_server is not None:
+            await self._metrics_server.stop()
+            self._metrics_server = None
+
+    def _start_account(self, account: Account) -> None:
+        if account._task is not None and not account._task.done():
+            return
+        account._task = asyncio.create_task(
+            self._supervise(account), name=f"vchat-account-{account.name}"
+        )
+
+    async def _stop_account(self, account: Account) -> None:
+        task = account._task
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        account._task = None
+        if account.state != AccountState.FAILED:
+            account.state = AccountState.STOPPED
+
+    async def _supervise(self, account: Account) -> None:
+        while True:
+            core = Core(
+                account.device_id, self._connectors, self.send_bucket, account.metrics
+            )
+            account.core = core
+            account.state = AccountState.STARTING
+            started: float | None = None
+            try:
+                await core.init(watchdog=False)
+                async with self._login_semaphore:
+                    # 无法连接网络对其中一个账号来说只是一次失败，不退出进程
+                    await core.auto_login(
+                        **{**account.login_options, "exit_if_offline": False}
+                    )
+                if account.setup is not None:
+                    result = account.setup(core)
+                    if inspect.isawaitable(result):
+                        await result
+                account.state = AccountState.RUNNING
+                started = time.monotonic()
+                await core.run()  # run返回或者抛出异常时已经关闭了core
+                logger.warning(f"account {account.name} exited")
+            except VLoginError as e:
+                account.state = AccountState.FAILED
+                account.last_error = e
+                logger.error(f"account {account.name} failed to login: {e}")
+                return
+            except Exception as e:
+                account.last_error = e
+                logger.exception(f"account {account.name} crashed")
+            finally:
+                if started is None:  # 没有进入run，需要自己关闭
+                    await core.close()
+
+            if (
+                started is not None
+                and time.monotonic() - started > config.ACCOUNT_RESTART_RESET
+            ):
+                account.failures = 0
+            account.failures += 1
+            if account.failures > self.max_restarts:
+                account.state = AccountState.FAILED
+                logger.error(
+                    f"account {account.name} failed {account.failures} times in a row,"
+                    " give up"
+                )
+                return
+            account.state = AccountState.RESTARTING
+            delay = self.restart_policy.backoff(account.failures)
+            logger.info(f"restart account {account.name} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            account.restarts += 1
@@ -5,6 +5,21 @@ import sys
 
 logger = logging.getLogger("vchat")
 BASE_URL = "https://login.weixin.qq.com"
+# 登录后跳转的域名 -> (文件上传下载的地址, 同步消息的地址)，按顺序匹配第一个包含的域名
+# 都不匹配时（例如本地的模拟服务器）文件和同步消息都使用跳转的地址
+HOST_MAPPING = (
+    ("wx2.qq.com", "https://file.wx2.qq.com", "https://webpush.wx2.qq.com"),
+    ("wx8.qq.com", "https://file.wx8.qq.com", "https://webpush.wx8.qq.com"),
+    ("qq.com", "https://file.wx.qq.com", "https://webpush.wx.qq.com"),
+    (
+        "web2.wechat.com",
+        "https://file.web2.wechat.com",
+        "https://webpush.web2.wechat.com",
+    ),
+    ("wechat.com", "https://file.web.wechat.com", "https://webpush.web.wechat.com"),
+)
+# 是否接受IP地址（例如http://127.0.0.1:8080）设置的cookie，使用IP地址访问模拟服务器时需要设置为True
+COOKIE_JAR_UNSAFE = False
 OS = sys.platform  # linux, win32,darwin
 TIMEOUT = 120
 
@@ -30,4 +45,219 @@ UOS_PATCH_EXTSPAM = (
     "/74QgpYqcPkmamB4nVv1JxczYITIqItIKjD35IGKAUwAA=="
 )
 
+# 单个账号登录时使用的设备id，AccountManager为每个账号生成各自的设备id
 DEVICEID = "e" + str(random.random())[2:17]
+
+# 上传文件的media_id缓存，服务器的media_id会过期，过期时间未知，保守设置为一天
+MEDIA_CACHE_TTL = 24 * 60 * 60
+MEDIA_CACHE_MAX_SIZE = 1024
+
+# 分块上传，上传中断后，再次上传同一个文件会从第一个未确认的分块继续
+UPLOAD_CHUNK_SIZE = 512 * 1024
+UPLOAD_CHUNK_RETRY = 3
+UPLOAD_SESSION_TTL = 60 * 60
+
+# 发送消息的令牌桶限速，(每秒发送数, 突发上限)
+# 短时间内大量发送会被服务器限流，甚至触发风控，以下数值偏保守
+SEND_GLOBAL_LIMIT = (5.0, 10)
+SEND_RECIPIENT_LIMIT = (1.0, 3)
+SEND_ENDPOINT_LIMITS = {
+    "webwxsendmsg": (5.0, 10),
+    "webwxsendmsgimg": (1.0, 3),
+    "webwxsendvideomsg": (0.5, 2),
+    "webwxsendappmsg": (1.0, 3),
+    "webwxsendemoticon": (1.0, 3),
+}
+
+# 群发时最多同时发送的消息数，实际发送速度还受发送限速的约束
+BROADCAST_CONCURRENCY = 8
+
+# 保存最近发送的消息的LocalID到服务器MsgID的映射，用于撤回消息
+LOCAL_ID_MAPPING_SIZE = 4096
+
+# 发送和上传失败后的重试，指数退避并加入随机抖动
+# 重试预算：每个请求积累RETRY_BUDGET_RATIO次重试机会，最多积累RETRY_BUDGET_MAX次，防止服务器故障时重试放大流量
+SEND_RETRY_MAX_ATTEMPTS = 3
+SEND_RETRY_BASE_DELAY = 0.5
+SEND_RETRY_MAX_DELAY = 8.0
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX = 20
+
+# 文件读写在线程池中执行，避免阻塞事件循环，可以通过vchat.fileio.set_executor替换线程池
+FILE_IO_WORKERS = 4
+FILE_IO_BUFFER_SIZE = 256 * 1024
+
+# 请求和响应使用的json编解码器，可选"stdlib"，"orjson"，"msgspec"，"auto"表示优先使用已经安装的orjson或msgspec
+JSON_CODEC = "auto"
+
+# 下载时每次从响应中读取的最大字节数
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# 媒体下载，同时进行的下载数上限；DOWNLOAD_CACHE_DIR不为None时启用磁盘缓存，超过上限时淘汰最久未使用的文件
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_CACHE_DIR: str | None = None
+DOWNLOAD_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 视频和文件使用Range请求分段下载，中断后从已下载的位置继续；文件大于DOWNLOAD_SEGMENT_SIZE时最多分为DOWNLOAD_MAX_SEGMENTS段并行下载
+DOWNLOAD_SEGMENT_SIZE = 8 * 1024 * 1024
+DOWNLOAD_MAX_SEGMENTS = 4
+
+# 后台预取媒体，预取的数据保存在内存中，总大小不超过PREFETCH_MAX_BYTES；大于PREFETCH_MAX_SIZE的单个媒体默认不预取
+PREFETCH_MAX_BYTES = 64 * 1024 * 1024
+PREFETCH_MAX_SIZE = 8 * 1024 * 1024
+
+# 头像缓存，内存中最多保存AVATAR_CACHE_MAX_SIZE个头像；AVATAR_CACHE_DIR不为None时同时缓存在磁盘上
+# HeadImgUrl未知的头像（通常是群成员）无法判断是否更新，只在内存中缓存AVATAR_CACHE_UNKNOWN_URL_TTL秒
+# 批量同步群成员头像时最多同时下载AVATAR_SYNC_CONCURRENCY个
+AVATAR_CACHE_MAX_SIZE = 2048
+AVATAR_CACHE_DIR: str | None = None
+AVATAR_CACHE_MAX_BYTES = 128 * 1024 * 1024
+AVATAR_CACHE_UNKNOWN_URL_TTL = 10 * 60
+AVATAR_SYNC_CONCURRENCY = 8
+
+# 不同类型的请求使用独立的连接池，避免大文件传输和长轮询占满连接，拖慢普通的API请求
+# 每项都是aiohttp.TCPConnector的参数：连接数上限、每个主机的连接数上限、空闲连接保持时间（秒）、DNS缓存时间（秒）
+API_POOL = {
+    "limit": 20,
+    "limit_per_host": 10,
+    "keepalive_timeout": 30,
+    "ttl_dns_cache": 300,
+}
+# synccheck长轮询最多持续TIMEOUT秒，空闲连接保持时间需要比它更长才能复用
+SYNC_POOL = {
+    "limit": 4,
+    "limit_per_host": 2,
+    "keepalive_timeout": TIMEOUT + 30,
+    "ttl_dns_cache": 300,
+}
+FILE_POOL = {
+    "limit": 16,
+    "limit_per_host": 8,
+    "keepalive_timeout": 15,
+    "ttl_dns_cache": 300,
+}
+
+# 启动时测试网络连接，每次尝试的超时时间（秒）
+CONNECT_TEST_TIMEOUT = 10
+
+# 登录后在后台加载联系人，webwxinit完成后就可以开始接收消息；为False时加载完联系人才调用login_callback
+LOAD_CONTACTS_IN_BACKGROUND = True
+
+# 统一的请求层，每个接口的超时时间（秒），没有列出的接口使用REQUEST_TIMEOUT
+# None表示不限制总时间（大文件下载），只限制建立连接和每次读取的时间
+REQUEST_TIMEOUT = 30
+REQUEST_CONNECT_TIMEOUT = 10
+ENDPOINT_TIMEOUTS: dict[str, float | None] = {
+    "synccheck": TIMEOUT,
+    "test_connect": CONNECT_TEST_TIMEOUT,
+    "login": 60,  # 等待扫码是长轮询
+    "webwxgetcontact": 60,
+    "webwxbatchgetcontact": 60,
+    "webwxuploadmedia": TIMEOUT,
+    "webwxgetmsgimg": 60,
+    "webwxgetvoice": 60,
+    "webwxgetvideo": None,
+    "webwxgetmedia": None,
+}
+# 没有收到响应或者收到5xx、429时的重试次数，只用于幂等的接口，发送消息使用SEND_RETRY_*的重试策略
+ENDPOINT_RETRIES = {
+    "synccheck": 2,
+    "webwxgetcontact": 2,
+    "webwxbatchgetcontact": 2,
+    "webwxgeticon": 2,
+    "webwxgetheadimg": 2,
+    "webwxgetmsgimg": 2,
+    "webwxgetvoice": 2,
+    "webwxgetvideo": 2,
+    "webwxgetmedia": 2,
+}
+REQUEST_RETRY_BASE_DELAY = 0.2
+# 同步接口连续失败BREAKER_FAILURE_THRESHOLD次后熔断BREAKER_RESET_TIMEOUT秒，期间的请求直接失败
+BREAKER_ENDPOINTS = ("synccheck", "webwxsync")
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 10.0
+
+# 运行指标，请求和消息处理函数耗时直方图的桶上界（秒）
+METRICS_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# Core.start_metrics_server默认监听的地址，只监听本机
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+# 事件循环的看门狗，Core.init时启动，也可以调用Core.start_watchdog手动启动
+# 事件循环被阻塞超过LOOP_LAG_THRESHOLD秒时记录正在运行的task、消息处理函数和调用栈
+LOOP_WATCHDOG = False
+LOOP_LAG_THRESHOLD = 0.5
+LOOP_WATCHDOG_INTERVAL = 0.1
+LOOP_LAG_MAX_EVENTS = 100
+# asyncio的调试模式，执行时间超过SLOW_CALLBACK_DURATION秒的回调会记录到日志，调试模式会降低性能
+ASYNCIO_DEBUG = False
+SLOW_CALLBACK_DURATION = 0.1
+# 使用vchat.loop.run启动时使用uvloop代替asyncio的事件循环，需要安装uvloop
+USE_UVLOOP = False
+
+# AccountManager：同一个进程中运行多个账号
+# 所有账号共享的连接池，每个账号都有一个挂起的synccheck长轮询，同步连接池不限制连接数
+ACCOUNTS_API_POOL = {
+    "limit": 100,
+    "limit_per_host": 50,
+    "keepalive_timeout": 30,
+    "ttl_dns_cache": 300,
+}
+ACCOUNTS_SYNC_POOL = {
+    "limit": 0,
+    "limit_per_host": 0,
+    "keepalive_timeout": TIMEOUT + 30,
+    "ttl_dns_cache": 300,
+}
+ACCOUNTS_FILE_POOL = {
+    "limit": 32,
+    "limit_per_host": 16,
+    "keepalive_timeout": 15,
+    "ttl_dns_cache": 300,
+}
+# 所有账号合计的发送限速，(每秒发送数, 突发上限)，每个账号仍然受SEND_*的限制
+ACCOUNTS_SEND_LIMIT = (20.0, 40)
+# 同时登录（包括热重载后的初始化）的账号数，避免启动时所有账号同时加载联系人
+ACCOUNTS_LOGIN_CONCURRENCY = 4
+# 账号异常退出后重启，等待时间从ACCOUNT_RESTART_BASE_DELAY开始指数增长，最长ACCOUNT_RESTART_MAX_DELAY秒
+# 连续失败ACCOUNT_MAX_RESTARTS次后不再重启；运行超过ACCOUNT_RESTART_RESET秒后连续失败次数清零
+ACCOUNT_RESTART_BASE_DELAY = 1.0
+ACCOUNT_RESTART_MAX_DELAY = 300.0
+ACCOUNT_MAX_RESTARTS = 10
+ACCOUNT_RESTART_RESET = 600.0
+
+# ShardSupervisor：把账号分配到多个工作进程，每个工作进程用AccountManager运行分到的账号
+# 工作进程数，None表示CPU核数
+SHARD_WORKERS: int | None = None
+# 主进程监听的地址，只监听本机，工作进程连接后先发送随机生成的令牌
+SHARD_HOST = "127.0.0.1"
+SHARD_WORKER_START_TIMEOUT = 30.0
+# 停止时等待工作进程退出的时间（秒），超时后强制结束
+SHARD_WORKER_STOP_TIMEOUT = 10.0
+# 工作进程退出后重启，等待时间从SHARD_RESTART_BASE_DELAY开始指数增长
+SHARD_RESTART_BASE_DELAY = 1.0
+SHARD_RESTART_MAX_DELAY = 60.0
+# 可以通过ShardSupervisor.call让账号执行的Core方法，参数和返回值需要可以pickle
+SHARD_COMMANDS = ("send_msg", "send_file", "send_image", "send_video", "revoke")
+# 收到的消息事件的队列长度，队列满时丢弃新的事件
+SHARD_EVENT_QUEUE_SIZE = 10000
+
+# 消息处理函数的运行方式为thread或process时使用的线程池和进程池大小，None表示按照CPU核数
+HANDLER_THREADS: int | None = None
+HANDLER_PROCESSES: int | None = None
+# 每个账号在线程池和进程池中运行（包括排队）的处理函数最多HANDLER_MAX_PENDING个，超过时暂停分发消息
+HANDLER_MAX_PENDING = 64
@@ -1,14 +1,17 @@
+import asyncio
 import copy
+import io
 import sys
 from abc import ABC
-
+from collections.abc import Iterable
 from pathlib import Path
 from typing import Optional, BinaryIO, overload
 
 from aiohttp import ClientError
 
+from vchat import config, fileio
 from vchat.core.interface import CoreInterface
-from vchat.errors import VMalformedParameterError
+from vchat.errors import VChatError, VMalformedParameterError
 from vchat.model import Chatroom, User, MassivePlatform, Contact
 
 if sys.version_info >= (3, 12):
@@ -100,7 +103,8 @@ class CoreContactMixin(CoreInterface, ABC):
             return copy.deepcopy(self._storage.members)
 
         async def callback():
-            for chatroom in self.chatrooms.values():
+            # 联系人在后台加载，等待期间接收消息可能会加入新的群，遍历副本
+            for chatroom in list(self.chatrooms.values()):
                 await self.update_chatroom(chatroom.username, detailed_member=True)
 
         seq = 0
@@ -186,32 +190,91 @@ class CoreContactMixin(CoreInterface, ABC):
             raise VMalformedParameterError(
                 "must specify one and only one of pic_path and fd"
             )
-        if pic_path is not None:
-            fd = pic_path.open("wb")
-        assert fd is not None
         if username is None and chatroom_username is None:  # 非法情况
             raise VMalformedParameterError("must specify who's head image to get")
-        elif username is not None and chatroom_username is None:  # 获取好友头像
-            infoDict = self._storage.members[username]
-            if infoDict is None:
+        if pic_path is not None:
+            async with fileio.open_file(pic_path, "wb") as fd:
+                return await self.get_head_img(username, chatroom_username, fd=fd)
+        assert fd is not None
+        data = await self._get_head_img_bytes(username, chatroom_username)
+        await fileio.run_io(fd.write, data)
+
+    async def _get_head_img_bytes(
+        self, username: Optional[str], chatroom_username: Optional[str]
+    ) -> bytes:
+        """
+        优先从头像缓存中读取，缓存在HeadImgUrl更新时失效，HeadImgUrl未知时在一段时间后失效
+        """
+        if username is not None and chatroom_username is None:  # 获取好友头像
+            contact: Contact | None = self._storage.members.get(username)
+            if contact is None:
                 raise VMalformedParameterError("no such friend")
-            await self._net_helper.get_user_head_img(username, fd)
+            kind = "user"
         elif username is None and chatroom_username is not None:  # 获取群头像
-            await self._net_helper.get_chatroom_head_img(chatroom_username, fd)
+            contact = self._storage.chatrooms.get(chatroom_username)
+            kind = "chatroom"
         else:  # 获取群成员头像
-            assert chatroom_username is not None
-
+            assert chatroom_username is not None and username is not None
+            chatroom = self._storage.chatrooms[chatroom_username]
+            contact = chatroom.members.get(username)
+            kind = "member"
+        cache_key = (kind, chatroom_username or "", username or "")
+        head_img_url = "" if contact is None else contact.get("HeadImgUrl") or ""
+        cache = self._storage.avatar_cache
+        data = await cache.get(cache_key, head_img_url)
+        if data is not None:
+            return data
+
+        buffer = io.BytesIO()
+        if username is not None and chatroom_username is None:
+            await self._net_helper.get_user_head_img(username, buffer)
+        elif username is None and chatroom_username is not None:
+            await self._net_helper.get_chatroom_head_img(chatroom_username, buffer)
+        else:
+            assert chatroom_username is not None and username is not None
             chatroom = self._storage.chatrooms[chatroom_username]
             chatroom_id: str = chatroom["UserName"]
             if "EncryChatRoomId" in chatroom:
                 chatroom_id = chatroom["EncryChatRoomId"]
-            assert username is not None
             await self._net_helper.get_chatroom_member_head_img(
-                username, chatroom_id, fd
+                username, chatroom_id, buffer
             )
+        data = buffer.getvalue()
+        await cache.put(cache_key, head_img_url, data)
+        return data
 
-        if pic_path is not None:
-            fd.close()
+    @override
+    async def sync_chatroom_avatars(
+        self,
+        chatroom_username: str,
+        usernames: Optional[Iterable[str]] = None,
+        concurrency: int | None = None,
+    ) -> dict[str, bytes | Exception]:
+        """
+        批量获取群成员的头像，缓存中已有的头像不会重复下载
+        usernames为None时获取所有群成员的头像，concurrency为None时使用config.AVATAR_SYNC_CONCURRENCY
+        返回username到头像数据的映射，获取失败的成员对应的值是异常
+        """
+        chatroom = self._storage.chatrooms.get(chatroom_username)
+        if chatroom is None:
+            raise VMalformedParameterError("no such chatroom")
+        if usernames is None:
+            usernames = list(chatroom.members)
+        results: dict[str, bytes | Exception] = {}
+        semaphore = asyncio.Semaphore(concurrency or config.AVATAR_SYNC_CONCURRENCY)
+
+        async def fetch(username: str) -> None:
+            async with semaphore:
+                try:
+                    results[username] = await self._get_head_img_bytes(
+                        username, chatroom_username
+                    )
+                except (VChatError, ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("failed to get avatar of %s: %s" % (username, e))
+                    results[username] = e
+
+        await asyncio.gather(*(fetch(username) for username in usernames))
+        return results
 
     @override
     def create_chatroom(self, members, topic=""):
@@ -1,9 +1,13 @@
+import asyncio
+
+from vchat import config
 from vchat.core.contact import CoreContactMixin
 from vchat.core.hotreload import CoreHotReloadMixin
 from vchat.core.login import CoreLoginMixin
 from vchat.core.messages import CoreMessageMixin
 from vchat.core.register import CoreRegisterMixin
 from vchat.core.utils import CoreUtilsMixin
+from vchat.loop import configure_loop
 
 
 class Core(
@@ -14,5 +18,11 @@ class Core(
     CoreLoginMixin,
     CoreUtilsMixin,
 ):
-    async def init(self):
+    async def init(self, watchdog: bool | None = None):
+        """
+        watchdog: 是否启动事件循环的看门狗，默认为config.LOOP_WATCHDOG；AccountManager中的账号共用AccountManager的看门狗
+        """
+        configure_loop(asyncio.get_running_loop())
+        if watchdog if watchdog is not None else config.LOOP_WATCHDOG:
+            self.start_watchdog()
         await self._net_helper.init()
@@ -4,6 +4,7 @@ from abc import ABC
 from pathlib import Path
 from typing import Optional
 
+from vchat import utils
 from vchat.core.interface import CoreInterface
 from vchat.errors import (
     VNetworkError,
@@ -46,11 +47,13 @@ class CoreHotReloadMixin(CoreInterface, ABC):
             logger.debug("No login status found, loading login status failed.")
             raise VFileIOError("No login status found, loading login status failed.")
 
+        timer = utils.StageTimer()
         self._net_helper.load_login_info_from_pickle(jar["loginInfo"])
         self._net_helper.load_cookies(jar["cookies"])
         self._storage.loads(jar["storage"])
         try:
-            rmsgs, contacts = await self._net_helper.get_msg()
+            with timer.stage("get_msg"):
+                rmsgs, contacts = await self._net_helper.get_msg()
         except VOperationFailedError:
             self._net_helper.clear_cookies()
             self._storage.clear()
@@ -69,6 +72,8 @@ class CoreHotReloadMixin(CoreInterface, ABC):
         async for msg in self._produce_msg(rmsgs):
             await self._storage.msgs.put(msg)
         logger.debug("loading login status succeeded.")
+        self.startup_timings = timer.timings
+        logger.info("Startup timings: %s", timer.report())
         if login_callback is not None:
             try:
                 await login_callback(self._storage.myname)
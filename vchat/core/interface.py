@@ -1,21 +1,39 @@
+import asyncio
 from abc import ABC, abstractmethod
 from collections.abc import AsyncGenerator
 from collections.abc import Iterable
 from pathlib import Path
 from typing import Optional, Callable, BinaryIO, overload, Awaitable
 
-from vchat.model import Contact, User, MassivePlatform, Chatroom
+from vchat import config
+from vchat.loop import LagEvent, LoopWatchdog
+from vchat.metrics import Metrics, MetricsServer
+from vchat.model import Contact, User, MassivePlatform, Chatroom, MediaTypes
 from vchat.model import ContentTypes, ContactTypes
-from vchat.model import RawMessage, Message
+from vchat.model import RawMessage, Message, ExecutionMode
+from vchat.core.prefetch import PrefetchPolicy
 from vchat.net import NetHelper
+from vchat.net.interface import SharedConnectors
+from vchat.net.scheduler import SendPriority, TokenBucket
 from vchat.storage import Storage
 
 
 class CoreInterface(ABC):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        device_id: str | None = None,
+        connectors: SharedConnectors | None = None,
+        send_bucket: TokenBucket | None = None,
+        metrics: Metrics | None = None,
+    ) -> None:
+        """
+        参数都用于在同一个进程中运行多个账号，一般由AccountManager传入，见NetHelperInterface
+        """
         self._alive = False
         self._storage: Storage = Storage()
-        self._net_helper: NetHelper = NetHelper()
+        self._net_helper: NetHelper = NetHelper(
+            device_id, connectors, send_bucket, metrics
+        )
         self._uuid: Optional[str] = None
         self._function_dict: dict[ContactTypes, list[Callable[..., Awaitable]]] = {
             ContactTypes.USER: [],
@@ -25,6 +43,20 @@ class CoreInterface(ABC):
         self._use_hot_reload = False
         self._hot_reload_path = Path("vchat.pkl")
         self._receiving_retry_count = 5
+        self._prefetch_policy: PrefetchPolicy | None = None
+        self._contacts_task: asyncio.Task | None = None
+        self._background_tasks: set[asyncio.Task] = set()
+        # 限制在线程池和进程池中运行的处理函数数量，见msg_register
+        self._offload_semaphore = asyncio.Semaphore(config.HANDLER_MAX_PENDING)
+        # 最近一次启动各个阶段的耗时（秒）
+        self.startup_timings: dict[str, float] = {}
+        # 请求和消息处理函数的运行指标
+        self.metrics: Metrics = self._net_helper.metrics
+        self.metrics.set_gauge(
+            "vchat_msgs_queue_depth", lambda: self._storage.msgs.qsize()
+        )
+        self._metrics_server: MetricsServer | None = None
+        self._watchdog: LoopWatchdog | None = None
 
     @abstractmethod
     def _login(
@@ -56,6 +88,14 @@ class CoreInterface(ABC):
     async def logout(self):
         pass
 
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def wait_for_contacts(self) -> None:
+        pass
+
     @abstractmethod
     @overload
     async def update_chatroom(self, username: str, detailed_member=False) -> Chatroom:
@@ -142,7 +182,12 @@ class CoreInterface(ABC):
         pass
 
     @abstractmethod
-    async def send_msg(self, msg: str, to_username: str) -> str:
+    async def send_msg(
+        self,
+        msg: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
@@ -154,6 +199,7 @@ class CoreInterface(ABC):
         media_id: str | None = None,
         file_size: int | None = None,
         file_name: str | None = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ):
         pass
 
@@ -165,6 +211,7 @@ class CoreInterface(ABC):
         fd: Optional[BinaryIO] = None,
         media_id: Optional[str] = None,
         file_name: Optional[str] = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ) -> str:
         pass
 
@@ -176,9 +223,66 @@ class CoreInterface(ABC):
         fd=None,
         media_id=None,
         file_name: Optional[str] = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ):
         pass
 
+    @abstractmethod
+    async def broadcast(
+        self,
+        to_usernames: Iterable[str],
+        msg: str | None = None,
+        file_path: Path | None = None,
+        fd: BinaryIO | None = None,
+        media_id: str | None = None,
+        file_size: int | None = None,
+        file_name: str | None = None,
+        media_type: MediaTypes | None = None,
+        concurrency: int | None = None,
+        priority: SendPriority = SendPriority.LOW,
+    ) -> dict[str, str | Exception]:
+        pass
+
+    @abstractmethod
+    async def sync_chatroom_avatars(
+        self,
+        chatroom_username: str,
+        usernames: Optional[Iterable[str]] = None,
+        concurrency: int | None = None,
+    ) -> dict[str, bytes | Exception]:
+        pass
+
+    @abstractmethod
+    def set_prefetch_policy(self, policy: PrefetchPolicy | None) -> None:
+        pass
+
+    @abstractmethod
+    async def start_metrics_server(
+        self, host: str | None = None, port: int | None = None
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def stop_metrics_server(self) -> None:
+        pass
+
+    @abstractmethod
+    def start_watchdog(
+        self,
+        threshold: float | None = None,
+        interval: float | None = None,
+    ) -> None:
+        pass
+
+    @abstractmethod
+    async def stop_watchdog(self) -> None:
+        pass
+
+    @property
+    @abstractmethod
+    def lag_events(self) -> list[LagEvent]:
+        pass
+
     @abstractmethod
     def revoke(self, msg_id, to_username, local_id=None):
         pass
@@ -200,6 +304,7 @@ class CoreInterface(ABC):
         pic_path: Path = Path("QR.svg"),
         qr_callback=None,
         login_callback=None,
+        exit_if_offline=True,
     ):
         pass
 
@@ -208,7 +313,12 @@ class CoreInterface(ABC):
         pass
 
     @abstractmethod
-    def msg_register(self, msg_type: ContentTypes, contact_type: ContactTypes):
+    def msg_register(
+        self,
+        msg_types: ContentTypes,
+        contact_type: ContactTypes,
+        mode: ExecutionMode | str = ExecutionMode.LOOP,
+    ):
         pass
 
     @abstractmethod
@@ -3,18 +3,18 @@ import io
 import sys
 import traceback
 from abc import ABC
-from collections.abc import Iterable
+from collections.abc import Coroutine, Iterable
 from pathlib import Path
 from typing import Optional
 
-from aiohttp.client_exceptions import ClientResponseError
 from pyqrcode import QRCode
 
-from vchat import utils
+from vchat import config, utils
 from vchat.core.interface import CoreInterface
-from vchat.errors import VOperationFailedError, VLoginError
+from vchat.errors import VNetworkError, VOperationFailedError, VLoginError
 from vchat.model import Chatroom, User, Contact
 from vchat.model import RawMessage
+from vchat.net.executor import VCircuitOpenError
 
 if sys.version_info >= (3, 12):
     from typing import override
@@ -37,15 +37,26 @@ class CoreLoginMixin(CoreInterface, ABC):
             logger.warning("vchat has already logged in.")
             return
 
-        resp_text = await self._get_uuid_and_wait_for_scan(
-            enable_cmd_qr=enable_cmd_qr, pic_path=pic_path, qr_callback=qr_callback
-        )
-        await self._net_helper.load_login_info_from_wechat(resp_text)
+        timer = utils.StageTimer()
+        with timer.stage("scan_qr"):
+            resp_text = await self._get_uuid_and_wait_for_scan(
+                enable_cmd_qr=enable_cmd_qr,
+                pic_path=pic_path,
+                qr_callback=qr_callback,
+            )
+        with timer.stage("login_info"):
+            await self._net_helper.load_login_info_from_wechat(resp_text)
 
         logger.info("Loading the contact, this may take a little while.")
-        await self._web_init()
-        await self._net_helper.show_mobile_login()
-        await self.get_contact(True)
+        # 联系人列表只依赖登录信息，和webwxinit同时开始加载，webwxinit完成后就可以接收消息
+        self._contacts_task = asyncio.create_task(self._load_contacts(timer))
+        self._contacts_task.add_done_callback(_log_task_failure)
+        with timer.stage("web_init"):
+            await self._web_init()
+        self._run_in_background(self._net_helper.show_mobile_login())
+        if not config.LOAD_CONTACTS_IN_BACKGROUND:
+            await self.wait_for_contacts()
+        self.startup_timings = timer.timings
         if hasattr(login_callback, "__call__"):
             await login_callback(self._storage.myname)
         else:
@@ -53,6 +64,36 @@ class CoreLoginMixin(CoreInterface, ABC):
             if pic_path.exists():
                 pic_path.unlink()
         logger.info("Login successfully as %s" % self._storage.nick_name)
+        logger.info("Startup timings: %s", timer.report())
+
+    async def _load_contacts(self, timer: utils.StageTimer) -> None:
+        with timer.stage("contacts"):
+            await self.get_contact(True)
+        logger.info(
+            "Contacts loaded in %.2fs, %d friends, %d chatrooms",
+            timer.timings["contacts"],
+            len(self._storage.members),
+            len(self._storage.chatrooms),
+        )
+        if self._use_hot_reload:
+            self._dump_login_status(self._hot_reload_path)
+
+    @override
+    async def wait_for_contacts(self) -> None:
+        """
+        联系人在登录后在后台加载，需要完整的联系人列表时先等待加载完成
+        """
+        if self._contacts_task is not None:
+            await asyncio.shield(self._contacts_task)
+
+    def _run_in_background(self, coro: Coroutine) -> None:
+        """
+        执行不影响启动的请求，失败时只记录日志
+        """
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        task.add_done_callback(_log_task_failure)
 
     async def push_login(self) -> Optional[str]:
         return await self._net_helper.push_login()
@@ -67,7 +108,7 @@ class CoreLoginMixin(CoreInterface, ABC):
     ):
         uuid = uuid or self.uuid
         qrStorage = io.BytesIO()
-        qrCode = QRCode("https://login.weixin.qq.com/l/" + uuid)
+        qrCode = QRCode(config.BASE_URL + "/l/" + uuid)
         qrCode.svg(qrStorage, scale=10)
         if hasattr(qr_callback, "__call__"):
             await qr_callback(uuid=uuid, status="0", qrcode=qrStorage.getvalue())
@@ -171,8 +212,13 @@ class CoreLoginMixin(CoreInterface, ABC):
         while self._alive:
             try:
                 code = await self._net_helper.sync_check()
-            except ClientResponseError as e:
+            except VCircuitOpenError as e:
+                # synccheck连续失败，熔断期间不再请求
+                await asyncio.sleep(e.retry_after)
+                continue
+            except VNetworkError as e:
                 logger.info(e)
+                await asyncio.sleep(1)
                 continue
             if code is None:
                 self._alive = False
@@ -182,7 +228,7 @@ class CoreLoginMixin(CoreInterface, ABC):
             else:
                 try:
                     msgs, contacts = await self._net_helper.get_msg()
-                except VOperationFailedError:
+                except (VOperationFailedError, VNetworkError):
                     retryCount += 1
                     logger.error(traceback.format_exc())
                     if self._receiving_retry_count < retryCount:
@@ -190,8 +236,8 @@ class CoreLoginMixin(CoreInterface, ABC):
                     else:
                         await asyncio.sleep(1)
                 else:
+                    retryCount = 0
                     await self._consume_message_loop_body(msgs, contacts)
-            retryCount = 0
 
     async def _consume_message_loop_body(
         self, rmsgs: Iterable[RawMessage], contacts: Iterable[Contact]
@@ -214,6 +260,8 @@ class CoreLoginMixin(CoreInterface, ABC):
 
     @override
     async def logout(self):
+        if self._contacts_task is not None and not self._contacts_task.done():
+            self._contacts_task.cancel()
         if self._alive:
             await self._net_helper.logout()
             await self._net_helper.close()
@@ -223,7 +271,24 @@ class CoreLoginMixin(CoreInterface, ABC):
         self._net_helper.clear_cookies()
         self._storage.clear()
 
+    @override
+    async def close(self) -> None:
+        """
+        停止后台任务并关闭连接，不退出登录，之后可以通过热重载恢复
+        """
+        if self._contacts_task is not None and not self._contacts_task.done():
+            self._contacts_task.cancel()
+        for task in list(self._background_tasks):
+            task.cancel()
+        self._alive = False
+        await self._net_helper.close()
+
     @override
     @property
     def alive(self) -> bool:
         return self._alive
+
+
+def _log_task_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("background task failed: %r", task.exception())
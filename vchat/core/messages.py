@@ -1,17 +1,25 @@
+import asyncio
+import functools
 import json
 import re
 import sys
 from abc import ABC
-from collections.abc import Iterable, AsyncGenerator
+from collections.abc import Iterable, AsyncGenerator, Awaitable, Callable
 from pathlib import Path
 from typing import BinaryIO
 
-from vchat import utils
+from aiohttp import ClientError
+
+from vchat import config, fileio, utils
 from vchat.core.interface import CoreInterface
-from vchat.errors import VMalformedParameterError
-from vchat.model import Content
+from vchat.core.prefetch import PrefetchPolicy
+from vchat.errors import VChatError, VMalformedParameterError, VOperationFailedError
+from vchat.model import Content, MediaTypes
 from vchat.model import RawMessage, Message
 from vchat.model import User, Contact, ChatroomMember
+from vchat.net.download import MediaDownload
+from vchat.net.scheduler import SendPriority
+from vchat.storage.media_cache import MediaCache
 
 if sys.version_info >= (3, 12):
     from typing import override
@@ -115,8 +123,30 @@ class CoreMessageMixin(CoreInterface, ABC):
                 chatroom_sender=chatroom_sender,
                 create_time=m.create_time,
             )
+            self._prefetch(msg)
             yield msg
 
+    @override
+    def set_prefetch_policy(self, policy: PrefetchPolicy | None) -> None:
+        """
+        设置后台预取媒体的策略，None表示不预取
+        """
+        self._prefetch_policy = policy
+        if policy is None:
+            self._net_helper.download_manager.clear_prefetched()
+
+    def _prefetch(self, msg: Message) -> None:
+        policy = self._prefetch_policy
+        if policy is None or not policy.match(msg):
+            return
+        download_fn = getattr(msg.content, "download_fn", None)
+        if not isinstance(download_fn, MediaDownload):
+            return
+        size = getattr(msg.content, "filesize", None)
+        if policy.max_size is not None and size is not None and size > policy.max_size:
+            return
+        download_fn.prefetch(policy.max_size)
+
     async def _produce_group_chat(
         self, rmsg: RawMessage
     ) -> tuple[ChatroomMember | None, bool | None]:
@@ -173,9 +203,14 @@ class CoreMessageMixin(CoreInterface, ABC):
         return member, is_at_me
 
     @override
-    async def send_msg(self, msg: str, to_username: str) -> str:
+    async def send_msg(
+        self,
+        msg: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         logger.debug("Request to send a text message to %s: %s" % (to_username, msg))
-        return await self._net_helper.send_raw_msg(1, msg, to_username)
+        return await self._net_helper.send_raw_msg(1, msg, to_username, priority)
 
     @override
     async def send_file(
@@ -186,6 +221,7 @@ class CoreMessageMixin(CoreInterface, ABC):
         media_id: str | None = None,
         file_size: int | None = None,
         file_name: str | None = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ):
         """
         1. 发送本地文件，提供file_path，默认使用file_path的文件名，可以通过file_name覆盖文件名
@@ -207,21 +243,18 @@ class CoreMessageMixin(CoreInterface, ABC):
         else:
             assert file_path is not None
             file_name = file_path.name
+        send_fn = functools.partial(self._net_helper.send_document, priority=priority)
         if media_id is None:
             if file_path is not None:
-                with file_path.open("rb") as fd:
-                    media_id, file_size = await self._net_helper.upload_file(
-                        file_name, fd, to_username
+                async with fileio.open_file(file_path, "rb") as fd:
+                    return await self._upload_and_send(
+                        file_name, fd, to_username, send_fn
                     )
             else:
                 assert fd is not None
-                media_id, file_size = await self._net_helper.upload_file(
-                    file_name, fd, to_username
-                )
+                return await self._upload_and_send(file_name, fd, to_username, send_fn)
         assert file_size is not None
-        msg_id = await self._net_helper.send_document(
-            file_name, media_id, file_size, to_username
-        )
+        msg_id = await send_fn(file_name, media_id, file_size, to_username)
         return msg_id, media_id, file_size
 
     @override
@@ -232,6 +265,7 @@ class CoreMessageMixin(CoreInterface, ABC):
         fd: BinaryIO | None = None,
         media_id: str | None = None,
         file_name: str | None = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ) -> str:
         logger.debug(
             "Request to send a image(mediaId: %s) to %s: %s"
@@ -245,17 +279,20 @@ class CoreMessageMixin(CoreInterface, ABC):
             file_name = file_name or file_path.name or "default.png"
         else:
             file_name = file_name or "default.png"
+        send_fn = functools.partial(self._send_image_helper, priority=priority)
         if media_id is None:
             if file_path is not None:
-                with file_path.open("rb") as fd:
-                    media_id, file_size = await self._net_helper.upload_file(
-                        file_name, fd, to_username
+                async with fileio.open_file(file_path, "rb") as fd:
+                    msg_id, _, _ = await self._upload_and_send(
+                        file_name, fd, to_username, send_fn
                     )
             else:
-                media_id, file_size = await self._net_helper.upload_file(
-                    file_name, fd, to_username
+                assert fd is not None
+                msg_id, _, _ = await self._upload_and_send(
+                    file_name, fd, to_username, send_fn
                 )
-        return await self._net_helper.send_image(media_id, to_username)
+            return msg_id
+        return await self._net_helper.send_image(media_id, to_username, priority)
 
     @override
     async def send_video(
@@ -265,6 +302,7 @@ class CoreMessageMixin(CoreInterface, ABC):
         fd=None,
         media_id=None,
         file_name: str | None = None,
+        priority: SendPriority = SendPriority.NORMAL,
     ):
         """
         1. 发送本地文件，提供file_path
@@ -280,19 +318,186 @@ class CoreMessageMixin(CoreInterface, ABC):
             logger.warning(
                 f"cannot specify which file to send: file_path:{file_path} fd:{fd} media_id:{media_id}"
             )
-        file_name = file_name or file_path.name or "default.mp4"
+        if file_path is not None:
+            file_name = file_name or file_path.name or "default.mp4"
+        else:
+            file_name = file_name or "default.mp4"
+        send_fn = functools.partial(self._send_video_helper, priority=priority)
         if media_id is None:
             if file_path is not None:
-                with file_path.open("rb") as fd:
-                    media_id, file_size = await self._net_helper.upload_file(
-                        file_name, fd, to_username
+                async with fileio.open_file(file_path, "rb") as fd:
+                    msg_id, _, _ = await self._upload_and_send(
+                        file_name, fd, to_username, send_fn
                     )
             else:
-                media_id, file_size = await self._net_helper.upload_file(
-                    file_name, fd, to_username
+                msg_id, _, _ = await self._upload_and_send(
+                    file_name, fd, to_username, send_fn
                 )
+            return msg_id
+
+        return await self._net_helper.send_video(media_id, to_username, priority)
+
+    async def _send_image_helper(
+        self,
+        file_name: str,
+        media_id: str,
+        file_size: int,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
+        return await self._net_helper.send_image(media_id, to_username, priority)
+
+    async def _send_video_helper(
+        self,
+        file_name: str,
+        media_id: str,
+        file_size: int,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
+        return await self._net_helper.send_video(media_id, to_username, priority)
+
+    async def _upload_media(
+        self, file_name: str, fd: BinaryIO, to_username: str
+    ) -> tuple[str, int, bool]:
+        """
+        上传文件，返回media_id, file_size和是否命中缓存
+        内容相同的文件在缓存有效期内只上传一次
+        """
+        media_type = MediaTypes.from_file_name(file_name)
+        file_md5, file_size = await fileio.run_io(MediaCache.digest, fd)
+        media_id = self._storage.media_cache.get(file_md5, file_size, media_type)
+        if media_id is not None:
+            logger.debug("media cache hit for %s: %s" % (file_name, media_id))
+            return media_id, file_size, True
+        media_id, file_size = await self._net_helper.upload_file(
+            file_name, fd, to_username, (file_md5, file_size)
+        )
+        self._storage.media_cache.put(file_md5, file_size, media_type, media_id)
+        return media_id, file_size, False
+
+    async def _upload_and_send(
+        self,
+        file_name: str,
+        fd: BinaryIO,
+        to_username: str,
+        send_fn: Callable[[str, str, int, str], Awaitable[str]],
+    ) -> tuple[str, str, int]:
+        """
+        上传文件并发送，如果使用缓存的media_id发送失败（media_id可能已经过期），重新上传一次
+        """
+        media_id, file_size, cached = await self._upload_media(
+            file_name, fd, to_username
+        )
+        try:
+            msg_id = await send_fn(file_name, media_id, file_size, to_username)
+        except VOperationFailedError:
+            if not cached:
+                raise
+            logger.debug("cached media_id %s may be expired, upload again" % media_id)
+            self._storage.media_cache.invalidate(media_id)
+            media_id, file_size, _ = await self._upload_media(
+                file_name, fd, to_username
+            )
+            msg_id = await send_fn(file_name, media_id, file_size, to_username)
+        return msg_id, media_id, file_size
+
+    @override
+    async def broadcast(
+        self,
+        to_usernames: Iterable[str],
+        msg: str | None = None,
+        file_path: Path | None = None,
+        fd: BinaryIO | None = None,
+        media_id: str | None = None,
+        file_size: int | None = None,
+        file_name: str | None = None,
+        media_type: MediaTypes | None = None,
+        concurrency: int | None = None,
+        priority: SendPriority = SendPriority.LOW,
+    ) -> dict[str, str | Exception]:
+        """
+        给多个联系人发送同一条文本消息或同一个文件（图片、视频）
+        1. 发送文本，提供msg
+        2. 发送文件，提供file_path、fd或media_id之一，文件只上传一次，所有联系人复用同一个media_id
+        media_type决定以图片、视频还是文件发送，默认根据file_name推断
+        最多同时发送concurrency条消息（默认config.BROADCAST_CONCURRENCY），并且受发送限速的约束
+        返回每个联系人的发送结果，成功为msg_id，失败为异常
+        """
+        usernames = list(dict.fromkeys(to_usernames))
+        if [msg, file_path, fd, media_id].count(None) != 3:
+            error_msg = f"cannot specify what to broadcast: msg:{msg} file_path:{file_path} fd:{fd} media_id:{media_id}"
+            logger.warning(error_msg)
+            raise VMalformedParameterError(error_msg)
+        results: dict[str, str | Exception] = {}
+        if len(usernames) == 0:
+            return results
+        logger.debug("Request to broadcast to %d contacts" % len(usernames))
+
+        send_fn: Callable[[str, str, int, str], Awaitable[str]]
+        if msg is not None:
+            text = msg
+
+            async def send_fn(file_name, media_id, file_size, to_username):
+                return await self._net_helper.send_raw_msg(
+                    1, text, to_username, priority
+                )
+
+        else:
+            if file_path is not None:
+                file_name = file_name or file_path.name
+            if file_name is None:
+                raise VMalformedParameterError("must specify file_name")
+            media_type = media_type or MediaTypes.from_file_name(file_name)
+            if media_type == MediaTypes.IMG:
+                send_fn = functools.partial(self._send_image_helper, priority=priority)
+            elif media_type == MediaTypes.VIDEO:
+                send_fn = functools.partial(self._send_video_helper, priority=priority)
+            else:
+                send_fn = functools.partial(
+                    self._net_helper.send_document, priority=priority
+                )
+            if media_id is None:
+                # 先完整地发送给第一个联系人，确认media_id有效后再发送给其他联系人
+                first = usernames.pop(0)
+                try:
+                    if file_path is not None:
+                        async with fileio.open_file(file_path, "rb") as fd:
+                            results[first], media_id, file_size = (
+                                await self._upload_and_send(
+                                    file_name, fd, first, send_fn
+                                )
+                            )
+                    else:
+                        assert fd is not None
+                        results[first], media_id, file_size = (
+                            await self._upload_and_send(file_name, fd, first, send_fn)
+                        )
+                except (VChatError, ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("broadcast upload failed: %s" % e)
+                    results[first] = e
+                    for username in usernames:
+                        results[username] = e
+                    return results
+            elif media_type == MediaTypes.DOC and file_size is None:
+                raise VMalformedParameterError(
+                    "must specify file_size when broadcasting a file by media_id"
+                )
+
+        semaphore = asyncio.Semaphore(concurrency or config.BROADCAST_CONCURRENCY)
+
+        async def send_one(to_username: str) -> None:
+            async with semaphore:
+                try:
+                    results[to_username] = await send_fn(
+                        file_name or "", media_id or "", file_size or 0, to_username
+                    )
+                except (VChatError, ClientError, asyncio.TimeoutError) as e:
+                    logger.warning("broadcast to %s failed: %s" % (to_username, e))
+                    results[to_username] = e
 
-        return await self._net_helper.send_video(media_id, to_username)
+        await asyncio.gather(*(send_one(username) for username in usernames))
+        return results
 
     @override
     async def revoke(self, msg_id, to_username, local_id=None):
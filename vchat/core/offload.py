@@ -0,0 +1,47 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from vchat import config
+from vchat.utils import apply_config_settings, config_settings
+
+# 同一个进程中的所有Core共享线程池和进程池，避免多开时进程数成倍增长
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            config.HANDLER_THREADS, thread_name_prefix="vchat-handler"
+        )
+    return _thread_pool
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """
+    使用spawn方式启动子进程，fork一个运行着事件循环和多个线程的进程是不安全的
+    子进程启动时复制主进程中config的设置
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            config.HANDLER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=apply_config_settings,
+            initargs=(config_settings(),),
+        )
+    return _process_pool
+
+
+def shutdown_pools(wait: bool = True) -> None:
+    """
+    关闭线程池和进程池，之后再使用时会重新创建
+    """
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait, cancel_futures=True)
+        _process_pool = None
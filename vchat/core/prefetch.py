@@ -0,0 +1,43 @@
+from dataclasses import dataclass, field
+
+from vchat import config
+from vchat.model import Chatroom, ChatroomMember, ContactTypes, ContentTypes, Message
+
+
+@dataclass
+class PrefetchPolicy:
+    """
+    后台预取媒体的策略，收到满足条件的消息时立即在后台开始下载
+    content_types: 预取的消息类型，只有图片、视频、音频、文件有效
+    contact_types: 预取的联系人类型
+    chatrooms: 只预取这些群聊的消息，可以是群聊的username或者昵称，None表示所有群聊
+    max_size: 大小超过max_size或者大小未知的媒体不预取，None表示不限制
+    """
+
+    content_types: ContentTypes = ContentTypes.IMAGE | ContentTypes.VOICE
+    contact_types: ContactTypes = ContactTypes.ALL
+    chatrooms: set[str] | None = None
+    max_size: int | None = field(default_factory=lambda: config.PREFETCH_MAX_SIZE)
+
+    def match(self, msg: Message) -> bool:
+        if msg.content.type not in self.content_types:
+            return False
+        chatroom = _chatroom_of(msg)
+        if chatroom is None:
+            return msg.from_.type in self.contact_types
+        if ContactTypes.CHATROOM not in self.contact_types:
+            return False
+        return (
+            self.chatrooms is None
+            or chatroom.username in self.chatrooms
+            or chatroom.nickname in self.chatrooms
+        )
+
+
+def _chatroom_of(msg: Message) -> Chatroom | None:
+    for contact in (msg.from_, msg.to):
+        if isinstance(contact, Chatroom):
+            return contact
+        if isinstance(contact, ChatroomMember):
+            return contact.from_chatroom
+    return None
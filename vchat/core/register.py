@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import sys
 import traceback
 from abc import ABC
@@ -7,11 +8,13 @@ from collections.abc import Callable, Awaitable
 from pathlib import Path
 
 from vchat.core.interface import CoreInterface
-from vchat.errors import VChatError
-from vchat.errors import VUserCallbackError
+from vchat.core.offload import process_pool, thread_pool
+from vchat.errors import VChatError, VMalformedParameterError
+from vchat.errors import VNetworkError, VUserCallbackError
+from vchat.metrics import Metrics
 from vchat.model import Chatroom, MassivePlatform, User
 from vchat.model import ContentTypes, ContactTypes
-from vchat.model import Message
+from vchat.model import ExecutionMode, MediaContent, Message, Reply
 
 if sys.version_info >= (3, 12):
     from typing import override
@@ -30,33 +33,48 @@ class CoreRegisterMixin(CoreInterface, ABC):
         pic_path: Path = Path("QR.svg"),
         qr_callback=None,
         login_callback=None,
+        exit_if_offline=True,
     ):
-        if not await self._net_helper.test_connect():
-            logger.info("You can't get access to internet or wechat domain, so exit.")
-            sys.exit()
+        """
+        无法连接网络时，exit_if_offline为True则退出程序，否则抛出VNetworkError
+        """
+        # 测试网络和读取热重载状态同时进行，热重载成功说明网络正常，不需要等待测试结果
+        connect_task = asyncio.create_task(self._net_helper.test_connect())
         self._use_hot_reload = hot_reload
         if isinstance(status_storage_path, str):
             self._hot_reload_path = Path(status_storage_path)
         else:
             self._hot_reload_path = status_storage_path
-        if hot_reload:
-            try:
-                await self._load_login_status(
-                    status_storage_path,
-                    login_callback=login_callback,
-                )
-                return
-            except VChatError as e:
-                logger.warning("hot reload failed\n" + str(e))
+        try:
+            if hot_reload:
+                try:
+                    await self._load_login_status(
+                        status_storage_path,
+                        login_callback=login_callback,
+                    )
+                    return
+                except VChatError as e:
+                    logger.warning("hot reload failed\n" + str(e))
+            connected = await connect_task
+        finally:
+            # 热重载成功或者出现其他异常时不再需要测试结果
+            if not connect_task.done():
+                connect_task.cancel()
+            elif not connect_task.cancelled():
+                connect_task.exception()  # 避免asyncio报告异常没有被获取
 
+        if not connected:
+            if not exit_if_offline:
+                raise VNetworkError("无法连接到网络或者微信服务器")
+            logger.info("You can't get access to internet or wechat domain, so exit.")
+            sys.exit()
         await self._login(
             enable_cmd_qr=enable_cmd_qr,
             pic_path=pic_path,
             qr_callback=qr_callback,
             login_callback=login_callback,
         )
-        if hot_reload:
-            self._dump_login_status(self._hot_reload_path)
+        # 热重载状态在联系人加载完成后保存，见_load_contacts
 
     @override
     async def _configured_reply(self):
@@ -78,24 +96,92 @@ class CoreRegisterMixin(CoreInterface, ABC):
             logger.warning(traceback.format_exc())
 
     @override
-    def msg_register(self, msg_types: ContentTypes, contact_type: ContactTypes):
+    def msg_register(
+        self,
+        msg_types: ContentTypes,
+        contact_type: ContactTypes,
+        mode: ExecutionMode | str = ExecutionMode.LOOP,
+    ):
+        """
+        mode是处理函数的运行方式
+            loop: fn是协程函数，在事件循环中运行，参数是Message
+            thread: fn是普通函数，在线程池中运行，参数是Message
+            process: fn是模块级别的普通函数，在进程池中运行，参数是Message.todict()，
+                媒体消息的content中附带"download"，可以在子进程中用DownloadDescriptor.fromdict下载
+        thread和process模式的处理函数不阻塞消息的分发，可以返回Reply、Reply的列表或者字符串（文本回复），由事件循环发送
+        """
+        mode = ExecutionMode(mode)
+
         def _msg_register(fn):
-            if ContactTypes.USER in contact_type:
-                self._function_dict[ContactTypes.USER].append(
-                    _conditional_wrapper(msg_types, fn)
-                )
-            if ContactTypes.CHATROOM in contact_type:
-                self._function_dict[ContactTypes.CHATROOM].append(
-                    _conditional_wrapper(msg_types, fn)
-                )
-            if ContactTypes.MP in contact_type:
-                self._function_dict[ContactTypes.MP].append(
-                    _conditional_wrapper(msg_types, fn)
-                )
+            if mode is ExecutionMode.LOOP:
+                wrapper = _conditional_wrapper(msg_types, fn, self.metrics)
+            else:
+                wrapper = self._offload_wrapper(msg_types, fn, mode)
+            for t in (ContactTypes.USER, ContactTypes.CHATROOM, ContactTypes.MP):
+                if t in contact_type:
+                    self._function_dict[t].append(wrapper)
             return fn
 
         return _msg_register
 
+    def _offload_wrapper(
+        self, filter_types, fn, mode: ExecutionMode
+    ) -> Callable[..., Awaitable]:
+        if inspect.iscoroutinefunction(fn):
+            raise VMalformedParameterError(f"{mode.value}模式的处理函数需要是普通函数")
+        # 进程池按照模块和名字找到处理函数，注册时函数还没有绑定到模块上，无法直接尝试pickle
+        if mode is ExecutionMode.PROCESS and "<" in getattr(fn, "__qualname__", "<"):
+            raise VMalformedParameterError("process模式的处理函数需要是模块级别的函数")
+        name = _handler_name(fn)
+
+        async def _run(msg: Message):
+            loop = asyncio.get_running_loop()
+            try:
+                with self.metrics.time_handler(name, on_loop=False):
+                    if mode is ExecutionMode.THREAD:
+                        result = await loop.run_in_executor(thread_pool(), fn, msg)
+                    else:
+                        result = await loop.run_in_executor(
+                            process_pool(), fn, _portable_message(msg)
+                        )
+                await self._send_replies(msg, result)
+            except Exception:
+                logger.warning(f"handler {name} failed\n" + traceback.format_exc())
+
+        async def _execute(msg: Message):
+            if msg.content.type not in filter_types:
+                return
+            # 线程池或进程池忙不过来时在这里等待，消息在Storage.msgs中排队
+            await self._offload_semaphore.acquire()
+            task = asyncio.create_task(_run(msg))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+            # 任务在开始运行之前被取消时也会调用，保证释放
+            task.add_done_callback(lambda _: self._offload_semaphore.release())
+
+        return _execute
+
+    async def _send_replies(self, msg: Message, result) -> None:
+        if result is None:
+            return
+        if isinstance(result, (str, Reply)):
+            result = [result]
+        for reply in result:
+            if isinstance(reply, str):
+                reply = Reply(text=reply)
+            to_username = reply.to_username
+            if to_username is None:
+                # 自己在其他设备上发送的消息，回复给接收者
+                is_mine = msg.from_.username == self._storage.myname
+                to_username = (msg.to if is_mine else msg.from_).username
+            if reply.text is not None:
+                await self.send_msg(reply.text, to_username)
+            if reply.file_path is not None:
+                send = {"image": self.send_image, "video": self.send_video}.get(
+                    reply.file_type, self.send_file
+                )
+                await send(to_username, file_path=Path(reply.file_path))
+
     async def _message_queue_consume_loop(self):
         logger.info("Start auto replying.")
         while True:
@@ -103,25 +189,31 @@ class CoreRegisterMixin(CoreInterface, ABC):
 
     @override
     async def run(self, exit_callback=None):
-        # `TaskGroup` is unavailable before 3.11
-        # async with asyncio.TaskGroup() as tg:
-        #     tg.create_task(self._message_queue_consume_loop())
-        #     tg.create_task(self.start_receiving(exit_callback))
-        # await self._net_helper.close()
+        # 接收循环结束（退出登录或者连续接收失败）后停止处理消息，run随之返回，
+        # AccountManager据此判断账号需要重启；任意一方抛出异常时另一方也会被取消
+        tasks = [
+            asyncio.create_task(self._message_queue_consume_loop()),
+            asyncio.create_task(self.start_receiving(exit_callback)),
+        ]
         try:
-            await asyncio.gather(
-                self._message_queue_consume_loop(),
-                self.start_receiving(exit_callback),
-            )
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            for task in done:
+                task.result()
         except CancelledError:
             self._alive = False
-            await self._net_helper.close()
             logger.debug("vchat received ^C and exit.")
             logger.info("Bye~")
             raise
         finally:
-            if self._alive:
-                await self._net_helper.close()
+            # 接收循环因为服务器退出登录而结束时_alive已经是False，同样需要关闭连接，重复关闭没有影响
+            await self.close()
+            await self.stop_metrics_server()
+            await self.stop_watchdog()
             if exit_callback is not None:
                 try:
                     logger.info("prepare to execute exit callback")
@@ -131,9 +223,33 @@ class CoreRegisterMixin(CoreInterface, ABC):
             logger.info("vchat exit")
 
 
-def _conditional_wrapper(filter_types, fn) -> Callable[..., Awaitable]:
+def _conditional_wrapper(
+    filter_types, fn, metrics: Metrics
+) -> Callable[..., Awaitable]:
+    name = _handler_name(fn)
+
     async def _execute(msg: Message):
         if msg.content.type in filter_types:
-            await fn(msg)
+            with metrics.time_handler(name):
+                await fn(msg)
 
     return _execute
+
+
+def _handler_name(fn) -> str:
+    # 示例中的回调函数都叫_，加上行号才能区分
+    name = f"{getattr(fn, '__module__', None)}.{getattr(fn, '__qualname__', repr(fn))}"
+    code = getattr(fn, "__code__", None)
+    if code is not None:
+        name += f":{code.co_firstlineno}"
+    return name
+
+
+def _portable_message(msg: Message) -> dict:
+    """
+    传给进程池的消息，媒体消息附带下载需要的全部信息
+    """
+    data = msg.todict()
+    if isinstance(msg.content, MediaContent):
+        data["content"]["download"] = msg.content.descriptor().todict()
+    return data
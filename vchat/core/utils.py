@@ -2,7 +2,10 @@ from abc import ABC
 from typing import Callable, Iterable
 import sys
 
+from vchat import config
 from vchat.core.interface import CoreInterface
+from vchat.loop import LagEvent, LoopWatchdog
+from vchat.metrics import MetricsServer
 from vchat.model import Contact, ContactTypes
 
 if sys.version_info >= (3, 12):
@@ -53,3 +56,53 @@ class CoreUtilsMixin(CoreInterface, ABC):
         return self.search_contact(
             lambda contact: name in contact.nickname, ContactTypes.CHATROOM
         )
+
+    @override
+    async def start_metrics_server(
+        self, host: str | None = None, port: int | None = None
+    ) -> None:
+        """
+        在本地启动Prometheus的抓取接口，GET /metrics返回文本格式，GET /metrics.json返回self.metrics.snapshot()
+        host和port默认为config.METRICS_HOST和config.METRICS_PORT
+        """
+        if self._metrics_server is not None:
+            return
+        server = MetricsServer(self.metrics, host, port)
+        await server.start()
+        self._metrics_server = server
+
+    @override
+    async def stop_metrics_server(self) -> None:
+        if self._metrics_server is not None:
+            await self._metrics_server.stop()
+            self._metrics_server = None
+
+    @override
+    def start_watchdog(
+        self,
+        threshold: float | None = None,
+        interval: float | None = None,
+    ) -> None:
+        """
+        启动事件循环的看门狗，延迟记录到self.metrics，阻塞事件见self.lag_events
+        """
+        if self._watchdog is not None:
+            return
+        self._watchdog = LoopWatchdog(self.metrics, threshold, interval)
+        self._watchdog.start()
+
+    @override
+    async def stop_watchdog(self) -> None:
+        if self._watchdog is not None:
+            await self._watchdog.stop()
+            self._watchdog = None
+
+    @override
+    @property
+    def lag_events(self) -> list[LagEvent]:
+        """
+        最近的事件循环阻塞事件，最多config.LOOP_LAG_MAX_EVENTS个
+        """
+        if self._watchdog is None:
+            return []
+        return list(self._watchdog.events)
@@ -24,9 +24,12 @@ class VNetworkError(VChatError):
 class VOperationFailedError(VChatError):
     """
     所有收发消息等需要网络请求的操作，都有可能收到服务器的错误指示，所以任何操作都有可能失败
+    ret是服务器返回的BaseResponse.Ret，没有时为None
     """
 
-    pass
+    def __init__(self, msg: str = "", ret: int | None = None):
+        super().__init__(msg)
+        self.ret = ret
 
 
 class VLoginError(VChatError):
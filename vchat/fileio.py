@@ -0,0 +1,79 @@
+import asyncio
+import functools
+from collections.abc import AsyncIterator, Callable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import BinaryIO, TypeVar
+
+from vchat import config
+
+T = TypeVar("T")
+
+# 文件读写会阻塞事件循环，大文件会拖慢消息接收和其他所有的收发操作，所以文件读写都交给线程池执行
+_executor: Executor | None = None
+
+
+def set_executor(executor: Executor | None) -> None:
+    """
+    设置执行文件读写的线程池，None表示使用默认的线程池（config.FILE_IO_WORKERS个线程）
+    """
+    global _executor
+    _executor = executor
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.FILE_IO_WORKERS, thread_name_prefix="vchat-io"
+        )
+    return _executor
+
+
+async def run_io(fn: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+
+@asynccontextmanager
+async def open_file(path: Path | str, mode: str = "rb") -> AsyncIterator[BinaryIO]:
+    """
+    在线程池中打开和关闭文件，读写文件时仍然需要通过run_io或者AsyncFileWriter
+    """
+    fd = await run_io(open, path, mode)
+    try:
+        yield fd
+    finally:
+        await run_io(fd.close)
+
+
+class AsyncFileWriter:
+    """
+    写入的数据先放入缓冲区，攒够buffer_size后再交给线程池写入，避免每个小块都切换一次线程
+    不小于buffer_size的数据块不经过缓冲区，直接写入
+    """
+
+    def __init__(self, fd: BinaryIO, buffer_size: int | None = None) -> None:
+        self._fd = fd
+        if buffer_size is None:
+            buffer_size = config.FILE_IO_BUFFER_SIZE
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        if len(data) >= self._buffer_size:
+            await self.flush()  # 先写入缓冲区中已有的数据，保持顺序
+            await run_io(self._fd.write, data)
+            return
+        self._buffer += data
+        if len(self._buffer) >= self._buffer_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, bytearray()
+        await run_io(self._fd.write, buffer)
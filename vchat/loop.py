@@ -0,0 +1,176 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Coroutine
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from vchat import config
+from vchat.config import logger
+from vchat.metrics import Metrics, MetricsGroup
+
+T = TypeVar("T")
+
+
+@dataclass
+class LagEvent:
+    """
+    一次事件循环被阻塞的记录
+    lag: 阻塞的时间（秒）
+    task: 阻塞时正在运行的task
+    handler: 阻塞时正在运行的消息处理函数，不是处理函数阻塞时为None
+    stack: 阻塞期间采样到的事件循环线程的调用栈，没有采样到时为None
+    """
+
+    time: float
+    lag: float
+    task: str | None
+    handler: str | None
+    stack: str | None
+
+
+class LoopWatchdog:
+    """
+    测量事件循环的延迟，超过threshold秒时记录阻塞事件循环的task、消息处理函数和调用栈
+    1. 事件循环中的心跳task每interval秒运行一次，实际间隔和interval的差就是延迟
+    2. 独立的线程检查心跳，心跳停止超过threshold秒时采样事件循环线程的调用栈，
+       此时阻塞事件循环的代码还在运行，采样到的就是罪魁祸首
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics | MetricsGroup | None = None,
+        threshold: float | None = None,
+        interval: float | None = None,
+        max_events: int | None = None,
+    ) -> None:
+        self.metrics = metrics or Metrics()
+        self.threshold = threshold or config.LOOP_LAG_THRESHOLD
+        self.interval = interval or config.LOOP_WATCHDOG_INTERVAL
+        if max_events is None:
+            max_events = config.LOOP_LAG_MAX_EVENTS
+        self.events: deque[LagEvent] = deque(maxlen=max_events)
+        self.max_lag = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._monitor_thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+        self._beat = 0  # 心跳的序号，监视线程据此判断心跳是否停止
+        self._beat_time = time.monotonic()
+        # 监视线程采样的结果，心跳恢复后和实际的延迟一起记录
+        self._sample: tuple[int, str | None, str | None, str] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._heartbeat_task is not None
+
+    def start(self) -> None:
+        """
+        需要在事件循环中调用
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._beat_time = time.monotonic()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._monitor_thread = threading.Thread(
+            target=self._monitor, name="vchat-watchdog", daemon=True
+        )
+        self._monitor_thread.start()
+
+    async def stop(self) -> None:
+        if self._heartbeat_task is None:
+            return
+        self._stopped.set()
+        self._heartbeat_task.cancel()
+        try:
+            await self._heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        self._heartbeat_task = None
+        if self._monitor_thread is not None:
+            self._monitor_thread.join()
+            self._monitor_thread = None
+
+    async def _heartbeat(self) -> None:
+        assert self._loop is not None
+        while True:
+            start = self._loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self._loop.time() - start - self.interval)
+            beat = self._beat
+            self._beat += 1
+            self._beat_time = time.monotonic()
+            self.metrics.observe_loop_lag(lag)
+            self.max_lag = max(self.max_lag, lag)
+            sample, self._sample = self._sample, None
+            if lag < self.threshold:
+                continue
+            if sample is not None and sample[0] == beat:
+                _, task, handler, stack = sample
+                event = LagEvent(time.time(), lag, task, handler, stack)
+            else:  # 阻塞时间刚好超过阈值，监视线程没有来得及采样
+                event = LagEvent(time.time(), lag, None, None, None)
+            self.events.append(event)
+            logger.warning(
+                "event loop blocked for %.3fs, task: %s, handler: %s%s",
+                lag,
+                event.task,
+                event.handler,
+                "\n" + event.stack if event.stack else "",
+            )
+
+    def _monitor(self) -> None:
+        check_interval = min(self.interval, self.threshold / 2)
+        sampled_beat = -1
+        while not self._stopped.wait(check_interval):
+            beat = self._beat
+            stalled = time.monotonic() - self._beat_time - self.interval
+            if stalled < self.threshold or beat == sampled_beat:
+                continue
+            sampled_beat = beat
+            try:
+                self._sample = (beat, *self._capture())
+            except Exception as e:  # 采样失败不应该影响监视线程
+                logger.debug("failed to sample event loop stack: %r", e)
+
+    def _capture(self) -> tuple[str | None, str | None, str]:
+        frame = sys._current_frames().get(self._loop_thread_id)  # type: ignore
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        task = asyncio.current_task(self._loop)
+        task_name = None
+        if task is not None:
+            coro = task.get_coro()
+            task_name = f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        return task_name, self.metrics.current_handler, stack
+
+
+def configure_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """
+    按照config.ASYNCIO_DEBUG设置事件循环的调试模式，调试模式下执行时间超过
+    config.SLOW_CALLBACK_DURATION秒的回调会被asyncio以WARNING级别记录到日志
+    """
+    if config.ASYNCIO_DEBUG:
+        loop.set_debug(True)
+        loop.slow_callback_duration = config.SLOW_CALLBACK_DURATION
+
+
+def run(main: Coroutine[Any, Any, T]) -> T:
+    """
+    代替asyncio.run，config.USE_UVLOOP为True时使用uvloop（需要安装uvloop）
+        vchat.loop.run(main())
+    """
+    if config.USE_UVLOOP:
+        try:
+            import uvloop
+
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            logger.warning("uvloop is not installed, fall back to asyncio")
+    return asyncio.run(main, debug=config.ASYNCIO_DEBUG or None)
@@ -0,0 +1,411 @@
+import bisect
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+
+import yarl
+from aiohttp import TraceConfig, web
+
+from vchat import config
+from vchat.config import logger
+
+
+class Histogram:
+    """
+    累积直方图，buckets是各个桶的上界（包含），和Prometheus的histogram相同
+    """
+
+    def __init__(self, buckets: tuple[float, ...] | None = None):
+        if buckets is None:
+            buckets = config.METRICS_LATENCY_BUCKETS
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)  # 落在每个桶中的次数，不累积
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> Iterator[tuple[float, int]]:
+        """
+        返回(上界, 不超过上界的次数)，最后一项的上界是inf
+        """
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+        yield float("inf"), self.count
+
+    def todict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {str(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class Metrics:
+    """
+    net层和消息分发循环的运行指标
+    1. 每个接口的请求数、耗时分布、发送和接收的字节数、按错误类型统计的失败次数
+    2. 每个消息处理函数的耗时分布和按错误类型统计的失败次数
+    3. gauge在读取时才计算，例如Storage.msgs中等待处理的消息数
+    labels会附加到输出的每一项指标上，多个账号的指标合并输出时用于区分账号，例如{"account": "alice"}
+    """
+
+    def __init__(self, labels: dict[str, str] | None = None) -> None:
+        self.labels: tuple[tuple[str, str], ...] = tuple((labels or {}).items())
+        self.requests: defaultdict[str, int] = defaultdict(int)
+        self.request_latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self.bytes_sent: defaultdict[str, int] = defaultdict(int)
+        self.bytes_received: defaultdict[str, int] = defaultdict(int)
+        # (endpoint, 错误类型) -> 次数
+        self.request_errors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.handler_latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        # (handler, 错误类型) -> 次数
+        self.handler_errors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.gauges: dict[str, Callable[[], float]] = {}
+        # 事件循环的延迟，只有启用LoopWatchdog时才有数据
+        self.loop_lag = Histogram()
+        # 正在运行的消息处理函数，LoopWatchdog据此判断是哪个处理函数阻塞了事件循环
+        self.current_handler: str | None = None
+
+    def observe_request(self, endpoint: str, seconds: float) -> None:
+        self.requests[endpoint] += 1
+        self.request_latency[endpoint].observe(seconds)
+
+    def record_request_error(self, endpoint: str, error: BaseException) -> None:
+        self.request_errors[(endpoint, _error_type(error))] += 1
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        self.loop_lag.observe(seconds)
+
+    @contextmanager
+    def time_handler(self, handler: str, on_loop: bool = True) -> Iterator[None]:
+        """
+        on_loop为False表示处理函数在线程池或进程池中运行，多个可以同时进行，
+        只记录耗时和错误，不设置current_handler
+        """
+        start = time.perf_counter()
+        if on_loop:
+            previous, self.current_handler = self.current_handler, handler
+        try:
+            yield
+        except Exception as e:
+            self.handler_errors[(handler, type(e).__name__)] += 1
+            raise
+        finally:
+            if on_loop:
+                self.current_handler = previous
+            self.handler_latency[handler].observe(time.perf_counter() - start)
+
+    def set_gauge(self, name: str, fn: Callable[[], float]) -> None:
+        self.gauges[name] = fn
+
+    def trace_config(self) -> TraceConfig:
+        """
+        统计实际发送和接收的字节数，需要在创建ClientSession时传入trace_configs
+        没有通过RequestExecutor发出的请求没有endpoint，使用url的最后一段
+        """
+
+        def endpoint(ctx: SimpleNamespace, url: yarl.URL) -> str:
+            request_ctx = ctx.trace_request_ctx
+            if isinstance(request_ctx, dict) and "endpoint" in request_ctx:
+                return request_ctx["endpoint"]
+            return url.name or str(url)
+
+        async def on_chunk_sent(session, ctx, params) -> None:
+            self.bytes_sent[endpoint(ctx, params.url)] += len(params.chunk)
+
+        async def on_chunk_received(session, ctx, params) -> None:
+            self.bytes_received[endpoint(ctx, params.url)] += len(params.chunk)
+
+        trace_config = TraceConfig()
+        trace_config.on_request_chunk_sent.append(on_chunk_sent)
+        trace_config.on_response_chunk_received.append(on_chunk_received)
+        return trace_config
+
+    def snapshot(self) -> dict:
+        """
+        返回所有指标的当前值，结果可以直接json序列化
+        """
+        return {
+            "requests": {
+                endpoint: {
+                    "count": count,
+                    "latency": self.request_latency[endpoint].todict(),
+                    "bytes_sent": self.bytes_sent.get(endpoint, 0),
+                    "bytes_received": self.bytes_received.get(endpoint, 0),
+                    "errors": {
+                        error: n
+                        for (e, error), n in self.request_errors.items()
+                        if e == endpoint
+                    },
+                }
+                for endpoint, count in self.requests.items()
+            },
+            "handlers": {
+                handler: {
+                    "latency": histogram.todict(),
+                    "errors": {
+                        error: n
+                        for (h, error), n in self.handler_errors.items()
+                        if h == handler
+                    },
+                }
+                for handler, histogram in self.handler_latency.items()
+            },
+            "loop_lag": self.loop_lag.todict(),
+            "gauges": {name: value for name, value in self._read_gauges()},
+        }
+
+    def render_prometheus(self) -> str:
+        """
+        Prometheus的文本格式
+        """
+        return _render(self.collect())
+
+    def collect(self) -> dict[str, "_Family"]:
+        """
+        按指标名分组的所有样本，MetricsGroup据此合并多个Metrics的输出
+        """
+        families: dict[str, _Family] = {}
+        const = self.labels
+        _counter(
+            families,
+            "vchat_requests_total",
+            "Requests sent, by endpoint",
+            {(*const, ("endpoint", e)): n for e, n in self.requests.items()},
+        )
+        _histogram(
+            families,
+            "vchat_request_duration_seconds",
+            "Request latency including reading the response, by endpoint",
+            const,
+            "endpoint",
+            self.request_latency,
+        )
+        _counter(
+            families,
+            "vchat_request_sent_bytes_total",
+            "Request body bytes sent, by endpoint",
+            {(*const, ("endpoint", e)): n for e, n in self.bytes_sent.items()},
+        )
+        _counter(
+            families,
+            "vchat_response_received_bytes_total",
+            "Response body bytes received, by endpoint",
+            {(*const, ("endpoint", e)): n for e, n in self.bytes_received.items()},
+        )
+        _counter(
+            families,
+            "vchat_request_errors_total",
+            "Failed requests, by endpoint and error type",
+            {
+                (*const, ("endpoint", e), ("type", t)): n
+                for (e, t), n in self.request_errors.items()
+            },
+        )
+        _histogram(
+            families,
+            "vchat_handler_duration_seconds",
+            "Message handler latency, by handler",
+            const,
+            "handler",
+            self.handler_latency,
+        )
+        _counter(
+            families,
+            "vchat_handler_errors_total",
+            "Message handler failures, by handler and error type",
+            {
+                (*const, ("handler", h), ("type", t)): n
+                for (h, t), n in self.handler_errors.items()
+            },
+        )
+        if self.loop_lag.count:
+            _histogram(
+                families,
+                "vchat_loop_lag_seconds",
+                "Event loop lag measured by the watchdog",
+                const,
+                None,
+                {"": self.loop_lag},
+            )
+        for name, value in self._read_gauges():
+            family = families.setdefault(name, _Family("gauge"))
+            family.samples.append(f"{name}{_labels(const)} {_format_value(value)}")
+        return families
+
+    def _read_gauges(self) -> Iterator[tuple[str, float]]:
+        for name, fn in self.gauges.items():
+            try:
+                yield name, fn()
+            except Exception as e:  # gauge出错不应该影响其他指标
+                logger.warning(f"failed to read gauge {name}: {e!r}")
+
+
+class MetricsGroup:
+    """
+    合并同一个进程中多个账号的指标，接口和Metrics相同，可以直接传给MetricsServer和LoopWatchdog
+    base记录不属于某个账号的指标，例如事件循环的延迟和账号数量
+    """
+
+    def __init__(self, base: Metrics | None = None) -> None:
+        self.base = base or Metrics()
+        self.members: dict[str, Metrics] = {}
+
+    def add(self, name: str, metrics: Metrics) -> None:
+        self.members[name] = metrics
+
+    def remove(self, name: str) -> None:
+        self.members.pop(name, None)
+
+    @property
+    def current_handler(self) -> str | None:
+        for metrics in self.members.values():
+            if metrics.current_handler is not None:
+                return metrics.current_handler
+        return None
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        self.base.observe_loop_lag(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.base.snapshot(),
+            "accounts": {
+                name: metrics.snapshot() for name, metrics in self.members.items()
+            },
+        }
+
+    def collect(self) -> dict[str, "_Family"]:
+        families = self.base.collect()
+        for metrics in list(self.members.values()):
+            for name, family in metrics.collect().items():
+                merged = families.setdefault(name, _Family(family.type, family.help))
+                merged.samples.extend(family.samples)
+        return families
+
+    def render_prometheus(self) -> str:
+        return _render(self.collect())
+
+
+class MetricsServer:
+    """
+    在本地提供Prometheus的抓取接口，GET /metrics返回文本格式，GET /metrics.json返回metrics.snapshot()
+    """
+
+    def __init__(
+        self,
+        metrics: Metrics | MetricsGroup,
+        host: str | None = None,
+        port: int | None = None,
+    ) -> None:
+        self.metrics = metrics
+        self.host = host if host is not None else config.METRICS_HOST
+        self.port = port if port is not None else config.METRICS_PORT
+        self._runner: web.AppRunner | None = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._prometheus)
+        app.router.add_get("/metrics.json", self._json)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"metrics server listening on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _prometheus(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=self.metrics.render_prometheus(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def _json(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics.snapshot())
+
+
+def _error_type(error: BaseException) -> str:
+    # RequestExecutor转换后的VNetworkError等错误保留了原始错误，原始错误的类型更有用
+    cause = error.__cause__
+    return type(cause if cause is not None else error).__name__
+
+
+@dataclass
+class _Family:
+    type: str
+    help: str | None = None
+    samples: list[str] = field(default_factory=list)
+
+
+def _render(families: dict[str, _Family]) -> str:
+    lines: list[str] = []
+    for name, family in families.items():
+        if family.help is not None:
+            lines.append(f"# HELP {name} {family.help}")
+        lines.append(f"# TYPE {name} {family.type}")
+        lines.extend(family.samples)
+    return "\n".join(lines) + "\n"
+
+
+def _counter(
+    families: dict[str, _Family],
+    name: str,
+    help_text: str,
+    samples: dict[tuple[tuple[str, str], ...], int],
+) -> None:
+    family = families.setdefault(name, _Family("counter", help_text))
+    for labels, value in samples.items():
+        family.samples.append(f"{name}{_labels(labels)} {_format_value(value)}")
+
+
+def _histogram(
+    families: dict[str, _Family],
+    name: str,
+    help_text: str,
+    const: tuple[tuple[str, str], ...],
+    label: str | None,
+    histograms: dict[str, Histogram],
+) -> None:
+    family = families.setdefault(name, _Family("histogram", help_text))
+    for key, histogram in histograms.items():
+        key_labels = (*const, (label, key)) if label is not None else const
+        for bound, count in histogram.cumulative():
+            labels = _labels((*key_labels, ("le", _format_value(bound))))
+            family.samples.append(f"{name}_bucket{labels} {count}")
+        labels = _labels(key_labels)
+        family.samples.append(f"{name}_sum{labels} {_format_value(histogram.sum)}")
+        family.samples.append(f"{name}_count{labels} {histogram.count}")
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
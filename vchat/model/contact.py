@@ -128,3 +128,15 @@ class MediaTypes(enum.Enum):
     DOC = "doc"
     IMG = "pic"
     VIDEO = "video"
+
+    @staticmethod
+    def from_file_name(file_name: str) -> "MediaTypes":
+        if "." not in file_name:
+            return MediaTypes.DOC
+        match file_name.split(".")[-1].lower():
+            case "jpg" | "jpeg" | "png":
+                return MediaTypes.IMG
+            case "mp4":
+                return MediaTypes.VIDEO
+            case _:
+                return MediaTypes.DOC
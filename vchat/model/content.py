@@ -1,7 +1,7 @@
 import enum
 import re
 from abc import ABC, abstractmethod
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncIterator, Awaitable, Callable
 from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
@@ -11,6 +11,7 @@ from vchat.config import logger
 
 if TYPE_CHECKING:
     from vchat.model import RawMessage
+    from vchat.net.download import DownloadDescriptor
     from vchat.net.interface import NetHelperInterface
 
 
@@ -124,8 +125,30 @@ class TextContent(Content):
         return {"type": "text", "content": self.content, "is_at_me": self.is_at_me}
 
 
+class MediaContent(Content, ABC):
+    """
+    图片、视频、音频、文件等可以下载的内容，子类都有download_fn属性
+    """
+
+    download_fn: Callable[..., Awaitable]
+
+    def stream(self, chunk_size: int | None = None) -> AsyncIterator[bytes]:
+        """
+        逐块读取媒体，适合将媒体转发给其他地方而不需要完整的副本
+        async for chunk in content.stream():
+            ...
+        """
+        return self.download_fn.stream(chunk_size)
+
+    def descriptor(self) -> "DownloadDescriptor":
+        """
+        可以序列化的下载描述，用于在其他进程中下载媒体，见DownloadDescriptor
+        """
+        return self.download_fn.descriptor()
+
+
 @dataclass
-class ImageContent(Content):
+class ImageContent(MediaContent):
     type = ContentTypes.IMAGE
     msg_id: str
     download_fn: Callable[..., Awaitable]
@@ -143,7 +166,7 @@ class ImageContent(Content):
 
 
 @dataclass
-class VideoContent(Content):
+class VideoContent(MediaContent):
     type = ContentTypes.VIDEO
     msg_id: str
     download_fn: Callable[..., Awaitable]
@@ -161,7 +184,7 @@ class VideoContent(Content):
 
 
 @dataclass
-class VoiceContent(Content):
+class VoiceContent(MediaContent):
     type = ContentTypes.VOICE
     msg_id: str
     download_fn: Callable[..., Awaitable]
@@ -179,7 +202,7 @@ class VoiceContent(Content):
 
 
 @dataclass
-class AttachContent(Content):
+class AttachContent(MediaContent):
     type = ContentTypes.ATTACH
     sender: str
     media_id: str
@@ -1,6 +1,8 @@
+import enum
 import sys
 from collections.abc import Mapping
 from dataclasses import dataclass
+from typing import Literal
 
 from vchat.model import Contact
 from vchat.model import Content
@@ -87,3 +89,27 @@ class Message:
             ),
             "create_time": self.create_time,
         }
+
+
+class ExecutionMode(str, enum.Enum):
+    """
+    消息处理函数的运行方式，见Core.msg_register
+    """
+
+    LOOP = "loop"  # 在事件循环中运行，处理函数是协程函数
+    THREAD = "thread"  # 在线程池中运行，适合会阻塞但释放GIL的操作，例如调用C扩展
+    PROCESS = "process"  # 在进程池中运行，适合CPU密集的操作，例如OCR、图片哈希
+
+
+@dataclass
+class Reply:
+    """
+    在线程或进程中运行的处理函数返回的回复，由主进程发送
+    to_username为None时回复给消息的来源，群聊消息回复到群里
+    file_path不为None时按照file_type发送文件、图片或视频
+    """
+
+    text: str | None = None
+    file_path: str | None = None
+    file_type: Literal["file", "image", "video"] = "file"
+    to_username: str | None = None
@@ -7,6 +7,7 @@ from typing import BinaryIO
 from vchat.errors import VOperationFailedError
 from vchat.model import User
 from vchat.net.interface import NetHelperInterface, catch_exception
+from vchat.net.writer import FileWriter, stream_response
 
 if sys.version_info >= (3, 12):
     from typing import override
@@ -28,8 +29,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "List": [{"UserName": u, "ChatRoomId": ""} for u in usernames],
         }
 
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
         return dic["ContactList"]  # type: ignore
 
     @override
@@ -42,9 +43,10 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "skey": self.login_info.skey,
             "type": "big",
         }
-        async with self.session.get(url, params=params) as resp:
-            async for chunk in resp.content.iter_chunked(1024):
-                fd.write(chunk)
+        async with self._request(
+            "GET", url, session=self.file_session, params=params
+        ) as resp:
+            await stream_response(resp, FileWriter(fd))
 
     @override
     @catch_exception
@@ -60,9 +62,10 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "skey": self.login_info.skey,
             "type": "big",
         }
-        async with self.session.get(url, params=params) as resp:
-            async for chunk in resp.content.iter_chunked(1024):
-                fd.write(chunk)
+        async with self._request(
+            "GET", url, session=self.file_session, params=params
+        ) as resp:
+            await stream_response(resp, FileWriter(fd))
 
     @override
     @catch_exception
@@ -77,8 +80,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "Topic": topic,
         }
 
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"创建群聊{topic}失败")
 
@@ -94,8 +97,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "NewTopic": name,
         }
         # TODO: 验证是否使用urlencoded
-        async with self.session.post(url, params=params, data=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, data=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(
                     f"设置群聊{chatroom_username}名称为{name}失败"
@@ -115,8 +118,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "DelMemberList": ",".join([member["UserName"] for member in members]),
         }
         # TODO: 验证是否使用urlencoded
-        async with self.session.post(url, params=params, data=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, data=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"从{chatroom_username}删除{members}失败")
 
@@ -132,8 +135,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "ChatRoomName": chatroom_name,
             "AddMemberList": members,
         }
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"向{chatroom_name}添加{members}失败")
 
@@ -149,8 +152,8 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
             "ChatRoomName": chatroom_name,
             "InviteMemberList": members,
         }
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"邀请{members}加入{chatroom_name}失败")
 
@@ -170,7 +173,7 @@ class NetHelperChatroomMixin(NetHelperInterface, ABC):
                 for member in members
             ],
         }
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             for member in dic["ContactList"]:
                 yield User(**member)
@@ -0,0 +1,77 @@
+import json
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+from vchat import config
+from vchat.config import logger
+from vchat.errors import VMalformedParameterError
+
+
+@dataclass(frozen=True)
+class JsonCodec:
+    """
+    json编解码器，dumps返回str（aiohttp的json_serialize要求），loads接受bytes或str
+    解码失败时抛出ValueError
+    """
+
+    name: str
+    dumps: Callable[[Any], str]
+    loads: Callable[[bytes | str], Any]
+
+
+def _stdlib_codec() -> JsonCodec:
+    return JsonCodec(
+        "stdlib", lambda obj: json.dumps(obj, ensure_ascii=False), json.loads
+    )
+
+
+def _orjson_codec() -> JsonCodec:
+    import orjson
+
+    # orjson.JSONDecodeError是ValueError的子类
+    return JsonCodec("orjson", lambda obj: orjson.dumps(obj).decode(), orjson.loads)
+
+
+def _msgspec_codec() -> JsonCodec:
+    import msgspec
+
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def loads(data: bytes | str) -> Any:
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    return JsonCodec("msgspec", lambda obj: encoder.encode(obj).decode(), loads)
+
+
+_CODECS: dict[str, Callable[[], JsonCodec]] = {
+    "stdlib": _stdlib_codec,
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+}
+
+
+def get_codec(name: str | None = None) -> JsonCodec:
+    """
+    根据名称获取json编解码器，默认使用config.JSON_CODEC
+    "auto"依次尝试orjson，msgspec，都没有安装时使用标准库
+    """
+    name = name or config.JSON_CODEC
+    if name == "auto":
+        for candidate in ("orjson", "msgspec"):
+            try:
+                return _CODECS[candidate]()
+            except ImportError:
+                continue
+        return _stdlib_codec()
+    if name not in _CODECS:
+        raise VMalformedParameterError(f"unknown json codec: {name}")
+    try:
+        return _CODECS[name]()
+    except ImportError:
+        logger.warning("json codec %s is not installed, fall back to stdlib", name)
+        return _stdlib_codec()
@@ -1,9 +1,19 @@
-import io
+import functools
 from abc import ABC
-from collections.abc import Callable, Awaitable
+from collections.abc import AsyncIterator, Callable, Awaitable
+from dataclasses import asdict, dataclass
+from pathlib import Path
 from typing import TYPE_CHECKING
 
+import aiohttp
+from aiohttp import ClientSession
+
+from vchat import config, fileio
+from vchat.config import logger
+from vchat.net.executor import RequestExecutor, RequestFn
 from vchat.net.interface import NetHelperInterface, catch_exception
+from vchat.net.ranged import RangedDownloader, check_size
+from vchat.net.writer import BufferWriter, FileWriter, content_length, stream_response
 
 if TYPE_CHECKING:
     from vchat.model import RawMessage
@@ -16,46 +26,237 @@ else:
 import yarl
 
 
+class MediaDownload:
+    """
+    消息中的download_fn，调用即可下载媒体
+    download_path为None时返回下载的数据（bytes），否则写入download_path
+    """
+
+    def __init__(
+        self,
+        net_helper: NetHelperInterface,
+        key: str,
+        url: str,
+        params: dict,
+        headers: dict | None = None,
+        ranged: bool = False,
+    ) -> None:
+        self._net_helper = net_helper
+        self.key = key
+        self.url = url
+        self.params = params
+        self.headers = headers
+        self.ranged = ranged
+
+    @catch_exception
+    async def __call__(self, download_path: Path | str | None = None):
+        return await self._net_helper.download_manager.download(
+            self.key, self._to_memory, self._to_file, download_path
+        )
+
+    def prefetch(self, max_size: int | None = None) -> None:
+        """
+        在后台下载到内存，之后调用download_fn时直接返回数据或者等待下载完成
+        max_size不为None时，大小未知或者超过max_size的媒体不会预取
+        """
+        self._net_helper.download_manager.prefetch(
+            self.key, functools.partial(self._to_memory, max_size)
+        )
+
+    async def stream(self, chunk_size: int | None = None) -> AsyncIterator[bytes]:
+        """
+        逐块读取媒体，不在内存或者磁盘上保存完整的副本，消费者读取下一块之前不会继续接收数据
+        已经预取或者缓存的媒体直接从内存或者磁盘读取
+        从网络读取时，整个读取过程占用DownloadManager的一个下载名额，但不与同一个媒体的其他下载合并
+        """
+        chunk_size = chunk_size or config.DOWNLOAD_CHUNK_SIZE
+        manager = self._net_helper.download_manager
+        data = manager.get_prefetched(self.key)
+        if data is not None:
+            for start in range(0, len(data), chunk_size):
+                yield data[start : start + chunk_size]
+            return
+        cached = await manager.get_cached_path(self.key)
+        if cached is not None:
+            async with fileio.open_file(cached, "rb") as f:
+                while chunk := await fileio.run_io(f.read, chunk_size):
+                    yield chunk
+            return
+
+        received = 0
+        async with manager.slot():
+            async with self._request(
+                "GET", self.url, params=self.params, headers=self.headers
+            ) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    received += len(chunk)
+                    yield chunk
+                check_size(received, content_length(resp))
+
+    def descriptor(self) -> "DownloadDescriptor":
+        """
+        导出下载需要的全部信息，可以在其他进程中下载
+        """
+        cookies = self._net_helper.file_session.cookie_jar.filter_cookies(
+            yarl.URL(self.url)
+        )
+        return DownloadDescriptor(
+            key=self.key,
+            url=self.url,
+            params={k: v for k, v in self.params.items() if v is not None},
+            headers=dict(self.headers or {}),
+            cookies={name: morsel.value for name, morsel in cookies.items()},
+            ranged=self.ranged,
+        )
+
+    def _request(self, method: str, url: str, **kwargs):
+        return self._net_helper._request(
+            method, url, session=self._net_helper.file_session, **kwargs
+        )
+
+    async def _to_memory(self, max_size: int | None = None) -> bytes | None:
+        return await fetch_to_memory(
+            self._request, self.url, self.params, self.headers, max_size
+        )
+
+    async def _to_file(self, download_path: Path) -> None:
+        await fetch_to_file(
+            self._request,
+            self.url,
+            self.params,
+            self.headers,
+            download_path,
+            self.ranged,
+        )
+
+
+@dataclass(frozen=True)
+class DownloadDescriptor:
+    """
+    可以序列化的下载描述，包含请求的地址、参数以及需要的cookie
+    消息离开当前进程（放入队列、交给其他进程）后，仍然可以通过它下载媒体，不经过主事件循环
+    cookie和skey等参数只在登录有效期内有效
+    """
+
+    key: str
+    url: str
+    params: dict[str, str]
+    headers: dict[str, str]
+    cookies: dict[str, str]
+    ranged: bool = False
+
+    def todict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def fromdict(d: dict) -> "DownloadDescriptor":
+        return DownloadDescriptor(**d)
+
+    @catch_exception
+    async def download(
+        self,
+        download_path: Path | str | None = None,
+        session: ClientSession | None = None,
+    ) -> bytes | None:
+        """
+        download_path为None时返回下载的数据（bytes），否则写入download_path
+        session为None时创建新的会话，多次下载时可以传入同一个会话复用连接
+        """
+        if session is None:
+            async with ClientSession(
+                cookie_jar=aiohttp.CookieJar(unsafe=config.COOKIE_JAR_UNSAFE),
+                headers={"User-Agent": config.USER_AGENT},
+            ) as new_session:
+                return await self.download(download_path, new_session)
+        session.cookie_jar.update_cookies(self.cookies, yarl.URL(self.url))
+        request = functools.partial(RequestExecutor().request, session)
+        if download_path is None:
+            return await fetch_to_memory(request, self.url, self.params, self.headers)
+        await fetch_to_file(
+            request,
+            self.url,
+            self.params,
+            self.headers,
+            Path(download_path),
+            self.ranged,
+        )
+        return None
+
+
+# TODO: 可能会禁用默认header
+async def fetch_to_memory(
+    request: RequestFn,
+    url: str,
+    params: dict,
+    headers: dict | None,
+    max_size: int | None = None,
+) -> bytes | None:
+    """
+    max_size不为None时，大小未知或者超过max_size的媒体不会下载，返回None
+    """
+    async with request("GET", url, params=params, headers=headers) as resp:
+        size = content_length(resp)
+        if max_size is not None and (size is None or size > max_size):
+            return None
+        writer = BufferWriter()
+        check_size(await stream_response(resp, writer), size)
+        return writer.getvalue()
+
+
+async def fetch_to_file(
+    request: RequestFn,
+    url: str,
+    params: dict,
+    headers: dict | None,
+    download_path: Path,
+    ranged: bool = False,
+) -> None:
+    if ranged:
+        downloader = RangedDownloader(request, url, params, headers)
+        return await downloader.download(download_path)
+    async with request("GET", url, params=params, headers=headers) as resp:
+        async with fileio.open_file(download_path, "wb") as f:
+            received = await stream_response(resp, FileWriter(f))
+        check_size(received, content_length(resp))
+
+
 class NetHelperDownloadMixin(NetHelperInterface, ABC):
     @override
     def _get_download_fn(
-        self, url: str, params: dict, headers: dict | None = None
+        self,
+        key: str,
+        url: str,
+        params: dict,
+        headers: dict | None = None,
+        ranged: bool = False,
     ) -> Callable[..., Awaitable]:
+        """
+        key唯一标识下载的内容，用于合并同时进行的相同下载以及磁盘缓存
+        ranged为True时，下载到文件使用分段的Range请求，可以从中断的位置继续
+        """
         assert self.login_info.url is not None
-        url = self.login_info.url + url
-
-        @catch_exception
-        async def download_fn(download_path=None):
-            # TODO: 可能会禁用默认header
-            async with self.session.get(url, params=params, headers=headers) as resp:
-                if download_path is None:
-                    with io.BytesIO() as output:
-                        async for chunk in resp.content.iter_chunked(1024):
-                            output.write(chunk)
-                        return output.getvalue()
-                else:
-                    with open(download_path, "wb") as f:
-                        async for chunk in resp.content.iter_chunked(1024):
-                            f.write(chunk)
-                        return
-
-        return download_fn
+        return MediaDownload(
+            self, key, self.login_info.url + url, params, headers, ranged
+        )
 
     @override
     def get_img_download_fn(self, msg_id: str) -> Callable[..., Awaitable]:
         params = {"msgid": msg_id, "skey": self.login_info.skey}
-        return self._get_download_fn("/webwxgetmsgimg", params)
+        return self._get_download_fn(f"img:{msg_id}", "/webwxgetmsgimg", params)
 
     @override
     def get_voice_download_fn(self, msg_id: str):
         params = {"msgid": msg_id, "skey": self.login_info.skey}
-        return self._get_download_fn("/webwxgetvoice", params)
+        return self._get_download_fn(f"voice:{msg_id}", "/webwxgetvoice", params)
 
     @override
     def get_video_download_fn(self, msg_id: str):
         params = {"msgid": msg_id, "skey": self.login_info.skey}
         headers = {"Range": "bytes=0-"}
-        return self._get_download_fn("/webwxgetvideo", params, headers=headers)
+        return self._get_download_fn(
+            f"video:{msg_id}", "/webwxgetvideo", params, headers=headers, ranged=True
+        )
 
     @override
     def get_attach_download_fn(self, rmsg: "RawMessage|dict[str, str]"):
@@ -70,4 +271,6 @@ class NetHelperDownloadMixin(NetHelperInterface, ABC):
                 yarl.URL(self.login_info.url)
             )["webwx_data_ticket"].value,
         }
-        return self._get_download_fn("/webwxgetmedia", params)
+        return self._get_download_fn(
+            f"attach:{rmsg['MediaId']}", "/webwxgetmedia", params, ranged=True
+        )
@@ -0,0 +1,192 @@
+import asyncio
+import shutil
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+from vchat import config, fileio
+from vchat.config import logger
+from vchat.storage.disk_cache import DiskCache
+
+
+class DownloadManager:
+    """
+    统一管理所有媒体下载
+    1. 同时进行的下载数不超过concurrency，MediaDownload.stream也占用下载名额
+    2. 同一个key（消息id或者media_id）同时只会下载一次，其他调用者等待同一个下载完成
+       stream不保存数据，不参与去重
+    3. 设置了磁盘缓存时，下载完成的文件写入缓存，再次下载时直接从缓存读取
+    4. 预取的数据保存在内存中，总大小不超过prefetch_max_bytes，超过时淘汰最久未使用的
+    内存中的数据会交给多个调用者，统一保存为不可变的bytes
+    """
+
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        cache: DiskCache | None = None,
+        prefetch_max_bytes: int | None = None,
+    ) -> None:
+        if concurrency is None:
+            concurrency = config.DOWNLOAD_CONCURRENCY
+        if prefetch_max_bytes is None:
+            prefetch_max_bytes = config.PREFETCH_MAX_BYTES
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: dict[str, asyncio.Task[bytes | Path | None]] = {}
+        self.cache = cache
+        self.prefetch_max_bytes = prefetch_max_bytes
+        self._prefetched: OrderedDict[str, bytes] = OrderedDict()
+        self._prefetched_bytes = 0
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def slot(self) -> asyncio.Semaphore:
+        """
+        不经过download的下载用它占用一个下载名额
+            async with manager.slot():
+                ...
+        """
+        return self._semaphore
+
+    async def download(
+        self,
+        key: str,
+        to_memory: Callable[[], Awaitable[bytes | None]],
+        to_file: Callable[[Path], Awaitable[None]],
+        download_path: Path | str | None = None,
+    ) -> bytes | None:
+        """
+        download_path为None时返回下载的数据，否则写入download_path
+        to_memory和to_file执行实际的下载
+        """
+        if download_path is not None:
+            download_path = Path(download_path)
+        data = self.get_prefetched(key)
+        if data is not None:
+            return await self._deliver(data, download_path)
+        cached = await self.get_cached_path(key)
+        if cached is not None:
+            return await self._deliver(cached, download_path)
+
+        while True:
+            task = self._inflight.get(key)
+            if task is None:
+                task = self._start(key, to_memory, to_file, download_path)
+            else:
+                logger.debug("join inflight download: %s", key)
+            # 一个调用者被取消时，不影响其他等待同一个下载的调用者
+            result = await asyncio.shield(task)
+            if result is not None:
+                return await self._deliver(result, download_path)
+            # 加入的是被放弃的预取（媒体超过了预取的大小限制），重新下载
+
+    def get_prefetched(self, key: str) -> bytes | None:
+        data = self._prefetched.get(key)
+        if data is not None:
+            self._prefetched.move_to_end(key)
+        return data
+
+    async def get_cached_path(self, key: str) -> Path | None:
+        if self.cache is None:
+            return None
+        cached = await fileio.run_io(self.cache.get_path, key)
+        if cached is not None:
+            logger.debug("download cache hit: %s", key)
+        return cached
+
+    def prefetch(
+        self, key: str, to_memory: Callable[[], Awaitable[bytes | None]]
+    ) -> None:
+        """
+        在后台下载到内存，to_memory返回None表示放弃预取
+        """
+        if key in self._prefetched or key in self._inflight:
+            return
+        task = self._start(key, to_memory, None, None)
+        task.add_done_callback(lambda t: self._on_prefetched(key, t))
+
+    def _start(
+        self,
+        key: str,
+        to_memory: Callable[[], Awaitable[bytes | None]],
+        to_file: Callable[[Path], Awaitable[None]] | None,
+        download_path: Path | None,
+    ) -> asyncio.Task[bytes | Path | None]:
+        task = asyncio.create_task(
+            self._download(key, to_memory, to_file, download_path)
+        )
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    async def _download(
+        self,
+        key: str,
+        to_memory: Callable[[], Awaitable[bytes | None]],
+        to_file: Callable[[Path], Awaitable[None]] | None,
+        download_path: Path | None,
+    ) -> bytes | Path | None:
+        async with self._semaphore:
+            if download_path is None:
+                data = await to_memory()
+                if data is not None:
+                    data = bytes(data)  # 已经是bytes时不复制
+                if data is not None and self.cache is not None:
+                    await fileio.run_io(self.cache.put, key, data)
+                return data
+            assert to_file is not None
+            await to_file(download_path)
+            if self.cache is not None:
+                await fileio.run_io(self.cache.put_file, key, download_path)
+            return download_path
+
+    def _on_done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 所有调用者都被取消时，避免asyncio报告异常没有被获取
+
+    def _on_prefetched(self, key: str, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        data = task.result()
+        if not isinstance(data, bytes) or len(data) > self.prefetch_max_bytes:
+            return
+        self._prefetched[key] = data
+        self._prefetched_bytes += len(data)
+        while self._prefetched_bytes > self.prefetch_max_bytes:
+            _, evicted = self._prefetched.popitem(last=False)
+            self._prefetched_bytes -= len(evicted)
+
+    def clear_prefetched(self) -> None:
+        self._prefetched.clear()
+        self._prefetched_bytes = 0
+
+    @staticmethod
+    async def _deliver(
+        result: bytes | Path, download_path: Path | None
+    ) -> bytes | None:
+        """
+        将下载结果转换为调用者需要的形式
+        """
+        if isinstance(result, Path):
+            if download_path is None:
+                return await fileio.run_io(result.read_bytes)
+            if result != download_path:
+                await fileio.run_io(shutil.copyfile, result, download_path)
+            return None
+        if download_path is None:
+            return result
+        async with fileio.open_file(download_path, "wb") as f:
+            await fileio.run_io(f.write, result)
+        return None
+
+
+def create_download_manager() -> DownloadManager:
+    cache = None
+    if config.DOWNLOAD_CACHE_DIR is not None:
+        cache = DiskCache(config.DOWNLOAD_CACHE_DIR, config.DOWNLOAD_CACHE_MAX_BYTES)
+    return DownloadManager(
+        config.DOWNLOAD_CONCURRENCY, cache, config.PREFETCH_MAX_BYTES
+    )
@@ -0,0 +1,264 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncContextManager
+
+import yarl
+from aiohttp import ClientError, ClientResponse, ClientResponseError, ClientSession
+from aiohttp import ClientTimeout
+
+from vchat import config
+from vchat.config import logger
+from vchat.errors import VChatError, VNetworkError, VOperationFailedError
+from vchat.metrics import Metrics
+from vchat.net.retry import RetryBudget, RetryPolicy
+
+# 发出请求的函数，参数和session.request相同，返回响应的异步上下文管理器
+RequestFn = Callable[..., AsyncContextManager[ClientResponse]]
+
+
+class VCircuitOpenError(VNetworkError):
+    """
+    接口连续失败后熔断，retry_after秒内的请求直接失败，不会发出
+    """
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"{endpoint}连续失败，{retry_after:.1f}秒后重试")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    连续失败failure_threshold次后断开reset_timeout秒，之后放行一个请求试探
+    试探成功则恢复，失败则再次断开
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int | None = None,
+        reset_timeout: float | None = None,
+    ) -> None:
+        if failure_threshold is None:
+            failure_threshold = config.BREAKER_FAILURE_THRESHOLD
+        if reset_timeout is None:
+            reset_timeout = config.BREAKER_RESET_TIMEOUT
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    def check(self, endpoint: str) -> None:
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self._probing:
+            raise VCircuitOpenError(endpoint, max(remaining, 0.0))
+        self._probing = True  # 半开状态，只放行一个请求
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self._probing:
+                logger.warning(
+                    "circuit opened after %d failures, pause %.1fs",
+                    self.failures,
+                    self.reset_timeout,
+                )
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+@dataclass(frozen=True)
+class EndpointPolicy:
+    """
+    timeout: 整个请求（包括读取响应）的超时时间，None表示不限制，只限制连接和每次读取的超时
+    retries: 没有收到响应或者收到5xx、429时的重试次数，只应该用于幂等的接口
+    breaker: 是否为这个接口启用熔断
+    """
+
+    timeout: float | None
+    retries: int = 0
+    breaker: bool = False
+
+
+class RequestExecutor:
+    """
+    net层的所有请求都通过它发出
+    1. 每个接口使用各自的超时时间，避免请求永远挂起
+    2. 幂等的接口在发送请求阶段失败时重试，重试受重试预算约束
+    3. 同步接口（synccheck、webwxsync）连续失败后熔断，避免接收循环在故障期间空转
+    4. 统一的错误转换：网络错误和超时转换为VNetworkError，响应格式错误转换为VOperationFailedError
+    5. 记录每个接口的请求数、耗时和错误类型到metrics
+    """
+
+    def __init__(
+        self,
+        policies: dict[str, EndpointPolicy] | None = None,
+        retry_policy: RetryPolicy | None = None,
+        retry_budget: RetryBudget | None = None,
+        metrics: Metrics | None = None,
+    ) -> None:
+        self.policies = policies if policies is not None else load_policies()
+        self.retry_policy = retry_policy or RetryPolicy(
+            base_delay=config.REQUEST_RETRY_BASE_DELAY
+        )
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self.metrics = metrics or Metrics()
+
+    def policy(self, endpoint: str) -> EndpointPolicy:
+        return self.policies.get(endpoint) or EndpointPolicy(config.REQUEST_TIMEOUT)
+
+    @asynccontextmanager
+    async def request(
+        self,
+        session: ClientSession,
+        method: str,
+        url: str,
+        endpoint: str | None = None,
+        **kwargs,
+    ) -> AsyncIterator[ClientResponse]:
+        """
+        用法和session.request相同，endpoint默认是url的最后一段，例如webwxsync
+        """
+        endpoint = endpoint or endpoint_of(url)
+        policy = self.policy(endpoint)
+        breaker = self._breaker(endpoint) if policy.breaker else None
+        if breaker is not None:
+            try:
+                breaker.check(endpoint)
+            except VCircuitOpenError as e:
+                self.metrics.record_request_error(endpoint, e)
+                raise
+        kwargs.setdefault("timeout", _client_timeout(policy.timeout))
+        kwargs.setdefault("trace_request_ctx", {"endpoint": endpoint})
+        start = time.perf_counter()
+        try:
+            async with self._convert_errors(endpoint, breaker):
+                resp = await self._send(session, method, url, endpoint, policy, kwargs)
+                try:
+                    yield resp
+                finally:
+                    resp.release()
+        except VChatError as e:
+            self.metrics.record_request_error(endpoint, e)
+            raise
+        finally:
+            self.metrics.observe_request(endpoint, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def _convert_errors(
+        self, endpoint: str, breaker: CircuitBreaker | None
+    ) -> AsyncIterator[None]:
+        try:
+            yield
+        except (ClientError, asyncio.TimeoutError) as e:
+            if breaker is not None:
+                breaker.record_failure()
+            msg = f"{endpoint}出现网络错误: {e!r}"
+            logger.warning(msg)
+            raise VNetworkError(msg) from e
+        except (KeyError, AttributeError, ValueError) as e:
+            if breaker is not None:
+                breaker.record_success()  # 服务器有响应，只是内容不符合预期
+            msg = f"{endpoint}返回的数据错误: {e!r}"
+            logger.warning(msg)
+            raise VOperationFailedError(msg) from e
+        except VChatError:
+            if breaker is not None:
+                breaker.record_success()
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+
+    async def _send(
+        self,
+        session: ClientSession,
+        method: str,
+        url: str,
+        endpoint: str,
+        policy: EndpointPolicy,
+        kwargs: dict,
+    ) -> ClientResponse:
+        async def send() -> ClientResponse:
+            resp = await session.request(method, url, **kwargs)
+            if policy.retries:
+                try:
+                    raise_for_retryable_status(resp)
+                except ClientResponseError:
+                    resp.release()
+                    raise
+            return resp
+
+        if not policy.retries:
+            return await send()
+        retry_policy = RetryPolicy(
+            max_attempts=policy.retries + 1,
+            base_delay=self.retry_policy.base_delay,
+            max_delay=self.retry_policy.max_delay,
+            jitter=self.retry_policy.jitter,
+        )
+        return await retry_policy.run(send, self.retry_budget)
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+
+def raise_for_retryable_status(resp: ClientResponse) -> None:
+    """
+    5xx和429说明服务器暂时无法处理请求，抛出ClientResponseError，重试策略据此决定重试
+    不在executor中重试的接口（发送消息、上传分块）需要在解析响应之前调用
+    """
+    if resp.status >= 500 or resp.status == 429:
+        raise ClientResponseError(
+            resp.request_info,
+            resp.history,
+            status=resp.status,
+            message=resp.reason or "",
+            headers=resp.headers,
+        )
+
+
+def endpoint_of(url: str) -> str:
+    return yarl.URL(url).path.rstrip("/").rsplit("/", 1)[-1] or url
+
+
+def load_policies() -> dict[str, EndpointPolicy]:
+    policies = {}
+    for endpoint, timeout in config.ENDPOINT_TIMEOUTS.items():
+        policies[endpoint] = EndpointPolicy(
+            timeout,
+            config.ENDPOINT_RETRIES.get(endpoint, 0),
+            endpoint in config.BREAKER_ENDPOINTS,
+        )
+    for endpoint, retries in config.ENDPOINT_RETRIES.items():
+        if endpoint not in policies:
+            policies[endpoint] = EndpointPolicy(
+                config.REQUEST_TIMEOUT, retries, endpoint in config.BREAKER_ENDPOINTS
+            )
+    for endpoint in config.BREAKER_ENDPOINTS:
+        if endpoint not in policies:
+            policies[endpoint] = EndpointPolicy(config.REQUEST_TIMEOUT, breaker=True)
+    return policies
+
+
+def _client_timeout(total: float | None) -> ClientTimeout:
+    if total is None:
+        return ClientTimeout(
+            sock_connect=config.REQUEST_CONNECT_TIMEOUT,
+            sock_read=config.REQUEST_TIMEOUT,
+        )
+    return ClientTimeout(total=total, sock_connect=config.REQUEST_CONNECT_TIMEOUT)
@@ -7,6 +7,7 @@ from typing import BinaryIO
 from vchat.errors import VOperationFailedError
 from vchat.model import User
 from vchat.net.interface import NetHelperInterface
+from vchat.net.writer import FileWriter, stream_response
 
 if sys.version_info >= (3, 12):
     from typing import override
@@ -26,8 +27,8 @@ class NetHelperFriendMixin(NetHelperInterface, ABC):
             "Count": len(usernames),
             "List": [{"UserName": u, "EncryChatRoomId": ""} for u in usernames],
         }
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             for friend in dic["ContactList"]:
                 yield User(**friend)
 
@@ -42,10 +43,10 @@ class NetHelperFriendMixin(NetHelperInterface, ABC):
             "RemarkName": alias,
             "BaseRequest": self.login_info.base_request,
         }
-        async with self.session.post(
-            url, params=params, data=data
+        async with self._request(
+            "POST", url, params=params, data=data
         ) as resp:  # TODO: 验证接口格式是否正确
-            dic = await resp.json(content_type=None)
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"为{username}设置alias操作失败")
 
@@ -61,8 +62,8 @@ class NetHelperFriendMixin(NetHelperInterface, ABC):
             "BaseRequest": self.login_info.base_request,
         }
 
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"为{username}设置pinned操作失败")
 
@@ -82,8 +83,8 @@ class NetHelperFriendMixin(NetHelperInterface, ABC):
             "skey": self.login_info.skey,
         }
 
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 raise VOperationFailedError(f"接受{username}好友请求失败")
 
@@ -93,6 +94,7 @@ class NetHelperFriendMixin(NetHelperInterface, ABC):
         url = self.login_info.url + "/webwxgeticon"
 
         params = {"userName": username, "skey": self.login_info.skey, "type": "big"}
-        async with self.session.get(url, params=params) as resp:
-            async for chunk in resp.content.iter_chunked(1024):
-                fd.write(chunk)
+        async with self._request(
+            "GET", url, session=self.file_session, params=params
+        ) as resp:
+            await stream_response(resp, FileWriter(fd))
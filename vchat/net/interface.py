@@ -1,4 +1,4 @@
-import json
+import random
 from abc import ABC, abstractmethod
 from collections.abc import (
     AsyncGenerator,
@@ -8,23 +8,39 @@ from collections.abc import (
     Coroutine,
     Awaitable,
 )
-from typing import Optional, Literal, ParamSpec, TypeVar, Any, BinaryIO
+from typing import (
+    Optional,
+    Literal,
+    ParamSpec,
+    TypeVar,
+    Any,
+    AsyncContextManager,
+    BinaryIO,
+)
 
 import aiohttp
-from aiohttp import ClientError, ClientSession
+from aiohttp import BaseConnector, ClientError, ClientResponse, ClientSession
 
 from vchat import config
 from vchat.config import logger
 from vchat.errors import VNetworkError, VOperationFailedError
+from vchat.metrics import Metrics
 from vchat.model import User, Contact, RawMessage
+from vchat.net.codec import JsonCodec, get_codec
+from vchat.net.download_manager import DownloadManager, create_download_manager
+from vchat.net.executor import RequestExecutor
+from vchat.net.local_id import LocalIdGenerator
+from vchat.net.retry import RetryBudget, RetryPolicy
+from vchat.net.scheduler import SendPriority, SendScheduler, TokenBucket
 from vchat.storage.login_info import LoginInfo
+from vchat.storage.upload_session import UploadSession
 
 T = TypeVar("T")
 P = ParamSpec("P")
 
 
 def catch_exception(
-    fn: Callable[P, Coroutine[Any, Any, T]]
+    fn: Callable[P, Coroutine[Any, Any, T]],
 ) -> Callable[P, Coroutine[Any, Any, T]]:
     async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
         try:
@@ -41,30 +57,142 @@ def catch_exception(
     return wrapper
 
 
+def new_device_id() -> str:
+    return "e" + str(random.random())[2:17]
+
+
+class SharedConnectors:
+    """
+    同一个进程中多个账号共享的连接池，每个账号仍然使用各自的cookie jar
+    需要在事件循环中创建，所有账号退出后调用close
+    """
+
+    def __init__(
+        self,
+        api_pool: dict[str, Any] | None = None,
+        sync_pool: dict[str, Any] | None = None,
+        file_pool: dict[str, Any] | None = None,
+    ) -> None:
+        self.api: BaseConnector = aiohttp.TCPConnector(
+            **(api_pool or config.ACCOUNTS_API_POOL)
+        )
+        self.sync: BaseConnector = aiohttp.TCPConnector(
+            **(sync_pool or config.ACCOUNTS_SYNC_POOL)
+        )
+        self.file: BaseConnector = aiohttp.TCPConnector(
+            **(file_pool or config.ACCOUNTS_FILE_POOL)
+        )
+
+    async def close(self) -> None:
+        for connector in (self.api, self.sync, self.file):
+            await connector.close()
+
+
 class NetHelperInterface(ABC):
-    def __init__(self):
+    def __init__(
+        self,
+        device_id: str | None = None,
+        connectors: SharedConnectors | None = None,
+        send_bucket: TokenBucket | None = None,
+        metrics: Metrics | None = None,
+    ):
+        """
+        device_id: 登录时使用的设备id，默认使用config.DEVICEID，同一个进程中的多个账号需要各自的设备id
+        connectors: 多个账号共享的连接池，默认每个账号创建自己的连接池
+        send_bucket: 多个账号共享的发送令牌桶，见SendScheduler
+        """
+        # 普通的API请求、长轮询（synccheck和webwxsync）、文件上传下载分别使用独立的连接池，共享同一个cookie jar
         self.session: ClientSession = None
+        self.sync_session: ClientSession = None
+        self.file_session: ClientSession = None
+        self.device_id: str = device_id or config.DEVICEID
+        self.connectors: SharedConnectors | None = connectors
         self.login_info: LoginInfo = LoginInfo()
+        # (file_md5, file_size, to_username) -> 未完成的分块上传
+        self._upload_sessions: dict[tuple[str, int, str], UploadSession] = {}
+        self.send_scheduler: SendScheduler = SendScheduler(shared_bucket=send_bucket)
+        self.local_ids: LocalIdGenerator = LocalIdGenerator()
+        self.send_retry_policy: RetryPolicy = RetryPolicy()
+        self.upload_retry_policy: RetryPolicy = RetryPolicy(
+            max_attempts=config.UPLOAD_CHUNK_RETRY + 1
+        )
+        self.retry_budget: RetryBudget = RetryBudget()
+        self.codec: JsonCodec = get_codec()
+        self.download_manager: DownloadManager = create_download_manager()
+        self.metrics: Metrics = metrics or Metrics()
+        self.executor: RequestExecutor = RequestExecutor(
+            retry_budget=self.retry_budget, metrics=self.metrics
+        )
 
     async def init(self):
-        self.session = aiohttp.ClientSession(
-            json_serialize=lambda s: json.dumps(s, ensure_ascii=False)
+        cookie_jar = aiohttp.CookieJar(unsafe=config.COOKIE_JAR_UNSAFE)
+        connectors = self.connectors
+        self.session = self._create_session(
+            config.API_POOL, cookie_jar, connectors and connectors.api
+        )
+        self.sync_session = self._create_session(
+            config.SYNC_POOL, cookie_jar, connectors and connectors.sync
+        )
+        self.file_session = self._create_session(
+            config.FILE_POOL, cookie_jar, connectors and connectors.file
+        )
+
+    def _create_session(
+        self,
+        pool: dict[str, Any],
+        cookie_jar: aiohttp.CookieJar,
+        connector: BaseConnector | None = None,
+    ) -> ClientSession:
+        """
+        指定connector时使用共享的连接池，关闭session时不会关闭共享的连接池
+        """
+        return aiohttp.ClientSession(
+            connector=connector or aiohttp.TCPConnector(**pool),
+            connector_owner=connector is None,
+            cookie_jar=cookie_jar,
+            headers={"User-Agent": config.USER_AGENT},
+            json_serialize=self.codec.dumps,
+            trace_configs=[self.metrics.trace_config()],
         )
-        self.session.headers.update({"User-Agent": config.USER_AGENT})
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        session: ClientSession | None = None,
+        **kwargs,
+    ) -> AsyncContextManager[ClientResponse]:
+        """
+        所有请求都通过self.executor发出，session默认使用API连接池
+        """
+        return self.executor.request(session or self.session, method, url, **kwargs)
+
+    async def _read_json(self, resp: ClientResponse) -> Any:
+        """
+        使用配置的json编解码器解析响应，服务器返回的Content-Type不一定是application/json
+        """
+        return self.codec.loads(await resp.read())
 
     async def close(self):
-        await self.session.close()
+        await self.send_scheduler.close()
+        for session in (self.session, self.sync_session, self.file_session):
+            if session is not None:
+                await session.close()
 
-    @staticmethod
     @catch_exception
-    async def test_connect(retry_times=5) -> bool:
-        async with aiohttp.ClientSession() as session:
-            for i in range(retry_times):
-                try:
-                    async with session.get(config.BASE_URL):
-                        return True
-                except ClientError:
-                    pass
+    async def test_connect(self, retry_times=5) -> bool:
+        """
+        使用API连接池测试，成功建立的连接会保留在连接池中，之后的登录请求可以直接复用
+        每次尝试的超时时间是config.ENDPOINT_TIMEOUTS中test_connect的超时时间
+        """
+        for i in range(retry_times):
+            try:
+                async with self._request(
+                    "GET", config.BASE_URL, endpoint="test_connect"
+                ):
+                    return True
+            except VNetworkError:
+                pass
         return False
 
     @abstractmethod
@@ -192,7 +320,12 @@ class NetHelperInterface(ABC):
 
     @abstractmethod
     def _get_download_fn(
-        self, url: str, params: dict, headers: dict | None = None
+        self,
+        key: str,
+        url: str,
+        params: dict,
+        headers: dict | None = None,
+        ranged: bool = False,
     ) -> Callable[..., Awaitable]:
         pass
 
@@ -214,24 +347,50 @@ class NetHelperInterface(ABC):
 
     @abstractmethod
     async def send_document(
-        self, file_name: str, media_id: str, file_size: int, to_username: str
-    ) -> None:
+        self,
+        file_name: str,
+        media_id: str,
+        file_size: int,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
-    async def send_image(self, media_id: str, to_username: str) -> None:
+    async def send_image(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
-    async def send_gif(self, media_id: str, to_username: str) -> None:
+    async def send_gif(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
-    async def send_video(self, media_id: str, to_username: str) -> None:
+    async def send_video(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
-    async def send_raw_msg(self, msg_type: int, content: str, to_username: str) -> None:
+    async def send_raw_msg(
+        self,
+        msg_type: int,
+        content: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         pass
 
     @abstractmethod
@@ -0,0 +1,34 @@
+import threading
+import time
+from collections import OrderedDict
+
+from vchat import config
+
+
+class LocalIdGenerator:
+    """
+    生成发送消息使用的LocalID/ClientMsgId和上传文件使用的ClientMediaId
+    格式与网页版相同（以0.1ms为单位的时间戳），但在同一个会话内严格递增，同一时刻并发发送也不会重复
+    同时记录LocalID到服务器返回的MsgID的映射，撤回消息时可以直接使用发送时返回的LocalID
+    """
+
+    def __init__(self, mapping_size: int | None = None) -> None:
+        self._last = 0
+        self._lock = threading.Lock()
+        if mapping_size is None:
+            mapping_size = config.LOCAL_ID_MAPPING_SIZE
+        self._mapping_size = mapping_size
+        self._svr_msg_ids: OrderedDict[str, str] = OrderedDict()
+
+    def next(self) -> str:
+        with self._lock:
+            self._last = max(int(time.time() * 1e4), self._last + 1)
+            return str(self._last)
+
+    def bind(self, local_id: str, svr_msg_id: str) -> None:
+        self._svr_msg_ids[local_id] = svr_msg_id
+        while len(self._svr_msg_ids) > self._mapping_size:
+            self._svr_msg_ids.popitem(last=False)
+
+    def lookup(self, local_id: str) -> str | None:
+        return self._svr_msg_ids.get(local_id)
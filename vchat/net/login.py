@@ -48,7 +48,7 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
             "lang": "zh_CN",
         }
 
-        async with self.session.get(url, params=params) as resp:
+        async with self._request("GET", url, params=params) as resp:
             text = await resp.text()
             regx = r'window.QRLogin.code = (\d+); window.QRLogin.uuid = "(\S+?)";'
             ma = re.search(regx, text)
@@ -72,7 +72,7 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
             "_": localTime,
         }
 
-        async with self.session.get(url, params=params) as resp:
+        async with self._request("GET", url, params=params) as resp:
             text = await resp.text()
             regx = r"window.code=(\d+)"
             ma = re.search(regx, text)
@@ -103,28 +103,20 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
             "extspam": config.UOS_PATCH_EXTSPAM,
             "referer": "https://wx.qq.com/?&lang=zh_CN&target=t",
         }
-        async with self.session.get(
-            self.login_info.url, headers=headers, allow_redirects=False
+        async with self._request(
+            "GET", self.login_info.url, headers=headers, allow_redirects=False
         ) as resp:
             text = await resp.text()
         # TODO: 优化
         self.login_info.url = self.login_info.url[: self.login_info.url.rfind("/")]
-        for index_url, detailed_url in (
-            ("wx2.qq.com", ("file.wx2.qq.com", "webpush.wx2.qq.com")),
-            ("wx8.qq.com", ("file.wx8.qq.com", "webpush.wx8.qq.com")),
-            ("qq.com", ("file.wx.qq.com", "webpush.wx.qq.com")),
-            ("web2.wechat.com", ("file.web2.wechat.com", "webpush.web2.wechat.com")),
-            ("wechat.com", ("file.web.wechat.com", "webpush.web.wechat.com")),
-        ):
-            file_url = f"https://{detailed_url[0]}/cgi-bin/mmwebwx-bin"
-            sync_url = f"https://{detailed_url[1]}/cgi-bin/mmwebwx-bin"
+        for index_url, file_base, sync_base in config.HOST_MAPPING:
             if index_url in self.login_info.url:
-                self.login_info.file_url = file_url
-                self.login_info.sync_url = sync_url
+                self.login_info.file_url = file_base + "/cgi-bin/mmwebwx-bin"
+                self.login_info.sync_url = sync_base + "/cgi-bin/mmwebwx-bin"
                 break
         else:
             self.login_info.file_url = self.login_info.sync_url = self.login_info.url
-        self.login_info.deviceid = config.DEVICEID
+        self.login_info.deviceid = self.device_id
         self.login_info.login_time = int(time.time() * 1e3)
         self.login_info.base_request = {}
         try:
@@ -165,8 +157,8 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
         }
         data = {"BaseRequest": self.login_info.base_request}
 
-        async with self.session.post(url, params=params, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, params=params, json=data) as resp:
+            dic = await self._read_json(resp)
         self.login_info.invite_start_count = int(dic["InviteStartCount"])
         self.login_info.user = User(**dic["User"])
         self.login_info.myname = self.login_info.user.username  # TODO
@@ -195,7 +187,7 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
             "ClientMsgId": int(time.time()),
         }
 
-        async with self.session.post(url, params=params, json=data):
+        async with self._request("POST", url, params=params, json=data):
             pass
 
     @override
@@ -229,8 +221,8 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
             return None
         url = config.BASE_URL + "/cgi-bin/mmwebwx-bin/webwxpushloginurl"
         params = {"uin": wxuin}
-        async with self.session.get(url, params=params) as resp:
-            data = await resp.json(content_type=None)
+        async with self._request("GET", url, params=params) as resp:
+            data = await self._read_json(resp)
         if "uuid" in data and data.get("ret") in (0, "0"):
             return data["uuid"]
         return None
@@ -241,5 +233,5 @@ class NetHelperLoginMixin(NetHelperInterface, ABC):
         assert self.login_info.url is not None
         url = self.login_info.url + "/webwxlogout"
         params = {"redirect": 1, "type": 1, "skey": self.login_info.skey}
-        async with self.session.get(url, params=params):
+        async with self._request("GET", url, params=params):
             pass
@@ -0,0 +1,206 @@
+import asyncio
+import glob
+import math
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiohttp import ClientResponse
+
+from vchat import config, fileio
+from vchat.config import logger
+from vchat.errors import VNetworkError
+from vchat.net.executor import RequestFn
+from vchat.net.writer import FileWriter, content_length, stream_response
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+def parse_content_range(value: str | None) -> tuple[int, int, int | None] | None:
+    """
+    解析Content-Range，返回(start, end, total)，end包含在内，total未知时为None
+    """
+    if value is None:
+        return None
+    match = _CONTENT_RANGE.fullmatch(value.strip())
+    if match is None:
+        return None
+    start, end, total = match.groups()
+    return int(start), int(end), None if total == "*" else int(total)
+
+
+def check_size(received: int, expected: int | None) -> None:
+    """
+    校验收到的字节数和服务器声明的大小是否一致，不一致说明连接中途断开
+    """
+    if expected is not None and received != expected:
+        msg = f"下载的数据不完整: 收到{received}字节，应为{expected}字节"
+        logger.warning(msg)
+        raise VNetworkError(msg)
+
+
+@dataclass(frozen=True)
+class Segment:
+    start: int
+    end: int  # 不包含
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def part_path(self, path: Path) -> Path:
+        # 分段的位置写在文件名中，分段方式改变后旧的分段文件不会被误用
+        return path.with_name(f"{path.name}.{self.start}-{self.end}.part")
+
+
+def plan_segments(total: int, segment_size: int, max_segments: int) -> list[Segment]:
+    """
+    将[0, total)切分为不超过max_segments个分段，每段不小于segment_size（最后一段除外）
+    相同的参数总是得到相同的分段，中断后可以继续下载未完成的分段
+    """
+    if total <= 0:
+        return [Segment(0, 0)]
+    count = max(1, min(max_segments, math.ceil(total / segment_size)))
+    step = math.ceil(total / count)
+    return [Segment(start, min(start + step, total)) for start in range(0, total, step)]
+
+
+class RangedDownloader:
+    """
+    使用Range请求下载文件到磁盘
+    1. 每个分段先写入各自的.part文件，中断后再次下载时从.part文件的末尾继续
+    2. 文件较大时多个分段并行下载
+    3. 每个分段以及最终文件的大小都和服务器声明的大小校验
+    服务器不支持Range时（返回200），退化为普通的完整下载
+    """
+
+    def __init__(
+        self,
+        request: RequestFn,
+        url: str,
+        params: dict,
+        headers: dict | None = None,
+        segment_size: int | None = None,
+        max_segments: int | None = None,
+    ) -> None:
+        self.request = request
+        self.url = url
+        self.params = params
+        self.headers = {
+            k: v for k, v in (headers or {}).items() if k.lower() != "range"
+        }
+        self.segment_size = segment_size or config.DOWNLOAD_SEGMENT_SIZE
+        self.max_segments = max_segments or config.DOWNLOAD_MAX_SEGMENTS
+
+    async def download(self, path: Path) -> None:
+        total = await self._probe(path)
+        if total is None:
+            return  # 已经在_probe中完整下载
+        if total == 0:
+            await fileio.run_io(path.write_bytes, b"")
+            return
+        segments = plan_segments(total, self.segment_size, self.max_segments)
+        await fileio.run_io(self._remove_stale_parts, path, segments)
+        logger.debug(
+            "ranged download %s: %d bytes, %d segments", path, total, len(segments)
+        )
+        tasks = [asyncio.create_task(self._download_segment(path, s)) for s in segments]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # 一个分段失败时取消其他分段，等待它们结束后.part文件才处于可以继续下载的状态
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        await fileio.run_io(self._merge, path, segments, total)
+
+    async def _probe(self, path: Path) -> int | None:
+        """
+        请求第一个字节获取文件总大小，无法分段下载时直接完整下载并返回None
+        """
+        async with self._get(0, 0) as resp:
+            resp.raise_for_status()
+            if resp.status != 206:
+                # 不支持Range，响应就是完整的文件
+                await self._save(resp, path)
+                return None
+            content_range = parse_content_range(resp.headers.get("Content-Range"))
+            if content_range is not None and content_range[2] is not None:
+                return content_range[2]
+        # 支持Range但不知道总大小，这个响应只有一个字节，从头完整下载
+        async with self._get(0, None) as resp:
+            resp.raise_for_status()
+            if resp.status == 206:
+                content_range = parse_content_range(resp.headers.get("Content-Range"))
+                if content_range is None or content_range[0] != 0:
+                    raise VNetworkError(f"服务器返回的数据范围错误: {content_range}")
+            await self._save(resp, path)
+        return None
+
+    @staticmethod
+    async def _save(resp: ClientResponse, path: Path) -> None:
+        async with fileio.open_file(path, "wb") as f:
+            received = await stream_response(resp, FileWriter(f))
+        check_size(received, content_length(resp))
+
+    async def _download_segment(self, path: Path, segment: Segment) -> None:
+        part = segment.part_path(path)
+        done = await fileio.run_io(_file_size, part)
+        if done > segment.size:  # .part文件损坏，重新下载这个分段
+            done = 0
+            await fileio.run_io(part.unlink)
+        if done == segment.size:
+            return
+        if done:
+            logger.debug("resume %s from %d", part, done)
+        async with self._get(segment.start + done, segment.end - 1) as resp:
+            resp.raise_for_status()
+            content_range = parse_content_range(resp.headers.get("Content-Range"))
+            if resp.status != 206 or content_range is None:
+                raise VNetworkError("服务器没有按照Range返回数据")
+            if content_range[0] != segment.start + done:
+                raise VNetworkError(f"服务器返回的数据范围错误: {content_range}")
+            async with fileio.open_file(part, "ab") as f:
+                received = await stream_response(resp, FileWriter(f))
+        check_size(done + received, segment.size)
+
+    def _get(self, start: int, end: int | None):
+        """
+        end包含在内，为None时请求从start到文件末尾
+        """
+        byte_range = f"bytes={start}-" if end is None else f"bytes={start}-{end}"
+        headers = {**self.headers, "Range": byte_range}
+        return self.request("GET", self.url, params=self.params, headers=headers)
+
+    @staticmethod
+    def _merge(path: Path, segments: list[Segment], total: int) -> None:
+        if len(segments) == 1:
+            os.replace(segments[0].part_path(path), path)
+        else:
+            with open(path, "wb") as dst:
+                for segment in segments:
+                    with open(segment.part_path(path), "rb") as src:
+                        while chunk := src.read(config.FILE_IO_BUFFER_SIZE):
+                            dst.write(chunk)
+            for segment in segments:
+                segment.part_path(path).unlink()
+        check_size(_file_size(path), total)
+
+    @staticmethod
+    def _remove_stale_parts(path: Path, segments: list[Segment]) -> None:
+        """
+        删除分段方式不同的旧.part文件
+        """
+        current = {s.part_path(path).name for s in segments}
+        for part in path.parent.glob(f"{glob.escape(path.name)}.*-*.part"):
+            if part.name not in current:
+                part.unlink()
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
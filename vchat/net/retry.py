@@ -0,0 +1,97 @@
+import asyncio
+import random
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import TypeVar
+
+from aiohttp import ClientError, ClientResponseError
+
+from vchat import config
+from vchat.config import logger
+from vchat.errors import VNetworkError, VOperationFailedError
+
+T = TypeVar("T")
+
+
+class RetryBudget:
+    """
+    重试预算，每个请求积累ratio次重试机会，最多积累max_tokens次，每次重试消耗一次
+    服务器故障时所有请求都会失败，重试预算保证重试不会成倍地放大流量
+    """
+
+    def __init__(
+        self,
+        ratio: float | None = None,
+        max_tokens: float | None = None,
+    ) -> None:
+        self.ratio = ratio if ratio is not None else config.RETRY_BUDGET_RATIO
+        self.max_tokens = (
+            max_tokens if max_tokens is not None else config.RETRY_BUDGET_MAX
+        )
+        self.tokens = float(self.max_tokens)
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class RetryPolicy:
+    """
+    重试策略，第n次重试前等待min(max_delay, base_delay * 2^(n-1))秒，并随机减少最多jitter比例的时间
+    调用者需要保证被重试的操作是幂等的，例如发送消息时每次重试使用相同的ClientMsgId
+    """
+
+    # 默认值在创建时从config读取
+    max_attempts: int = field(default_factory=lambda: config.SEND_RETRY_MAX_ATTEMPTS)
+    base_delay: float = field(default_factory=lambda: config.SEND_RETRY_BASE_DELAY)
+    max_delay: float = field(default_factory=lambda: config.SEND_RETRY_MAX_DELAY)
+    jitter: float = 0.5
+    # 1100, 1101, 1102表示登录已经失效，重试没有意义
+    fatal_rets: frozenset[int] = field(
+        default_factory=lambda: frozenset({1100, 1101, 1102})
+    )
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def retryable(self, e: Exception) -> bool:
+        if isinstance(e, ClientResponseError):
+            return e.status >= 500 or e.status == 429
+        if isinstance(e, (ClientError, asyncio.TimeoutError, VNetworkError)):
+            return True
+        if isinstance(e, VOperationFailedError):
+            return e.ret is not None and e.ret not in self.fatal_rets
+        return False
+
+    async def run(
+        self, fn: Callable[[], Awaitable[T]], budget: RetryBudget | None = None
+    ) -> T:
+        """
+        执行fn，失败后按照策略重试，重试次数或重试预算用尽时抛出最后一次的异常
+        """
+        if budget is not None:
+            budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                attempt += 1
+                if (
+                    attempt >= self.max_attempts
+                    or not self.retryable(e)
+                    or (budget is not None and not budget.withdraw())
+                ):
+                    raise
+                delay = self.backoff(attempt)
+                logger.debug(
+                    "attempt %d failed, retry after %.2fs: %r" % (attempt, delay, e)
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,232 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from vchat import config
+from vchat.config import logger
+
+
+class SendPriority(enum.IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class TokenBucket:
+    """
+    令牌桶，每秒补充rate个令牌，最多积累capacity个令牌
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        距离下一个令牌可用还需要等待的秒数，0表示现在就可以消耗
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass(order=True)
+class _SendJob:
+    priority: int
+    seq: int
+    to_username: str = field(compare=False)
+    endpoint: str = field(compare=False)
+    send_fn: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class SendScheduler:
+    """
+    发送队列，所有发送操作排队后在全局、每个联系人、每个接口三级令牌桶的限制下尽快发出
+    1. 优先级高的先发送，同优先级先进先出
+    2. 同一个联系人同一时间只有一个发送中的消息，保证消息的顺序
+    3. 不同联系人的消息并发发送
+    shared_bucket是多个账号共享的令牌桶，用于限制同一个进程中所有账号的总发送速度
+    """
+
+    def __init__(
+        self,
+        global_limit: tuple[float, float] | None = None,
+        recipient_limit: tuple[float, float] | None = None,
+        endpoint_limits: dict[str, tuple[float, float]] | None = None,
+        shared_bucket: TokenBucket | None = None,
+    ) -> None:
+        # 参数为None时在创建时从config读取，运行时修改config同样生效
+        if global_limit is None:
+            global_limit = config.SEND_GLOBAL_LIMIT
+        if recipient_limit is None:
+            recipient_limit = config.SEND_RECIPIENT_LIMIT
+        self.global_bucket = TokenBucket(*global_limit)
+        self.shared_bucket = shared_bucket
+        self._recipient_limit = recipient_limit
+        self._recipient_buckets: dict[str, TokenBucket] = {}
+        if endpoint_limits is None:
+            endpoint_limits = config.SEND_ENDPOINT_LIMITS
+        self._endpoint_buckets = {
+            endpoint: TokenBucket(*limit) for endpoint, limit in endpoint_limits.items()
+        }
+        self._queue: list[_SendJob] = []
+        self._seq = itertools.count()
+        self._busy_recipients: set[str] = set()
+        self._running: set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    def submit(
+        self,
+        send_fn: Callable[[], Awaitable[Any]],
+        to_username: str,
+        endpoint: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> asyncio.Future:
+        """
+        将发送操作加入队列，返回的future在发送完成后得到send_fn的返回值
+        """
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        future = asyncio.get_running_loop().create_future()
+        job = _SendJob(
+            int(priority), next(self._seq), to_username, endpoint, send_fn, future
+        )
+        heapq.heappush(self._queue, job)
+        self._wakeup.set()
+        return future
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for job in self._queue:
+            job.future.cancel()
+        self._queue.clear()
+        for task in list(self._running):
+            task.cancel()
+
+    def _recipient_bucket(self, to_username: str) -> TokenBucket:
+        bucket = self._recipient_buckets.get(to_username)
+        if bucket is None:
+            bucket = TokenBucket(*self._recipient_limit)
+            self._recipient_buckets[to_username] = bucket
+        return bucket
+
+    def _pick(self, now: float) -> tuple[_SendJob | None, float | None]:
+        """
+        选出优先级最高的可以立刻发送的任务，没有则返回最短的等待时间
+        按优先级从堆中依次弹出，暂时不能发送的任务放回堆中
+        """
+        if not self._queue:
+            return None, None
+        global_wait = self.global_bucket.wait_time(now)
+        if self.shared_bucket is not None:
+            global_wait = max(global_wait, self.shared_bucket.wait_time(now))
+        if global_wait > 0:  # 所有任务都要等待全局令牌，不需要逐个检查
+            return None, global_wait
+        min_wait: float | None = None
+        picked: _SendJob | None = None
+        skipped: list[_SendJob] = []
+        while self._queue:
+            job = heapq.heappop(self._queue)
+            if job.future.done():  # 调用者已经取消
+                continue
+            if job.to_username in self._busy_recipients:
+                skipped.append(job)
+                continue
+            wait = self._recipient_bucket(job.to_username).wait_time(now)
+            endpoint_bucket = self._endpoint_buckets.get(job.endpoint)
+            if endpoint_bucket is not None:
+                wait = max(wait, endpoint_bucket.wait_time(now))
+            if wait == 0:
+                picked = job
+                break
+            skipped.append(job)
+            if min_wait is None or wait < min_wait:
+                min_wait = wait
+        for job in skipped:
+            heapq.heappush(self._queue, job)
+        if picked is not None:
+            return picked, None
+        return None, min_wait
+
+    def _prune_recipient_buckets(self, now: float) -> None:
+        # 已经回满的令牌桶与新建的令牌桶等价，可以丢弃
+        for to_username, bucket in list(self._recipient_buckets.items()):
+            if to_username not in self._busy_recipients and bucket.full(now):
+                del self._recipient_buckets[to_username]
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            if job is None:
+                if len(self._recipient_buckets) > 1024:
+                    self._prune_recipient_buckets(now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.global_bucket.consume(now)
+            if self.shared_bucket is not None:
+                self.shared_bucket.consume(now)
+            self._recipient_bucket(job.to_username).consume(now)
+            endpoint_bucket = self._endpoint_buckets.get(job.endpoint)
+            if endpoint_bucket is not None:
+                endpoint_bucket.consume(now)
+            self._busy_recipients.add(job.to_username)
+            task = asyncio.create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, job: _SendJob) -> None:
+        try:
+            result = await job.send_fn()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            else:
+                logger.debug(
+                    "send to %s failed after cancelled: %s", job.to_username, e
+                )
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy_recipients.discard(job.to_username)
+            self._wakeup.set()
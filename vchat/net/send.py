@@ -1,5 +1,4 @@
-import hashlib
-import json
+import asyncio
 import math
 import mimetypes
 import time
@@ -8,42 +7,71 @@ from typing import BinaryIO
 from urllib.parse import quote
 
 import yarl
-from aiohttp import FormData
+from aiohttp import ClientError, FormData
 
-from vchat import config
-from vchat.errors import VOperationFailedError
+from vchat import config, fileio
+from vchat.config import logger
+from vchat.errors import VChatError, VOperationFailedError
 from vchat.model import MediaTypes
+from vchat.net.executor import raise_for_retryable_status
 from vchat.net.interface import NetHelperInterface
+from vchat.net.scheduler import SendPriority
+from vchat.storage.media_cache import MediaCache
+from vchat.storage.upload_session import UploadSession
 
 
 class NetHelperSendMixin(NetHelperInterface, ABC):
     async def upload_file(
-        self, file_name: str, fd: BinaryIO, to_username: str
+        self,
+        file_name: str,
+        fd: BinaryIO,
+        to_username: str,
+        digest: tuple[str, int] | None = None,
     ) -> tuple[str, int]:
+        """
+        分块上传文件，每个分块失败后会重试，重试次数用尽时抛出VOperationFailedError
+        上传状态会保留，再次上传同一个文件时从第一个未确认的分块继续
+        同时上传同一个文件时只有一个调用者真正上传，其他调用者等待并使用它的结果
+        digest是已经计算好的(md5, 文件大小)，为None时读取fd计算
+        """
+        assert self.login_info.url is not None
+        start = fd.tell()
+        if digest is None:
+            digest = await fileio.run_io(MediaCache.digest, fd)
+        file_md5, file_size = digest
+        session = self._get_upload_session(file_md5, file_size, to_username)
+        async with session.lock:
+            if not session.missing_chunks() and session.media_id:
+                return session.media_id, file_size
+            await self._upload_chunks(
+                session, file_name, fd, start, to_username, file_md5, file_size
+            )
+        self._upload_sessions.pop((file_md5, file_size, to_username), None)
+        if not session.media_id:
+            raise VOperationFailedError(
+                f"上传文件{file_name}失败，服务器没有返回MediaId"
+            )
+        return session.media_id, file_size
+
+    async def _upload_chunks(
+        self,
+        session: UploadSession,
+        file_name: str,
+        fd: BinaryIO,
+        start: int,
+        to_username: str,
+        file_md5: str,
+        file_size: int,
+    ) -> None:
         assert self.login_info.url is not None
         encoded_file_name = quote(file_name)
         file_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
-        file_bytes = fd.read()
-        fd.seek(0)
-        file_size = len(file_bytes)
-        file_md5 = hashlib.md5(file_bytes).hexdigest()
-        client_media_id = int(time.time() * 1e4)  # TODO: 尝试改进client_media_id
-
-        if "." not in file_name:
-            media_type = MediaTypes.DOC
-        else:
-            match file_name.split(".")[-1].lower():
-                case "jpg" | "jpeg" | "png":
-                    media_type = MediaTypes.IMG
-                case "mp4":
-                    media_type = MediaTypes.VIDEO
-                case _:
-                    media_type = MediaTypes.DOC
+        media_type = MediaTypes.from_file_name(file_name)
 
         upload_media_request = {
             "UploadType": 2,
             "BaseRequest": self.login_info.base_request,
-            "ClientMediaId": client_media_id,
+            "ClientMediaId": session.client_media_id,
             "TotalLen": file_size,
             "StartPos": 0,
             "DataLen": file_size,
@@ -75,7 +103,6 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
         #     ),
         #     "pass_ticket": (None, self.login_info.pass_ticket),
         # }
-        form_data = FormData()
         fields = [
             ("id", "WU_FILE_0"),
             ("name", encoded_file_name),
@@ -86,7 +113,7 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             ),
             ("size", str(file_size)),
             ("mediatype", media_type.value),
-            ("uploadmediarequest", json.dumps(upload_media_request)),
+            ("uploadmediarequest", self.codec.dumps(upload_media_request)),
             (
                 "webwx_data_ticket",
                 self.session.cookie_jar.filter_cookies(yarl.URL(self.login_info.url))[
@@ -95,65 +122,87 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             ),
             ("pass_ticket", self.login_info.pass_ticket),
         ]
-        if file_size <= 512 * 1024:
-            # files["filename"] = (
-            #     encoded_file_name,
-            #     fd.read(),
-            #     "application/octet-stream",
-            # )
+        for chunk in session.missing_chunks():
+            fd.seek(start + chunk * config.UPLOAD_CHUNK_SIZE)
+            payload = await fileio.run_io(fd.read, config.UPLOAD_CHUNK_SIZE)
 
-            form_data.add_fields(*fields)
-            form_data.add_field("filename", fd.read(), filename=encoded_file_name)
-            data = await self._upload_chunk_file(form_data)
-            media_id = data["MediaId"]
-        else:
-            chunks = math.ceil(file_size / (512 * 1024))
-            data = {}
-            for chunk in range(chunks):
+            async def upload_chunk() -> dict:
+                # FormData只能被发送一次，每次重试都需要重新构造
                 form_data = FormData()
                 form_data.add_fields(*fields)
-                form_data.add_field("chunk", str(chunk))
-                form_data.add_field("chunks", str(chunks))
-                form_data.add_field(
-                    "filename", fd.read(512 * 1024), filename=encoded_file_name
+                if session.chunks > 1:
+                    form_data.add_field("chunk", str(chunk))
+                    form_data.add_field("chunks", str(session.chunks))
+                form_data.add_field("filename", payload, filename=encoded_file_name)
+                return await self._upload_chunk_file(form_data)
+
+            try:
+                data = await self.upload_retry_policy.run(
+                    upload_chunk, self.retry_budget
                 )
+            except (VChatError, ClientError, asyncio.TimeoutError) as e:
+                fd.seek(start)
+                raise VOperationFailedError(
+                    f"上传文件{file_name}的第{chunk}/{session.chunks}块失败: {e}",
+                    e.ret if isinstance(e, VOperationFailedError) else None,
+                )
+            session.acked.add(chunk)
+            session.media_id = data.get("MediaId") or session.media_id
+        fd.seek(start)
 
-                # files.update(
-                #     {
-                #         "chunk": (None, str(chunk)),
-                #         "chunks": (None, str(chunks)),
-                #         "filename": (
-                #             encoded_file_name,
-                #             fd.read(512 * 1024),
-                #             "application/octet-stream",
-                #         ),
-                #     }
-                # )
-                data = await self._upload_chunk_file(form_data)
-            media_id = data["MediaId"]
-        return media_id, file_size
+    def _get_upload_session(
+        self, file_md5: str, file_size: int, to_username: str
+    ) -> UploadSession:
+        """
+        获取未完成的上传状态，没有则新建一个
+        """
+        for key, session in list(self._upload_sessions.items()):
+            if session.expired(config.UPLOAD_SESSION_TTL):
+                del self._upload_sessions[key]
+        key = (file_md5, file_size, to_username)
+        session = self._upload_sessions.get(key)
+        if session is None:
+            session = UploadSession(
+                client_media_id=int(self.local_ids.next()),
+                file_md5=file_md5,
+                file_size=file_size,
+                chunks=max(1, math.ceil(file_size / config.UPLOAD_CHUNK_SIZE)),
+            )
+            self._upload_sessions[key] = session
+        else:
+            logger.debug(
+                "resume uploading from chunk %d/%d"
+                % (session.missing_chunks()[0], session.chunks)
+            )
+        return session
 
     async def _upload_chunk_file(self, form_data: FormData):
         assert self.login_info.file_url is not None
         url = self.login_info.file_url + "/webwxuploadmedia?f=json"
 
-        async with self.session.post(
-            url, data=form_data, timeout=config.TIMEOUT
+        async with self._request(
+            "POST", url, session=self.file_session, data=form_data
         ) as resp:
-            data = await resp.json(content_type=None)
+            raise_for_retryable_status(resp)
+            data = await self._read_json(resp)
             if data["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("上传文件失败")
+                raise VOperationFailedError("上传文件失败", data["BaseResponse"]["Ret"])
             return data
 
     async def send_document(
-        self, file_name: str, media_id: str, file_size: int, to_username: str
+        self,
+        file_name: str,
+        media_id: str,
+        file_size: int,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
     ) -> str:
         if "." in file_name:
             suffix = file_name.split(".")[-1]
         else:  # 处理没有扩展名的情况
             suffix = ""
         url = "%s/webwxsendappmsg?fun=async&f=json" % self.login_info.url
-        msg_id = str(int(time.time() * 1e4))
+        msg_id = self.local_ids.next()
         data = {
             "BaseRequest": self.login_info.base_request,
             "Msg": {
@@ -171,16 +220,19 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             },
             "Scene": 0,
         }
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
-            if dic["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("发送文件失败")
-        return msg_id
+        return await self._submit_send(
+            "webwxsendappmsg", url, data, msg_id, to_username, "发送文件失败", priority
+        )
 
-    async def send_image(self, media_id: str, to_username: str) -> str:
+    async def send_image(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         assert self.login_info.url is not None
         url = self.login_info.url + "/webwxsendmsgimg?fun=async&f=json"
-        msg_id = str(int(time.time() * 1e4))
+        msg_id = self.local_ids.next()
         data = {
             "BaseRequest": self.login_info.base_request,
             "Msg": {
@@ -193,17 +245,19 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             },
             "Scene": 0,
         }
+        return await self._submit_send(
+            "webwxsendmsgimg", url, data, msg_id, to_username, "发送图片失败", priority
+        )
 
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
-            if dic["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("发送图片失败")
-        return msg_id
-
-    async def send_gif(self, media_id: str, to_username: str) -> None:
+    async def send_gif(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         assert self.login_info.url is not None
         url = self.login_info.url + "/webwxsendemoticon?fun=sys"
-        msg_id = str(int(time.time() * 1e4))
+        msg_id = self.local_ids.next()
         data = {
             "BaseRequest": self.login_info.base_request,
             "Msg": {
@@ -217,18 +271,21 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             },
             "Scene": 0,
         }
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
-            if dic["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("发送gif失败")
-        return msg_id
+        return await self._submit_send(
+            "webwxsendemoticon", url, data, msg_id, to_username, "发送gif失败", priority
+        )
 
-    async def send_video(self, media_id: str, to_username: str) -> str:
+    async def send_video(
+        self,
+        media_id: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         url = "%s/webwxsendvideomsg?fun=async&f=json&pass_ticket=%s" % (
             self.login_info.url,
             self.login_info.pass_ticket,
         )
-        msg_id = str(int(time.time() * 1e4))
+        msg_id = self.local_ids.next()
         data = {
             "BaseRequest": self.login_info.base_request,
             "Msg": {
@@ -241,18 +298,27 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             },
             "Scene": 0,
         }
+        return await self._submit_send(
+            "webwxsendvideomsg",
+            url,
+            data,
+            msg_id,
+            to_username,
+            "发送视频失败",
+            priority,
+        )
 
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
-            if dic["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("发送视频失败")
-        return msg_id
-
-    async def send_raw_msg(self, msg_type: int, content: str, to_username: str) -> str:
+    async def send_raw_msg(
+        self,
+        msg_type: int,
+        content: str,
+        to_username: str,
+        priority: SendPriority = SendPriority.NORMAL,
+    ) -> str:
         # 有些帐号不能给自己发送消息
         assert self.login_info.url is not None
         url = self.login_info.url + "/webwxsendmsg"
-        msg_id = str(int(time.time() * 1e4))
+        msg_id = self.local_ids.next()
         data = {
             "BaseRequest": self.login_info.base_request,
             "Msg": {
@@ -265,22 +331,58 @@ class NetHelperSendMixin(NetHelperInterface, ABC):
             },
             "Scene": 0,
         }
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
-            if dic["BaseResponse"]["Ret"] != 0:
-                raise VOperationFailedError("发送消息失败")
-        return msg_id
+        return await self._submit_send(
+            "webwxsendmsg", url, data, msg_id, to_username, "发送消息失败", priority
+        )
+
+    async def _submit_send(
+        self,
+        endpoint: str,
+        url: str,
+        data: dict,
+        msg_id: str,
+        to_username: str,
+        error_msg: str,
+        priority: SendPriority,
+    ) -> str:
+        """
+        将发送请求加入发送队列，在限速允许时发出，发送成功后返回msg_id
+        网络错误和服务器的临时错误会按照send_retry_policy重试
+        """
+
+        async def send() -> str:
+            async with self._request("POST", url, json=data) as resp:
+                raise_for_retryable_status(resp)
+                dic = await self._read_json(resp)
+                if dic["BaseResponse"]["Ret"] != 0:
+                    raise VOperationFailedError(error_msg, dic["BaseResponse"]["Ret"])
+            if dic.get("MsgID"):
+                self.local_ids.bind(msg_id, dic["MsgID"])
+            return msg_id
+
+        # 每次重试都重新排队，重试同样受限速约束；data中的ClientMsgId保持不变，服务器据此去重
+        return await self.send_retry_policy.run(
+            lambda: self.send_scheduler.submit(send, to_username, endpoint, priority),
+            self.retry_budget,
+        )
 
     async def revoke(self, msg_id: str, to_username: str, local_id=None) -> None:
+        """
+        msg_id可以是服务器的MsgID，也可以是发送消息时返回的LocalID
+        """
         assert self.login_info.url is not None
         url = self.login_info.url + "/webwxrevokemsg"
+        svr_msg_id = self.local_ids.lookup(msg_id)
+        if svr_msg_id is not None:
+            local_id = local_id or msg_id
+            msg_id = svr_msg_id
         data = {
             "BaseRequest": self.login_info.base_request,
-            "ClientMsgId": local_id or str(time.time() * 1e3),
+            "ClientMsgId": local_id or self.local_ids.next(),
             "SvrMsgId": msg_id,
             "ToUserName": to_username,
         }
-        async with self.session.post(url, json=data) as resp:
-            dic = await resp.json(content_type=None)
+        async with self._request("POST", url, json=data) as resp:
+            dic = await self._read_json(resp)
         if dic["BaseResponse"]["Ret"] != 0:
             raise VOperationFailedError("撤回消息失败")
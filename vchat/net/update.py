@@ -1,4 +1,3 @@
-import random
 import re
 import time
 from abc import ABC
@@ -6,9 +5,6 @@ from collections.abc import Callable, Iterable
 from typing import Optional, Literal
 import json
 
-from aiohttp import ClientError
-
-from vchat import config
 from vchat.config import logger
 from vchat.errors import VNetworkError, VOperationFailedError
 from vchat.model import Contact, RawMessage
@@ -24,21 +20,19 @@ class NetHelperUpdateMixin(NetHelperInterface, ABC):
         params = {"r": int(time.time()), "seq": seq, "skey": self.login_info.skey}
 
         try:
-            resp = await self.session.get(url, params=params)
-        except ClientError:
+            async with self._request("GET", url, params=params) as resp:
+                data = await self._read_json(resp)
+        except VNetworkError:
             logger.info(
                 "Failed to fetch contact, that may because of the amount of your chatrooms"
             )
             callback()
             return 0, []
-        else:
-            data = await resp.json(content_type=None)
-            resp.close()
-            member_list = data.get("MemberList", [])
+        member_list = data.get("MemberList", [])
 
-            return data.get("Seq", 0), (
-                Contact.constructor(contact) for contact in member_list
-            )
+        return data.get("Seq", 0), (
+            Contact.constructor(contact) for contact in member_list
+        )
 
     async def sync_check(self) -> Optional[str]:
         assert self.login_info.sync_url is not None
@@ -54,18 +48,23 @@ class NetHelperUpdateMixin(NetHelperInterface, ABC):
             "_": self.login_info.login_time,
         }
         self.login_info.login_time += 1
-        async with self.session.get(url, params=params, timeout=config.TIMEOUT) as resp:
+        async with self._request(
+            "GET", url, session=self.sync_session, params=params
+        ) as resp:
             text = await resp.text()
             regx = r'window.synccheck={retcode:"(\d+)",selector:"(\d+)"}'
             pm = re.search(regx, text)
             if pm is None:
                 raise VNetworkError("Unexpected sync check result: %s" % text)
+            if pm.group(1) != "0":  # 1100、1101等表示登录已经失效
+                logger.warning("sync check failed, retcode: %s", pm.group(1))
+                return None
             return pm.group(2)
 
     @catch_exception
     async def get_msg(self) -> tuple[Iterable[RawMessage], Iterable[Contact]]:
         assert self.login_info.url is not None
-        self.login_info.deviceid = "e" + str(random.random())[2:17]
+        self.login_info.deviceid = self.device_id
         url = self.login_info.url + "/webwxsync"
         params = {
             "sid": self.login_info.wxsid,
@@ -77,10 +76,10 @@ class NetHelperUpdateMixin(NetHelperInterface, ABC):
             "SyncKey": self.login_info.SyncKey,
             "rr": ~int(time.time()),
         }
-        async with self.session.post(
-            url, params=params, json=data, timeout=config.TIMEOUT
+        async with self._request(
+            "POST", url, session=self.sync_session, params=params, json=data
         ) as resp:
-            dic = await resp.json(content_type=None)
+            dic = await self._read_json(resp)
             if dic["BaseResponse"]["Ret"] != 0:
                 logger.warning(
                     "sync message failed, server return: %s", json.dumps(dic)
@@ -0,0 +1,92 @@
+import os
+from abc import ABC, abstractmethod
+from typing import BinaryIO
+
+from aiohttp import ClientResponse
+
+from vchat import config, fileio
+
+
+class MediaWriter(ABC):
+    """
+    下载的数据写入的目标
+    """
+
+    @abstractmethod
+    async def write(self, chunk: bytes) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
+
+
+class BufferWriter(MediaWriter):
+    """
+    写入内存，保存收到的每一块，getvalue()时一次拼接为不可变的bytes
+    整个下载只在拼接时复制一次，没有BytesIO扩容时的复制
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    async def write(self, chunk: bytes) -> None:
+        self._chunks.append(bytes(chunk))  # 已经是bytes时不复制
+
+    def getvalue(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = [data]
+        return data
+
+
+class FileWriter(MediaWriter):
+    """
+    写入文件对象或者文件描述符，写入操作在线程池中执行，不阻塞事件循环
+    """
+
+    def __init__(self, fd: BinaryIO | int) -> None:
+        if isinstance(fd, int):
+            self._writer = fileio.AsyncFileWriter(_RawFd(fd))
+        else:
+            self._writer = fileio.AsyncFileWriter(fd)
+
+    async def write(self, chunk: bytes) -> None:
+        await self._writer.write(chunk)
+
+    async def flush(self) -> None:
+        await self._writer.flush()
+
+
+class _RawFd:
+    def __init__(self, fd: int) -> None:
+        self._fd = fd
+
+    def write(self, data: bytes) -> int:
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+        return len(data)
+
+
+def content_length(resp: ClientResponse) -> int | None:
+    if resp.content_length is not None and resp.content_length > 0:
+        return resp.content_length
+    return None
+
+
+async def stream_response(
+    resp: ClientResponse,
+    writer: MediaWriter,
+    chunk_size: int | None = None,
+) -> int:
+    """
+    将响应体写入writer，返回写入的字节数
+    """
+    size = 0
+    async for chunk in resp.content.iter_chunked(
+        chunk_size or config.DOWNLOAD_CHUNK_SIZE
+    ):
+        await writer.write(chunk)
+        size += len(chunk)
+    await writer.flush()
+    return size
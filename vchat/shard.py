@@ -0,0 +1,506 @@
+import asyncio
+import hmac
+import inspect
+import itertools
+import multiprocessing
+import os
+import pickle
+import secrets
+from dataclasses import dataclass, field
+from multiprocessing.process import BaseProcess
+from pathlib import Path
+from typing import Any
+
+from vchat import config
+from vchat.accounts import AccountManager, SetupFn
+from vchat.config import logger
+from vchat.core import Core
+from vchat.errors import (
+    VMalformedParameterError,
+    VNetworkError,
+    VOperationFailedError,
+)
+from vchat.loop import run as run_loop
+from vchat.model import ContactTypes, ContentTypes, Message
+from vchat.net.retry import RetryPolicy
+from vchat.utils import apply_config_settings, config_settings
+
+
+@dataclass
+class AccountSpec:
+    """
+    发送给工作进程的账号配置，setup和login_options中的回调函数需要可以pickle，即模块级别的函数
+    """
+
+    name: str
+    setup: SetupFn | None = None
+    device_id: str | None = None
+    login_options: dict[str, Any] = field(default_factory=dict)
+
+
+class _Channel:
+    """
+    主进程和工作进程之间的连接，每一帧是4字节长度加上pickle序列化的dict
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._lock = asyncio.Lock()
+
+    async def send(self, frame: dict) -> None:
+        data = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL)
+        async with self._lock:
+            self._writer.write(len(data).to_bytes(4, "big") + data)
+            await self._writer.drain()
+
+    async def recv(self) -> dict | None:
+        """
+        连接关闭时返回None
+        """
+        try:
+            header = await self._reader.readexactly(4)
+            data = await self._reader.readexactly(int.from_bytes(header, "big"))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return pickle.loads(data)
+
+    async def close(self) -> None:
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class _Worker:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process: BaseProcess | None = None
+        self.channel: _Channel | None = None
+        self.accounts: set[str] = set()
+        self.ready = asyncio.Event()  # 工作进程已经连接，可以分配账号
+        self.failures = 0  # 连续启动失败的次数，连接成功后清零
+        self.pending: dict[int, asyncio.Future] = {}
+
+
+class ShardSupervisor:
+    """
+    把账号分配到多个工作进程，每个工作进程有自己的事件循环，用AccountManager运行分到的账号
+    1. 新账号分配给账号最少的工作进程
+    2. 主进程通过call（或者send_msg、send_file）让任意账号执行config.SHARD_COMMANDS中的操作
+    3. 所有账号收到的消息以{"type": "message", "account": 账号, "message": Message.todict()}
+       的形式放入self.events
+    4. 工作进程退出后它的账号立刻分配给其他工作进程，重启的工作进程连接后重新均衡各进程的账号数，
+       账号迁移后通过热重载恢复登录
+    工作进程使用spawn方式启动，启动时复制主进程中config的设置
+        supervisor = ShardSupervisor(workers=4)
+        for name in names:
+            await supervisor.add_account(name, setup=register_handlers)
+        await supervisor.start()
+        await supervisor.send_msg("alice", "hello", "filehelper")
+        event = await supervisor.events.get()
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        host: str | None = None,
+        restart_policy: RetryPolicy | None = None,
+    ) -> None:
+        self.host = host or config.SHARD_HOST
+        self.events: asyncio.Queue[dict] = asyncio.Queue(config.SHARD_EVENT_QUEUE_SIZE)
+        self.specs: dict[str, AccountSpec] = {}
+        # 账号 -> 运行它的工作进程的序号
+        self.assignments: dict[str, int] = {}
+        self.restart_policy = restart_policy or RetryPolicy(
+            base_delay=config.SHARD_RESTART_BASE_DELAY,
+            max_delay=config.SHARD_RESTART_MAX_DELAY,
+        )
+        workers = workers or config.SHARD_WORKERS or os.cpu_count() or 1
+        self._workers = [_Worker(i) for i in range(workers)]
+        self._token = secrets.token_bytes(32)
+        self._server: asyncio.AbstractServer | None = None
+        self._port = 0
+        self._request_ids = itertools.count()
+        self._tasks: set[asyncio.Task] = set()
+        self._rebalance_lock = asyncio.Lock()
+        self._started = False
+        self._stopping = False
+        self._stopped = asyncio.Event()
+
+    async def add_account(
+        self,
+        name: str,
+        setup: SetupFn | None = None,
+        device_id: str | None = None,
+        **login_options,
+    ) -> None:
+        """
+        参数和AccountManager.add_account相同，已经启动时立刻分配给一个工作进程
+        """
+        if name in self.specs:
+            raise VMalformedParameterError(f"账号{name}已经存在")
+        spec = AccountSpec(name, setup, device_id, login_options)
+        try:
+            pickle.dumps(spec)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise VMalformedParameterError(
+                f"账号{name}的配置无法发送给工作进程，回调函数需要是模块级别的函数: {e}"
+            ) from e
+        self.specs[name] = spec
+        if self._started:
+            await self._place(name)
+
+    async def remove_account(self, name: str) -> None:
+        self.specs.pop(name, None)
+        index = self.assignments.pop(name, None)
+        if index is None:
+            return
+        worker = self._workers[index]
+        worker.accounts.discard(name)
+        if worker.ready.is_set():
+            await self._request(worker, {"op": "remove_account", "account": name})
+
+    async def start(self) -> None:
+        if self._started:
+            return
+        self._server = await asyncio.start_server(self._on_connect, self.host, 0)
+        self._port = self._server.sockets[0].getsockname()[1]
+        for worker in self._workers:
+            self._spawn(worker)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(w.ready.wait() for w in self._workers)),
+                config.SHARD_WORKER_START_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            ready = sum(w.ready.is_set() for w in self._workers)
+            logger.warning(f"only {ready}/{len(self._workers)} workers started")
+        self._started = True
+        await self._place_unassigned()
+
+    async def run(self) -> None:
+        """
+        启动后一直运行，直到调用stop或者被取消
+        """
+        await self.start()
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        if self._stopping:
+            return
+        self._stopping = True
+        for task in list(self._tasks):
+            task.cancel()
+        # 关闭连接后工作进程停止所有账号并退出
+        for worker in self._workers:
+            if worker.channel is not None:
+                await worker.channel.close()
+        for worker in self._workers:
+            process = worker.process
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, config.SHARD_WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                await asyncio.to_thread(process.join)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._stopped.set()
+
+    async def call(self, account: str, command: str, *args, **kwargs) -> Any:
+        """
+        让账号执行Core的方法command，参数和返回值需要可以pickle，例如send_file需要使用file_path而不是fd
+        """
+        if command not in config.SHARD_COMMANDS:
+            raise VMalformedParameterError(f"不支持的操作: {command}")
+        index = self.assignments.get(account)
+        if index is None:
+            raise VOperationFailedError(f"账号{account}没有运行")
+        return await self._request(
+            self._workers[index],
+            {
+                "op": "call",
+                "account": account,
+                "command": command,
+                "args": args,
+                "kwargs": kwargs,
+            },
+        )
+
+    async def send_msg(self, account: str, msg: str, to_username: str) -> str:
+        return await self.call(account, "send_msg", msg, to_username)
+
+    async def send_file(
+        self, account: str, to_username: str, file_path: Path, **kwargs
+    ) -> tuple[str, str, int]:
+        """
+        返回(msg_id, media_id, file_size)，和Core.send_file相同
+        """
+        return await self.call(account, "send_file", to_username, file_path, **kwargs)
+
+    async def rebalance(self) -> None:
+        """
+        把账号从账号最多的工作进程迁移到最少的工作进程，直到各进程的账号数最多相差1
+        """
+        async with self._rebalance_lock:
+            while True:
+                live = [w for w in self._workers if w.ready.is_set()]
+                if len(live) < 2:
+                    return
+                busiest = max(live, key=lambda w: len(w.accounts))
+                idlest = min(live, key=lambda w: len(w.accounts))
+                if len(busiest.accounts) - len(idlest.accounts) <= 1:
+                    return
+                name = sorted(busiest.accounts)[-1]
+                logger.info(
+                    f"move account {name} from worker {busiest.index} to {idlest.index}"
+                )
+                busiest.accounts.discard(name)
+                self.assignments.pop(name, None)
+                try:
+                    await self._request(
+                        busiest, {"op": "remove_account", "account": name}
+                    )
+                except VNetworkError:
+                    pass  # 工作进程刚好退出，账号已经停止
+                await self._assign(name, idlest)
+
+    def _spawn(self, worker: _Worker) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        process = ctx.Process(
+            target=_worker_entry,
+            args=(self.host, self._port, self._token, worker.index, config_settings()),
+            name=f"vchat-shard-{worker.index}",
+            daemon=True,
+        )
+        process.start()
+        worker.process = process
+        self._create_task(self._monitor(worker, process))
+
+    async def _monitor(self, worker: _Worker, process: BaseProcess) -> None:
+        await asyncio.to_thread(process.join)
+        if self._stopping or worker.process is not process:
+            return
+        logger.warning(
+            f"worker {worker.index} exited with code {process.exitcode}, "
+            f"reassign {len(worker.accounts)} accounts"
+        )
+        worker.ready.clear()
+        worker.process = None
+        if worker.channel is not None:
+            await worker.channel.close()
+            worker.channel = None
+        self._fail_pending(worker)
+        orphans, worker.accounts = worker.accounts, set()
+        for name in orphans:
+            self.assignments.pop(name, None)
+        await self._place_unassigned()
+
+        worker.failures += 1
+        delay = self.restart_policy.backoff(worker.failures)
+        logger.info(f"restart worker {worker.index} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        self._spawn(worker)
+
+    async def _on_connect(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        channel = _Channel(reader, writer)
+        try:
+            token = await asyncio.wait_for(reader.readexactly(len(self._token)), 10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            await channel.close()
+            return
+        # 校验令牌之后才反序列化对方发送的数据
+        if not hmac.compare_digest(token, self._token):
+            logger.warning("reject connection with invalid token")
+            await channel.close()
+            return
+        hello = await channel.recv()
+        if hello is None or hello.get("type") != "hello":
+            await channel.close()
+            return
+        worker = self._workers[hello["worker"]]
+        worker.channel = channel
+        worker.failures = 0
+        worker.ready.set()
+        logger.info(f"worker {worker.index} connected")
+        if self._started:
+            self._create_task(self._on_worker_restarted())
+        while (frame := await channel.recv()) is not None:
+            self._dispatch(worker, frame)
+        if worker.channel is channel:
+            worker.channel = None
+            worker.ready.clear()
+            self._fail_pending(worker)
+            # 连接断开但进程还在，结束进程，由_monitor重新分配账号并重启
+            if not self._stopping and worker.process is not None:
+                worker.process.terminate()
+
+    async def _on_worker_restarted(self) -> None:
+        await self._place_unassigned()
+        await self.rebalance()
+
+    def _dispatch(self, worker: _Worker, frame: dict) -> None:
+        if frame["type"] == "result":
+            future = worker.pending.pop(frame["id"], None)
+            if future is None or future.done():
+                return
+            if "error" in frame:
+                future.set_exception(frame["error"])
+            else:
+                future.set_result(frame["result"])
+        elif frame["type"] == "message":
+            try:
+                self.events.put_nowait(
+                    {
+                        "type": "message",
+                        "account": frame["account"],
+                        "message": frame["message"],
+                    }
+                )
+            except asyncio.QueueFull:
+                logger.warning(
+                    f"event queue is full, drop message of {frame['account']}"
+                )
+
+    async def _request(self, worker: _Worker, frame: dict) -> Any:
+        if worker.channel is None:
+            raise VNetworkError(f"worker {worker.index} is not running")
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        try:
+            await worker.channel.send({"type": "request", "id": request_id, **frame})
+            return await future
+        finally:
+            worker.pending.pop(request_id, None)
+
+    def _fail_pending(self, worker: _Worker) -> None:
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(
+                    VNetworkError(f"worker {worker.index} exited before replying")
+                )
+        worker.pending.clear()
+
+    async def _place_unassigned(self) -> None:
+        for name in list(self.specs):
+            if name not in self.assignments:
+                await self._place(name)
+
+    async def _place(self, name: str) -> None:
+        live = [w for w in self._workers if w.ready.is_set()]
+        if not live:
+            logger.warning(f"no worker is running, account {name} is not started")
+            return
+        await self._assign(name, min(live, key=lambda w: len(w.accounts)))
+
+    async def _assign(self, name: str, worker: _Worker) -> None:
+        spec = self.specs.get(name)
+        if spec is None:
+            return
+        worker.accounts.add(name)
+        self.assignments[name] = worker.index
+        try:
+            await self._request(worker, {"op": "add_account", "spec": spec})
+        except VNetworkError as e:
+            # 工作进程刚好退出，_monitor会重新分配它的账号
+            logger.warning(f"failed to assign account {name}: {e}")
+
+    def _create_task(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def _worker_entry(
+    host: str, port: int, token: bytes, index: int, settings: dict[str, Any]
+) -> None:
+    apply_config_settings(settings)
+    run_loop(_worker_main(host, port, token, index))
+
+
+async def _worker_main(host: str, port: int, token: bytes, index: int) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(token)
+    channel = _Channel(reader, writer)
+    await channel.send({"type": "hello", "worker": index})
+    manager = AccountManager()
+    await manager.start()
+    tasks: set[asyncio.Task] = set()
+    try:
+        while (frame := await channel.recv()) is not None:
+            if frame["op"] == "add_account":
+                # 同步处理，保证之后对这个账号的请求能找到它
+                spec: AccountSpec = frame["spec"]
+                manager.add_account(
+                    spec.name,
+                    _forwarding_setup(spec.name, spec.setup, channel),
+                    spec.device_id,
+                    **spec.login_options,
+                )
+                await channel.send(
+                    {"type": "result", "id": frame["id"], "result": None}
+                )
+                continue
+            task = asyncio.create_task(_handle_request(manager, channel, frame))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await manager.stop()
+        await channel.close()
+
+
+async def _handle_request(
+    manager: AccountManager, channel: _Channel, frame: dict
+) -> None:
+    try:
+        if frame["op"] == "remove_account":
+            result = await manager.remove_account(frame["account"])
+        else:
+            core = manager.core(frame["account"])
+            if core is None or not core.alive:
+                raise VOperationFailedError(f"账号{frame['account']}没有运行")
+            fn = getattr(core, frame["command"])
+            result = await fn(*frame["args"], **frame["kwargs"])
+    except Exception as e:
+        await channel.send({"type": "result", "id": frame["id"], "error": _portable(e)})
+    else:
+        await channel.send({"type": "result", "id": frame["id"], "result": result})
+
+
+def _portable(e: Exception) -> Exception:
+    # 无法pickle的异常转换为VOperationFailedError，只保留描述
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return VOperationFailedError(repr(e))
+
+
+def _forwarding_setup(name: str, setup: SetupFn | None, channel: _Channel) -> SetupFn:
+    async def wrapper(core: Core) -> None:
+        async def forward(msg: Message) -> None:
+            await channel.send(
+                {"type": "message", "account": name, "message": msg.todict()}
+            )
+
+        core.msg_register(ContentTypes.ALL, ContactTypes.ALL)(forward)
+        if setup is not None:
+            result = setup(core)
+            if inspect.isawaitable(result):
+                await result
+
+    return wrapper
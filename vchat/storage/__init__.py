@@ -3,6 +3,8 @@ from queue import Queue
 from typing import Optional, TYPE_CHECKING
 
 from vchat.model import User, Chatroom, MassivePlatform
+from vchat.storage.avatar_cache import AvatarCache, create_avatar_cache
+from vchat.storage.media_cache import MediaCache
 
 if TYPE_CHECKING:
     from vchat.model import Message
@@ -17,6 +19,8 @@ class Storage:
         self.chatrooms: dict[str, Chatroom] = {}
         self.msgs: asyncio.Queue[Message] = asyncio.Queue()
         self.las_input_username = None
+        self.media_cache = MediaCache()
+        self.avatar_cache: AvatarCache = create_avatar_cache()
 
     def dumps(self):
         return {
@@ -43,4 +47,6 @@ class Storage:
         self.mps.clear()
         self.chatrooms.clear()
         self.las_input_username = None
+        self.media_cache.clear()
+        self.avatar_cache.clear()
         self.msgs = Queue(-1)
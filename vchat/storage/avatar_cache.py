@@ -0,0 +1,89 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from vchat import config, fileio
+from vchat.storage.disk_cache import DiskCache
+
+# (头像类型, 群username, username)，好友头像和同一个人在群中的头像是不同的条目
+AvatarKey = tuple[str, str, str]
+
+
+class AvatarCache:
+    """
+    头像缓存，以AvatarKey和HeadImgUrl为键，HeadImgUrl改变说明头像已经更新，旧的缓存失效
+    内存中保存最近使用的max_size个头像，设置了disk时同时保存在磁盘上，重新登录后仍然有效
+    HeadImgUrl未知（通常是群成员）时无法判断头像是否更新，只在内存中保存unknown_url_ttl秒
+    """
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        disk: DiskCache | None = None,
+        unknown_url_ttl: float | None = None,
+    ) -> None:
+        if max_size is None:
+            max_size = config.AVATAR_CACHE_MAX_SIZE
+        if unknown_url_ttl is None:
+            unknown_url_ttl = config.AVATAR_CACHE_UNKNOWN_URL_TTL
+        self.max_size = max_size
+        self.disk = disk
+        self.unknown_url_ttl = unknown_url_ttl
+        # key -> (HeadImgUrl, 头像数据, 过期时间)，过期时间为None表示不会过期
+        self._entries: OrderedDict[AvatarKey, tuple[str, bytes, float | None]] = (
+            OrderedDict()
+        )
+
+    async def get(self, key: AvatarKey, head_img_url: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            url, data, expire_at = entry
+            if url == head_img_url and (
+                expire_at is None or expire_at > time.monotonic()
+            ):
+                self._entries.move_to_end(key)
+                return data
+            del self._entries[key]
+        if self.disk is None or not head_img_url:
+            return None
+        data = await fileio.run_io(self.disk.get, self._disk_key(key, head_img_url))
+        if data is not None:
+            self._remember(key, head_img_url, data)
+        return data
+
+    async def put(self, key: AvatarKey, head_img_url: str, data: bytes) -> None:
+        self._remember(key, head_img_url, data)
+        if self.disk is not None and head_img_url:
+            await fileio.run_io(self.disk.put, self._disk_key(key, head_img_url), data)
+
+    def invalidate(self, key: AvatarKey) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        只清空内存中的缓存，磁盘上的缓存在重新登录后仍然可用
+        """
+        self._entries.clear()
+
+    def _remember(self, key: AvatarKey, head_img_url: str, data: bytes) -> None:
+        expire_at = None
+        if not head_img_url:
+            expire_at = time.monotonic() + self.unknown_url_ttl
+        self._entries[key] = (head_img_url, data, expire_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _disk_key(key: AvatarKey, head_img_url: str) -> str:
+        url_hash = hashlib.sha1(head_img_url.encode()).hexdigest()
+        return f"avatar:{':'.join(key)}:{url_hash}"
+
+
+def create_avatar_cache() -> AvatarCache:
+    disk = None
+    if config.AVATAR_CACHE_DIR is not None:
+        disk = DiskCache(config.AVATAR_CACHE_DIR, config.AVATAR_CACHE_MAX_BYTES)
+    return AvatarCache(
+        config.AVATAR_CACHE_MAX_SIZE, disk, config.AVATAR_CACHE_UNKNOWN_URL_TTL
+    )
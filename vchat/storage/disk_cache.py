@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from vchat.config import logger
+
+
+class DiskCache:
+    """
+    基于内容寻址的磁盘缓存，文件以内容的sha256命名，内容相同的文件只保存一份
+    总大小超过max_bytes时淘汰最久未使用的文件
+    所有方法都会读写磁盘，在事件循环中应该通过vchat.fileio.run_io调用
+    目录结构：
+        objects/<sha256>    缓存的文件
+        index.json          key到sha256的映射，以及使用顺序
+    """
+
+    def __init__(self, path: Path | str, max_bytes: int) -> None:
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._objects_path = self.path / "objects"
+        self._index_path = self.path / "index.json"
+        self._lock = threading.Lock()
+        self._keys: dict[str, str] = {}
+        # sha256 -> 文件大小，按使用顺序排列，最久未使用的在最前
+        self._objects: OrderedDict[str, int] = OrderedDict()
+        self._objects_path.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    @property
+    def size(self) -> int:
+        return sum(self._objects.values())
+
+    def get_path(self, key: str) -> Path | None:
+        with self._lock:
+            digest = self._keys.get(key)
+            if digest is None:
+                return None
+            path = self._objects_path / digest
+            if not path.exists():  # 被外部删除
+                self._remove_object(digest)
+                return None
+            self._objects.move_to_end(digest)
+            return path
+
+    def get(self, key: str) -> bytes | None:
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes | bytearray) -> Path:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._objects_path / digest
+        if not path.exists():
+            with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+        return self._commit(key, digest, len(data))
+
+    def put_file(self, key: str, src: Path | str) -> Path:
+        sha256 = hashlib.sha256()
+        with open(src, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        path = self._objects_path / digest
+        if not path.exists():
+            with (
+                open(src, "rb") as fsrc,
+                tempfile.NamedTemporaryFile(dir=self.path, delete=False) as fdst,
+            ):
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            os.replace(fdst.name, path)
+        return self._commit(key, digest, path.stat().st_size)
+
+    def clear(self) -> None:
+        with self._lock:
+            for digest in list(self._objects):
+                self._remove_object(digest)
+            self._save_index()
+
+    def _commit(self, key: str, digest: str, size: int) -> Path:
+        with self._lock:
+            self._keys[key] = digest
+            self._objects[digest] = size
+            self._objects.move_to_end(digest)
+            while self.size > self.max_bytes and len(self._objects) > 1:
+                oldest = next(iter(self._objects))
+                self._remove_object(oldest)
+            self._save_index()
+        return self._objects_path / digest
+
+    def _remove_object(self, digest: str) -> None:
+        self._objects.pop(digest, None)
+        for key in [k for k, d in self._keys.items() if d == digest]:
+            del self._keys[key]
+        try:
+            (self._objects_path / digest).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self) -> None:
+        try:
+            index = json.loads(self._index_path.read_text())
+        except (OSError, ValueError):
+            return
+        for digest in index.get("objects", []):
+            path = self._objects_path / digest
+            if path.exists():
+                self._objects[digest] = path.stat().st_size
+        self._keys = {
+            key: digest
+            for key, digest in index.get("keys", {}).items()
+            if digest in self._objects
+        }
+        logger.debug("loaded %d cached files from %s", len(self._objects), self.path)
+
+    def _save_index(self) -> None:
+        index = {"keys": self._keys, "objects": list(self._objects)}
+        tmp = self._index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index))
+        os.replace(tmp, self._index_path)
@@ -0,0 +1,72 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import BinaryIO
+
+from vchat import config
+from vchat.model import MediaTypes
+
+
+class MediaCache:
+    """
+    已上传文件的media_id缓存，以文件的md5、大小和媒体类型为键
+    相同的文件发送给多个联系人时，只需要上传一次
+    服务器的media_id会过期，所以每个条目都有有效期，超过max_size时淘汰最久未使用的条目
+    """
+
+    def __init__(
+        self,
+        ttl: float | None = None,
+        max_size: int | None = None,
+    ) -> None:
+        # 默认值在创建时从config读取，运行时修改config同样生效
+        self.ttl = ttl if ttl is not None else config.MEDIA_CACHE_TTL
+        self.max_size = (
+            max_size if max_size is not None else config.MEDIA_CACHE_MAX_SIZE
+        )
+        self._entries: OrderedDict[tuple[str, int, MediaTypes], tuple[str, float]] = (
+            OrderedDict()
+        )
+
+    @staticmethod
+    def digest(fd: BinaryIO, chunk_size: int = 512 * 1024) -> tuple[str, int]:
+        """
+        计算fd从当前位置开始的内容的md5和大小，计算完成后fd回到原来的位置
+        """
+        start = fd.tell()
+        md5 = hashlib.md5()
+        size = 0
+        while chunk := fd.read(chunk_size):
+            md5.update(chunk)
+            size += len(chunk)
+        fd.seek(start)
+        return md5.hexdigest(), size
+
+    def get(self, file_md5: str, file_size: int, media_type: MediaTypes) -> str | None:
+        key = (file_md5, file_size, media_type)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        media_id, expire_at = entry
+        if expire_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return media_id
+
+    def put(
+        self, file_md5: str, file_size: int, media_type: MediaTypes, media_id: str
+    ) -> None:
+        key = (file_md5, file_size, media_type)
+        self._entries[key] = (media_id, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, media_id: str) -> None:
+        for key, (cached_media_id, _) in list(self._entries.items()):
+            if cached_media_id == media_id:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -0,0 +1,27 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class UploadSession:
+    """
+    一次分块上传的状态，记录ClientMediaId、分块数和服务器已经确认的分块
+    上传中断后，再次上传同一个文件会复用这个状态，从第一个未确认的分块继续
+    同时上传同一个文件的调用者共享这个状态，通过lock依次上传，后来者直接使用已经上传的结果
+    """
+
+    client_media_id: int
+    file_md5: str
+    file_size: int
+    chunks: int
+    acked: set[int] = field(default_factory=set)
+    media_id: str | None = None
+    created_at: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False, compare=False)
+
+    def missing_chunks(self) -> list[int]:
+        return [chunk for chunk in range(self.chunks) if chunk not in self.acked]
+
+    def expired(self, ttl: float) -> bool:
+        return self.created_at + ttl < time.monotonic()
@@ -3,7 +3,9 @@ import os
 import re
 import subprocess
 import sys
-from collections.abc import Iterable
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 from typing import Any
 
 from vchat import config
@@ -145,3 +147,40 @@ def batch(data: Iterable[Any], n: int = 1):
     if len(ret_val) != 0:
         yield ret_val
     return
+
+
+class StageTimer:
+    """
+    记录启动过程中各个阶段的耗时（秒），并发执行的阶段各自计时
+    """
+
+    def __init__(self) -> None:
+        self.timings: dict[str, float] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def report(self) -> str:
+        stages = ", ".join(f"{name}={t:.2f}s" for name, t in self.timings.items())
+        return f"{stages}, total={self.elapsed():.2f}s"
+
+
+def config_settings() -> dict[str, Any]:
+    """
+    config中的所有设置，spawn方式启动的子进程重新导入config，需要用apply_config_settings恢复主进程修改过的设置
+    """
+    return {key: value for key, value in vars(config).items() if key.isupper()}
+
+
+def apply_config_settings(settings: dict[str, Any]) -> None:
+    for key, value in settings.items():
+        setattr(config, key, value)